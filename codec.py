@@ -0,0 +1,175 @@
+import typing
+
+from ujson import loads as json_loads
+
+from panic import \
+    datatypes as panic_datatypes, \
+    response as panic_response
+from panic.response import \
+    serializers as response_serializers
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+try:
+  import cbor2
+except ImportError:
+  cbor2 = None
+
+try:
+  import pyarrow
+except ImportError:
+  pyarrow = None
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+Buffer = typing.Union[bytes, bytearray, memoryview]
+
+class Codec:
+  """
+  Turns the objects a channel handler sends into websocket payloads and received payloads back
+  into objects. `encode` returns the payload and whether it goes out as a text frame.
+  """
+  media_type: str = None
+  aliases: typing.Tuple[str, ...] = ()
+  requires: typing.Tuple[str, typing.Any] = None
+
+  def __init__(self, **parameters: str) -> None:
+    if self.requires is not None and self.requires[1] is None:
+      raise ValueError(f'socket_encoding[{self.media_type}] requires {self.requires[0]} to be installed')
+
+  def encode(self, datum: typing.Any) -> typing.Tuple[Buffer, bool]:
+    raise NotImplementedError
+
+  def decode(self, data: typing.Union[str, bytes]) -> typing.Any:
+    raise NotImplementedError
+
+  def __repr__(self) -> str:
+    return f'Codec[{self.media_type}]'
+
+class OctetStreamCodec(Codec):
+  """
+  Passes bytes and str through, anything else is sent as JSON text
+  """
+  media_type = 'application/octet-stream'
+
+  def encode(self, datum: typing.Any) -> typing.Tuple[Buffer, bool]:
+    if isinstance(datum, str):
+      return datum.encode('utf-8'), True
+
+    if isinstance(datum, (bytes, bytearray, memoryview)):
+      return datum, False
+
+    return panic_response.json_dumps(datum), True
+
+  def decode(self, data: typing.Union[str, bytes]) -> typing.Any:
+    return data
+
+class JSONCodec(Codec):
+  media_type = 'application/json'
+
+  def encode(self, datum: typing.Any) -> typing.Tuple[Buffer, bool]:
+    return panic_response.json_dumps(datum), True
+
+  def decode(self, data: typing.Union[str, bytes]) -> typing.Any:
+    return json_loads(data)
+
+class MsgpackCodec(Codec):
+  media_type = 'application/msgpack'
+  aliases = ('application/x-msgpack',)
+  requires = ('msgpack', msgpack)
+
+  def encode(self, datum: typing.Any) -> typing.Tuple[Buffer, bool]:
+    return msgpack.packb(datum, default=response_serializers.default, use_bin_type=True), False
+
+  def decode(self, data: typing.Union[str, bytes]) -> typing.Any:
+    return msgpack.unpackb(data, raw=False)
+
+class CBORCodec(Codec):
+  media_type = 'application/cbor'
+  requires = ('cbor2', cbor2)
+
+  def encode(self, datum: typing.Any) -> typing.Tuple[Buffer, bool]:
+    return cbor2.dumps(datum, default=lambda encoder, value: encoder.encode(response_serializers.default(value))), False
+
+  def decode(self, data: typing.Union[str, bytes]) -> typing.Any:
+    return cbor2.loads(data)
+
+class ArrowCodec(Codec):
+  """
+  Record batches and tables as Arrow IPC streams, received streams are read into a Table
+  """
+  media_type = 'application/vnd.apache.arrow.stream'
+  requires = ('pyarrow', pyarrow)
+
+  def encode(self, datum: typing.Any) -> typing.Tuple[Buffer, bool]:
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, datum.schema) as writer:
+      writer.write(datum)
+
+    # The IPC buffer is handed to the transport as is
+    return memoryview(sink.getvalue()), False
+
+  def decode(self, data: typing.Union[str, bytes]) -> typing.Any:
+    return pyarrow.ipc.open_stream(data).read_all()
+
+class NumPyCodec(Codec):
+  """
+  An array's raw memory, `application/x-numpy; dtype=float64`. Contiguous arrays are sent without
+  copying, received buffers become read-only arrays of `dtype` over the frame's bytes.
+  """
+  media_type = 'application/x-numpy'
+  requires = ('numpy', numpy)
+
+  def __init__(self, dtype: str = 'uint8', **parameters: str) -> None:
+    super().__init__(**parameters)
+    self.dtype = numpy.dtype(dtype)
+
+  def encode(self, datum: typing.Any) -> typing.Tuple[Buffer, bool]:
+    return memoryview(numpy.ascontiguousarray(datum)).cast('B'), False
+
+  def decode(self, data: typing.Union[str, bytes]) -> typing.Any:
+    return numpy.frombuffer(data, dtype=self.dtype)
+
+  def __repr__(self) -> str:
+    return f'Codec[{self.media_type}:{self.dtype}]'
+
+CODECS: typing.Dict[str, typing.Type[Codec]] = {}
+_instances: typing.Dict[str, Codec] = {}
+
+def register(codec: typing.Type[Codec]) -> typing.Type[Codec]:
+  """
+  Makes `codec` available as a socket_encoding, usable as a class decorator
+  """
+  for media_type in (codec.media_type, ) + codec.aliases:
+    CODECS[media_type] = codec
+
+  _instances.clear()
+  return codec
+
+for _codec in (OctetStreamCodec, JSONCodec, MsgpackCodec, CBORCodec, ArrowCodec, NumPyCodec):
+  register(_codec)
+
+def get(socket_encoding: str) -> Codec:
+  """
+  Codec for a socket_encoding, media type parameters are passed to the codec. Codecs are stateless,
+  routes with the same socket_encoding share one so broadcasts to them are encoded once.
+  """
+  try:
+    return _instances[socket_encoding]
+  except KeyError:
+    pass
+
+  media_type = panic_datatypes.parse_media_type(socket_encoding)
+  try:
+    codec = CODECS[media_type.type]
+  except KeyError:
+    raise ValueError(f'socket_encoding[{socket_encoding}] has no registered codec')
+
+  codec = _instances[socket_encoding] = codec(**media_type.parameters)
+  return codec
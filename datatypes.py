@@ -1,11 +1,13 @@
 import asyncio
-import cgi
 import enum
 import hashlib
 import logging
 import os
+import sys
 import typing
 
+from functools import lru_cache
+
 from panic import exceptions as panic_exceptions
 
 logger = logging.getLogger(__name__)
@@ -13,19 +15,77 @@ logger = logging.getLogger(__name__)
 ExceptionType = Exception
 FunctionType = (lambda: None).__class__
 PWN = typing.TypeVar('PWN')
+MEDIA_TYPE_CACHE_SIZE = 256
+
+class MediaType:
+  """
+  A parsed `type/subtype; name=value` header value. `type` is lowercased and interned, so it can be
+  compared with `is` against the MEDIA_* constants.
+  """
+  type: str
+  parameters: typing.Dict[str, str]
+  __slots__ = ('type', 'parameters')
+
+  def __init__(self, type: str, parameters: typing.Dict[str, str]) -> None:
+    self.type = sys.intern(type)
+    self.parameters = parameters
+
+  def __repr__(self):
+    return f'MediaType[{self.type}]'
+
+MEDIA_JSON = sys.intern('application/json')
+MEDIA_FORM_URLENCODED = sys.intern('application/x-www-form-urlencoded')
+MEDIA_MULTIPART = sys.intern('multipart/form-data')
+MEDIA_OCTET_STREAM = sys.intern('application/octet-stream')
+MEDIA_NDJSON = sys.intern('application/x-ndjson')
+MEDIA_JSON_LINES = sys.intern('application/jsonl')
+
+def _split_parameters(value: str) -> typing.Iterator[str]:
+  # Splits on `;` outside of quoted strings, the same as the cgi module did
+  while value[:1] == ';':
+    value = value[1:]
+    end = value.find(';')
+    while end > 0 and (value.count('"', 0, end) - value.count('\\"', 0, end)) % 2:
+      end = value.find(';', end + 1)
+
+    if end < 0:
+      end = len(value)
+
+    yield value[:end].strip()
+    value = value[end:]
+
+@lru_cache(maxsize=MEDIA_TYPE_CACHE_SIZE)
+def parse_media_type(value: str) -> MediaType:
+  """
+  Parses a Content-Type style header value, memoized per distinct value
+  """
+  parts = _split_parameters(';' + value)
+  media_type = next(parts).lower()
+  parameters = {}
+  for part in parts:
+    index = part.find('=')
+    if index >= 0:
+      name = part[:index].strip().lower()
+      datum = part[index + 1:].strip()
+      if len(datum) >= 2 and datum[0] == datum[-1] == '"':
+        datum = datum[1:-1].replace('\\\\', '\\').replace('\\"', '"')
+
+      parameters[name] = datum
+
+  return MediaType(media_type, parameters)
 
 class HTTPHeader:
   name: str
   value: str
-  _parameters: typing.Dict[str, typing.Any]
-  __slots__ = ('name', 'value', '_parameters')
+  _encoded: bytes
+  __slots__ = ('name', 'value', '_encoded')
 
   def __init__(self, name: str, value: str) -> None:
     self.name = name.lower() # axios
     self.value = value
 
   def __hash__(self):
-    return hash(self.value.split(';', 1)[0])
+    return hash(self.media_type)
 
   def __eq__(self, other: PWN) -> bool:
     return self.__hash__() == other.__hash__()
@@ -34,17 +94,27 @@ class HTTPHeader:
     return f'HTTPHeader[{self.name, self.value}]'
 
   def encode(self, encoding='utf-8') -> bytes:
-    return b':'.join([
-      self.name.encode(encoding),
-      self.value.encode(encoding)])
+    if encoding != 'utf-8':
+      return b':'.join([
+        self.name.encode(encoding),
+        self.value.encode(encoding)])
+
+    try:
+      return self._encoded
+    except AttributeError:
+      self._encoded = b':'.join([
+        self.name.encode(encoding),
+        self.value.encode(encoding)])
+
+    return self._encoded
 
   @property
-  def parameters(self) -> typing.Dict[str, typing.Any]:
-    if hasattr(self, '_parameters'):
-      return self._parameters
+  def media_type(self) -> str:
+    return parse_media_type(self.value).type
 
-    self._parameters = cgi.parse_header(self.value)[1]
-    return self._parameters
+  @property
+  def parameters(self) -> typing.Dict[str, typing.Any]:
+    return parse_media_type(self.value).parameters
 
 class HTTPMethod(enum.Enum):
   joint: str = 'joint'
@@ -52,14 +122,36 @@ class HTTPMethod(enum.Enum):
   post: str = 'post'
   put: str = 'put'
   channel: str = 'channel'
+  # https://tools.ietf.org/html/rfc7231#section-4.3 and https://tools.ietf.org/html/rfc5789
+  delete: str = 'delete'
+  patch: str = 'patch'
+  head: str = 'head'
+  options: str = 'options'
+  trace: str = 'trace'
+  connect: str = 'connect'
 
   @classmethod
   def Match(cls: type, name: str) -> PWN:
-    for item in cls:
-      if item.name.lower() == name.lower():
-        return item
+    try:
+      return HTTP_METHOD_NAMES[name.lower()]
+    except KeyError:
+      raise panic_exceptions.InvalidHTTPMethod(name)
 
-    raise panic_exceptions.InvalidHTTPMethod(name)
+  @classmethod
+  def Parse(cls: type, raw: bytes) -> PWN:
+    """
+    Resolves the method exactly as the parser hands it over, `b'GET'`, without decoding it
+    """
+    try:
+      return HTTP_METHOD_TOKENS[raw]
+    except KeyError:
+      return cls.Match(raw.decode('latin-1'))
+
+HTTP_METHOD_NAMES: typing.Dict[str, HTTPMethod] = {method.name: method for method in HTTPMethod}
+HTTP_METHOD_TOKENS: typing.Dict[bytes, HTTPMethod] = {method.name.upper().encode(): method for method in HTTPMethod}
+# Methods that are advertised in `Allow`, `joint` and `channel` aren't HTTP methods on the wire
+HTTP_ALLOWABLE: typing.Tuple[HTTPMethod, ...] = tuple(method for method in HTTPMethod
+    if method not in (HTTPMethod.joint, HTTPMethod.channel))
 
 class HTTPCookies:
   _cookies: typing.Dict
@@ -69,9 +161,14 @@ class HTTPCookies:
     self._cookies = {}
 
   def merge(self, datum: typing.Dict[str, str], as_defaults: bool = False) -> PWN:
-    logger.warn('NotImplemented')
+    if datum:
+      logger.warn('NotImplemented')
+
     return self
 
+# Shared by every HTTPHeaders until a real Content-Type is appended, HTTPHeader is never mutated in place
+DEFAULT_CONTENT_TYPE = HTTPHeader('Content-Type', 'text/plain')
+
 class HTTPHeaders:
   _headers: typing.Dict[str, HTTPHeader]
   __slots__ = ('_headers',)
@@ -80,13 +177,25 @@ class HTTPHeaders:
     return item in self._headers.keys()
 
   def __init__(self) -> None:
-    self._headers = {}
-    self.append('Content-Type', 'text/plain')
+    self._headers = {'content-type': DEFAULT_CONTENT_TYPE}
+
+  def reset(self) -> PWN:
+    """
+    Empties the headers in place so a connection can reuse them for its next request
+    """
+    self._headers.clear()
+    self._headers['content-type'] = DEFAULT_CONTENT_TYPE
+    return self
 
   def append(self, name: str, value: str) -> HTTPHeader:
     self._headers[name.lower()] = HTTPHeader(name, value)
     return self._headers[name.lower()]
 
+  def copy(self) -> 'HTTPHeaders':
+    headers = HTTPHeaders.__new__(HTTPHeaders)
+    headers._headers = dict(self._headers)
+    return headers
+
   def __setitem__(self, name: str, value: HTTPHeader) -> None:
     self._headers[name.lower()] = value
 
@@ -134,9 +243,141 @@ class HTTPHeaders:
   def __repr__(self):
     return f'HTTPHeaders[{len(self._headers)}]'
 
+class RequestHeaders:
+  """
+  Request headers exactly as the parser produced them, names and values alternating in one flat list
+  of bytes. Names are lowercased and values decoded only when looked up, the index is built on the
+  first lookup, and repeated headers keep every value.
+  """
+  _raw: typing.List[bytes]
+  _index: typing.Dict[str, typing.List[int]]
+  _decoded: typing.Dict[str, HTTPHeader]
+  __slots__ = ('_raw', '_index', '_decoded')
+
+  def __init__(self) -> None:
+    self._raw = []
+    self._index = None
+    self._decoded = {}
+
+  def reset(self) -> PWN:
+    self._raw.clear()
+    self._index = None
+    self._decoded.clear()
+    return self
+
+  def append_raw(self, name: bytes, value: bytes) -> None:
+    self._raw.append(name)
+    self._raw.append(value)
+    if self._index is not None:
+      self._index.setdefault(name.decode('latin-1').lower(), []).append(len(self._raw) - 1)
+
+  def append(self, name: str, value: str) -> HTTPHeader:
+    self.append_raw(name.encode('latin-1'), value.encode('utf-8'))
+    self._decoded.pop(name.lower(), None)
+    return self[name]
+
+  def _lookup(self) -> typing.Dict[str, typing.List[int]]:
+    if self._index is None:
+      index = self._index = {}
+      raw = self._raw
+      for position in range(0, len(raw), 2):
+        index.setdefault(raw[position].decode('latin-1').lower(), []).append(position + 1)
+
+    return self._index
+
+  def __contains__(self, item: str) -> bool:
+    return item.lower() in self._lookup() or item.lower() == 'content-type'
+
+  def __getitem__(self, name: str) -> HTTPHeader:
+    key = name.lower()
+    try:
+      return self._decoded[key]
+    except KeyError:
+      pass
+
+    try:
+      position = self._lookup()[key][0]
+    except KeyError:
+      if key == 'content-type':
+        return DEFAULT_CONTENT_TYPE
+
+      raise KeyError(f'Header[{name}] not fould')
+
+    header = self._decoded[key] = HTTPHeader(key, self._raw[position].decode('utf-8', 'replace'))
+    return header
+
+  def get(self, name: str) -> HTTPHeader:
+    try:
+      return self[name]
+    except KeyError as err:
+      logger.debug(err)
+
+    return None
+
+  def getall(self, name: str) -> typing.List[HTTPHeader]:
+    key = name.lower()
+    return [HTTPHeader(key, self._raw[position].decode('utf-8', 'replace')) for position in self._lookup().get(key, [])]
+
+  def raw(self, name: str) -> typing.Optional[bytes]:
+    """
+    First value of the header as received, without decoding
+    """
+    try:
+      return self._raw[self._lookup()[name.lower()][0]]
+    except KeyError:
+      return None
+
+  def keys(self):
+    return self._lookup().keys()
+
+  def __len__(self) -> int:
+    return len(self._raw) // 2
+
+  def __repr__(self):
+    return f'RequestHeaders[{len(self)}]'
+
 class ServiceParams:
   supported_methods: typing.List[HTTPMethod] = list(HTTPMethod)
   debug: bool = os.environ.get('WWW_DEBUG', None)
+  route_cache_size: int = int(os.environ.get('WWW_ROUTE_CACHE_SIZE', 1024))
+  # Synchronous handlers run on a thread pool, `process=True` routes on a process pool
+  thread_workers: int = int(os.environ.get('WWW_THREAD_WORKERS', min(32, (os.cpu_count() or 1) + 4)))
+  thread_queue: int = int(os.environ.get('WWW_THREAD_QUEUE', 256))
+  process_workers: int = int(os.environ.get('WWW_PROCESS_WORKERS', os.cpu_count() or 1))
+  process_queue: int = int(os.environ.get('WWW_PROCESS_QUEUE', 64))
+  # auto, orjson, ujson or json
+  json_serializer: str = os.environ.get('WWW_JSON_SERIALIZER', 'auto')
+  # Response compression, levels as `gzip=6,br=4`; unset codings keep their defaults
+  compression: bool = bool(int(os.environ.get('WWW_COMPRESSION', 0)))
+  compression_levels: str = os.environ.get('WWW_COMPRESSION_LEVELS', '')
+  compression_threshold: int = int(os.environ.get('WWW_COMPRESSION_THRESHOLD', 1024))
+  compression_executor_threshold: int = int(os.environ.get('WWW_COMPRESSION_EXECUTOR_THRESHOLD', 2 ** 18))
+  compression_cache_size: int = int(os.environ.get('WWW_COMPRESSION_CACHE_SIZE', 2 ** 25))
+  # Frames queued per `topics` channel connection, past it the oldest are dropped or the socket closed
+  channel_queue: int = int(os.environ.get('WWW_CHANNEL_QUEUE', 256))
+  channel_overflow: str = os.environ.get('WWW_CHANNEL_OVERFLOW', 'drop')
+  # Defaults of the per-route channel options, see router.datatypes.SocketParams
+  channel_max_size: int = int(os.environ.get('WWW_CHANNEL_MAX_SIZE', 2 ** 20))
+  channel_max_queue: int = int(os.environ.get('WWW_CHANNEL_MAX_QUEUE', 2 ** 5))
+  channel_read_limit: int = int(os.environ.get('WWW_CHANNEL_READ_LIMIT', 2 ** 16))
+  channel_write_limit: int = int(os.environ.get('WWW_CHANNEL_WRITE_LIMIT', 2 ** 16))
+  channel_compression: bool = bool(int(os.environ.get('WWW_CHANNEL_COMPRESSION', 1)))
+  channel_compression_threshold: int = int(os.environ.get('WWW_CHANNEL_COMPRESSION_THRESHOLD', 128))
+  channel_compression_level: int = int(os.environ.get('WWW_CHANNEL_COMPRESSION_LEVEL', 6))
+  # Prometheus metrics on `metrics_route`, workers publish snapshots to `metrics_dir` every `metrics_interval`
+  metrics: bool = bool(int(os.environ.get('WWW_METRICS', 0)))
+  metrics_route: str = os.environ.get('WWW_METRICS_ROUTE', '/metrics')
+  metrics_dir: str = os.environ.get('WWW_METRICS_DIR', None)
+  metrics_interval: float = float(os.environ.get('WWW_METRICS_INTERVAL', 1))
+  # Slow-request tracer, each worker writes requests slower than `trace_threshold` seconds, loop stalls
+  # and sampled hot frames to `trace_file` with its pid before the extension
+  trace: bool = bool(int(os.environ.get('WWW_TRACE', 0)))
+  trace_threshold: float = float(os.environ.get('WWW_TRACE_THRESHOLD', 1))
+  trace_sample_interval: float = float(os.environ.get('WWW_TRACE_SAMPLE_INTERVAL', 0.1))
+  trace_report_interval: float = float(os.environ.get('WWW_TRACE_REPORT_INTERVAL', 60))
+  trace_file: str = os.environ.get('WWW_TRACE_FILE', 'panic-trace.log')
+  trace_file_size: int = int(os.environ.get('WWW_TRACE_FILE_SIZE', 2 ** 23))
+  trace_file_count: int = int(os.environ.get('WWW_TRACE_FILE_COUNT', 3))
 
 class Signal():
   def __init__(self) -> None:
@@ -144,15 +385,30 @@ class Signal():
 
 class ServerParams:
   host: str = os.environ.get('WWW_HOST', None)
-  port: int = int(os.environ.get('WWW_PORT', None))
+  port: int = int(os.environ.get('WWW_PORT', 8000))
   sock: object = None
   debug: bool = os.environ.get('WWW_DEBUG', None)
   loop: object = None
   request_timeout: int = int(os.environ.get('WWW_REQUEST_TIMEOUT', 15))
+  keep_alive_timeout: int = int(os.environ.get('WWW_KEEP_ALIVE_TIMEOUT', 5))
   signal: object = Signal()
   connections: set = set()
   reuse_port: bool = False
+  write_high_water: int = int(os.environ.get('WWW_WRITE_HIGH_WATER', 2 ** 18))
+  write_low_water: int = int(os.environ.get('WWW_WRITE_LOW_WATER', 2 ** 16))
+  # 0 disables the limit
+  max_body_size: int = int(os.environ.get('WWW_MAX_BODY_SIZE', 100 * 2 ** 20))
+  body_queue_size: int = int(os.environ.get('WWW_BODY_QUEUE_SIZE', 16))
+  # Multipart parts larger than this are spooled to a temporary file
+  multipart_spill_size: int = int(os.environ.get('WWW_MULTIPART_SPILL_SIZE', 2 ** 20))
+  # Pipelined requests queued per connection before reading pauses
+  max_pipeline: int = int(os.environ.get('WWW_MAX_PIPELINE', 16))
   protocol: asyncio.Protocol = None
+  # panic.metrics.Metrics when enabled
+  metrics: object = None
+  metrics_interval: float = 1
+  # panic.tracing.Tracer when enabled
+  tracer: object = None
   request_handler: object
   error_handler: object
 
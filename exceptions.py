@@ -7,6 +7,9 @@ class PanicRouteExists(Exception):
 class MissingRequiredHeader(PanicRouteExists):
   pass
 
+class InvalidRoute(PanicRouteExists):
+  pass
+
 class PanicException(Exception):
   def __init__(self, message, status_code=None):
     super().__init__(message)
@@ -42,3 +45,10 @@ class PayloadTooLarge(PanicException):
 class InvalidHTTPMethod(PanicException):
   status = 405
 
+  def __init__(self, message, allow=None, status_code=None):
+    super().__init__(message, status_code)
+    self.allow = allow
+
+class ServiceUnavailable(PanicException):
+  status = 503
+
@@ -1,58 +1,198 @@
 import asyncio
+import concurrent.futures
 import hashlib
 import inspect
 import logging
 import os
+import time
 import traceback
 import typing
 
+from functools import partial
+from websockets import ConnectionClosed
+
 from panic import \
+    codec as panic_codec, \
+    topics as panic_topics, \
     request as panic_request, \
     response as panic_response, \
     datatypes as panic_datatypes, \
     exceptions as panic_exceptions
+from panic.response import \
+    compression as response_compression, \
+    datatypes as response_datatypes
+from panic.router import \
+    datatypes as router_datatypes
 
-WWW_DEBUG = False if os.environ.get('WWW_DEBUG', 't') == 'f' else True
 logger = logging.getLogger(__name__)
 
+class HandlerExecutor:
+  """
+  Bounded pool for synchronous handlers. The pool is created on first use, so pre-forked workers each
+  get their own, and requests beyond `max_workers + max_queue` in flight are rejected with a 503.
+  Counters are only touched from the event loop thread.
+  """
+  factory: typing.Callable[[int], concurrent.futures.Executor]
+  max_workers: int
+  max_queue: int
+  inflight: int
+  submitted: int
+  completed: int
+  rejected: int
+  _executor: concurrent.futures.Executor
+
+  def __init__(self, factory: typing.Callable[[int], concurrent.futures.Executor], max_workers: int, max_queue: int) -> None:
+    self.factory = factory
+    self.max_workers = max_workers
+    self.max_queue = max_queue
+    self.inflight = 0
+    self.submitted = 0
+    self.completed = 0
+    self.rejected = 0
+    self._executor = None
+
+  async def __call__(self, handler: panic_datatypes.FunctionType, *args, **kwargs) -> typing.Any:
+    if self.inflight >= self.max_workers + self.max_queue:
+      self.rejected += 1
+      raise panic_exceptions.ServiceUnavailable('Handler pool is saturated')
+
+    if self._executor is None:
+      self._executor = self.factory(self.max_workers)
+
+    self.inflight += 1
+    self.submitted += 1
+    try:
+      return await asyncio.get_event_loop().run_in_executor(self._executor, partial(handler, *args, **kwargs))
+    finally:
+      self.inflight -= 1
+      self.completed += 1
+
+  def stats(self) -> typing.Dict[str, typing.Any]:
+    return {
+      'max_workers': self.max_workers,
+      'max_queue': self.max_queue,
+      'active': min(self.inflight, self.max_workers),
+      'queued': max(self.inflight - self.max_workers, 0),
+      'saturation': self.inflight / (self.max_workers + self.max_queue),
+      'submitted': self.submitted,
+      'completed': self.completed,
+      'rejected': self.rejected,
+    }
+
+  def shutdown(self, wait: bool = False) -> None:
+    if self._executor is not None:
+      self._executor.shutdown(wait=wait)
+      self._executor = None
+
+  def __repr__(self) -> str:
+    return f'HandlerExecutor[{self.inflight}/{self.max_workers}+{self.max_queue}]'
+
 class RequestHandler:
   _panic: object
+  threads: HandlerExecutor
+  processes: HandlerExecutor
+  compression: response_compression.Compression
   def __init__(self, panic_service):
     self._panic = panic_service
+    params = panic_service.params
+    self.threads = HandlerExecutor(
+        lambda max_workers: concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='panic'),
+        params.thread_workers, params.thread_queue)
+    self.processes = HandlerExecutor(concurrent.futures.ProcessPoolExecutor, params.process_workers, params.process_queue)
+    self.compression = response_compression.Compression(params, self.threads) if params.compression else None
+
+  def executor_stats(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    return {'threads': self.threads.stats(), 'processes': self.processes.stats()}
+
+  def streams_body(self, request: panic_request.Request) -> bool:
+    try:
+      uri_route, parameters = self._panic.router.request(request.method, request.url)
+    except panic_exceptions.PanicException:
+      return False
+
+    return uri_route.stream_body
+
+  def socket_params(self, request: panic_request.Request) -> router_datatypes.SocketParams:
+    """
+    Websocket options of the channel route `request` upgrades to, the defaults when there's none
+    """
+    try:
+      uri_route, parameters = self._panic.router.request(request.method, request.url)
+    except panic_exceptions.PanicException:
+      return router_datatypes.SocketParams()
+
+    return uri_route.socket_params
 
   async def __call__(self,
       request: panic_request.Request,
       response_callback: typing.Any,
       transport: asyncio.BaseTransport = None) -> typing.Any:
 
-    try:
-      uri_route = self._panic.router.request(request.method, request.url)
-    except panic_exceptions.NotFound as err:
-      if WWW_DEBUG:
-        response = panic_response.text(f'Method[{request.method}] and Route[{request.url}] does not exist', status=500)
+    timings = request.timings
+    if timings is not None:
+      timings['scheduled'] = time.perf_counter()
 
-      else:
-        response = panic_response.text('Service Error', status=500)
+    try:
+      uri_route, parameters = self._panic.router.request(request.method, request.url)
+    except (panic_exceptions.NotFound, panic_exceptions.InvalidHTTPMethod) as err:
+      if timings is not None:
+        timings['routed'] = time.perf_counter()
 
-      response_callback(response)
+      response_callback(self._panic.exception_handler(request, err))
       return None
 
+    request.route = uri_route.url
+    if timings is not None:
+      timings['routed'] = time.perf_counter()
+
     if uri_route.streamable:
-      raise NotImplementedError
+      response = panic_response.stream(uri_route.handler(request, **parameters))
+      if self.compression is not None:
+        response = await self.compression(request, response)
+
+      response_callback(response)
+      return None
 
     if uri_route.method is panic_datatypes.HTTPMethod.channel:
-      while True:
-        response = await uri_route.handler(request, response_callback)
-        if response in [0]:
-          break
+      # Raw octet-stream routes keep the bare websocket, everything else goes through a Channel
+      # for topics and the route's codec
+      if uri_route.socket_protocol == 'topics' or not isinstance(uri_route.codec, panic_codec.OctetStreamCodec):
+        response_callback = self._panic.topics.channel(response_callback, transport, uri_route.socket_params, uri_route.codec)
+
+      try:
+        while True:
+          response = await uri_route.handler(request, response_callback, **parameters)
+          if response in [0]:
+            break
+
+      except ConnectionClosed as err:
+        logger.debug(err)
+
+      finally:
+        if isinstance(response_callback, panic_topics.Channel):
+          self._panic.topics.discard(response_callback)
 
       await response_callback.close()
       transport.close()
 
-    elif uri_route.awaitable:
+    else:
       try:
-        response = await uri_route.handler(request)
+        if uri_route.awaitable:
+          response = await uri_route.handler(request, **parameters)
+
+        elif uri_route.process:
+          response = await self.processes(uri_route.handler, request, **parameters)
+
+        elif self._panic.tracer is not None and timings is not None:
+          response = await self.threads(self._panic.tracer.in_thread, uri_route.handler, request, **parameters)
+
+        else:
+          response = await self.threads(uri_route.handler, request, **parameters)
+
       except Exception as err:
+        if self._panic.metrics is not None:
+          self._panic.metrics.handler_errors += 1
+
         try:
           if inspect.iscoroutinefunction(self._panic.exception_handler):
             response = self._panic.exception_handler(request, err)
@@ -64,15 +204,23 @@ class RequestHandler:
           else:
             response = panic_response.text('Internal Error', status=500)
 
+      if timings is not None:
+        timings['handled'] = time.perf_counter()
+
+      if self.compression is not None:
+        response = await self.compression(request, response)
+
       response_callback(response)
-    else:
-      raise NotImplementedError
 
 class ExceptionHandler:
   _panic: object
   handlers: typing.Dict[panic_datatypes.ExceptionType, panic_datatypes.FunctionType]
+  _resolved: typing.Dict[type, panic_datatypes.FunctionType]
+  _defaults: typing.Dict[typing.Tuple[type, int, str], panic_response.FrozenResponse]
   def __init__(self, panic_service):
     self.handlers = {}
+    self._resolved = {}
+    self._defaults = {}
     self._panic = panic_service
 
   def add(self, exception: panic_datatypes.ExceptionType, handler: panic_datatypes.FunctionType) -> None:
@@ -80,20 +228,55 @@ class ExceptionHandler:
       raise panic_exceptions.InvalidAttribute(f'exception[{exception}] is already registered')
 
     self.handlers[exception] = handler
+    self._resolved.clear()
+
+  def resolve(self, exception_type: type) -> typing.Optional[panic_datatypes.FunctionType]:
+    """
+    Handler registered for the closest class in the exception's MRO, memoized per concrete type
+    """
+    try:
+      return self._resolved[exception_type]
+    except KeyError:
+      pass
+
+    handler = None
+    for klass in exception_type.__mro__:
+      if klass in self.handlers:
+        handler = self.handlers[klass]
+        break
+
+    self._resolved[exception_type] = handler
+    return handler
 
   def __call__(self, request: panic_request.Request, exception: Exception) -> panic_response.Response:
     if self._panic.params.debug:
-      logger.exception(exception)
+      if isinstance(exception, panic_exceptions.PanicException):
+        logger.debug(f'{type(exception).__name__}: {exception}')
+      else:
+        logger.exception(exception)
 
-    for key, handler in self.handlers.items():
-      if issubclass(type(exception), key):
-        return handler(request=request, exception=exception)
+    handler = self.resolve(type(exception))
+    if handler is not None:
+      return handler(request=request, exception=exception)
 
     return self._default(request=request, exception=exception)
 
   def _default(self, request: panic_request.Request, exception: panic_datatypes.ExceptionType) -> panic_response.Response:
     if issubclass(type(exception), panic_exceptions.PanicException):
-      return panic_response.text(f'Error: {exception}', status=getattr(exception, 'status', 500))
+      status = getattr(exception, 'status', 500)
+      allow = getattr(exception, 'allow', None)
+      headers = {} if allow is None else {'Allow': allow}
+      if self._panic.params.debug:
+        return panic_response.text(f'Error: {exception}', status=status, headers=headers)
+
+      # Outside of debug the body only names the status, so every error of a kind shares one rendering
+      key = (type(exception), status, allow)
+      try:
+        return self._defaults[key]
+      except KeyError:
+        response = self._defaults[key] = panic_response.text(
+            f'Error: {response_datatypes.reason_phrase(status)}', status=status, headers=headers).freeze()
+        return response
 
     elif self._panic.params.debug:
       return panic_response.text(f'Error: {exception}\nException: {traceback.format_exc()}', status=500)
@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import typing
+
+from bisect import bisect_left
+
+from panic import \
+    response as panic_response
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('parse', 'handler', 'write')
+# Label of requests that matched no route
+UNMATCHED = '<unmatched>'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+COUNTERS = (
+  ('accepted', 'panic_connections_total', 'Connections accepted'),
+  ('requests', 'panic_requests_total', 'Requests parsed'),
+  ('reused', 'panic_keep_alive_requests_total', 'Requests served on an already used connection'),
+  ('bytes_received', 'panic_received_bytes_total', 'Bytes read from clients'),
+  ('bytes_sent', 'panic_sent_bytes_total', 'Bytes handed to the transport'),
+  ('timeouts', 'panic_request_timeouts_total', 'Requests answered with 408 after request_timeout'),
+  ('expired', 'panic_keep_alive_expired_total', 'Idle connections closed after keep_alive_timeout'),
+  ('parser_errors', 'panic_parser_errors_total', 'Requests rejected by the HTTP parser'),
+  ('handler_errors', 'panic_handler_errors_total', 'Handlers that raised'),
+)
+
+class Histogram:
+  """
+  Fixed-bucket latency histogram, `counts` aren't cumulative until rendered
+  """
+  counts: typing.List[int]
+  sum: float
+  __slots__ = ('counts', 'sum')
+
+  def __init__(self) -> None:
+    self.counts = [0] * (len(BUCKETS) + 1)
+    self.sum = 0.0
+
+  def observe(self, seconds: float) -> None:
+    self.counts[bisect_left(BUCKETS, seconds)] += 1
+    self.sum += seconds
+
+  def merge(self, counts: typing.List[int], seconds: float) -> None:
+    for index, count in enumerate(counts):
+      self.counts[index] += count
+
+    self.sum += seconds
+
+  def __repr__(self) -> str:
+    return f'Histogram[{sum(self.counts)}]'
+
+def _escape(value: str) -> str:
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metrics:
+  """
+  Counters and per-route phase histograms of one worker. They're only touched from the worker's event
+  loop, so nothing is locked. With several workers each one writes a snapshot to `directory` every
+  `interval` seconds and `/metrics` merges the snapshots of the live workers with its own counters.
+  """
+  directory: typing.Optional[str]
+  connections: typing.Set[typing.Any]
+  histograms: typing.Dict[typing.Tuple[str, str], Histogram]
+  accepted: int
+  requests: int
+  reused: int
+  bytes_received: int
+  bytes_sent: int
+  timeouts: int
+  expired: int
+  parser_errors: int
+  handler_errors: int
+
+  def __init__(self, directory: str = None) -> None:
+    self.directory = directory
+    # The server's connections, handed over once it starts
+    self.connections = set()
+    self.histograms = {}
+    for name, metric, description in COUNTERS:
+      setattr(self, name, 0)
+
+  def observe(self, route: typing.Optional[str], timings: typing.Dict[str, float]) -> None:
+    """
+    Records a request's phases from its `Request.timings`: parse runs from its first byte to the
+    handler's start, handler to its response and write to the response's last byte handed to the
+    transport, waiting on earlier pipelined responses included
+    """
+    route = UNMATCHED if route is None else route
+    responded = timings['responded']
+    for phase, seconds in zip(PHASES, (timings['dispatched'] - timings['started'], responded - timings['dispatched'], timings['written'] - responded)):
+      try:
+        histogram = self.histograms[(route, phase)]
+      except KeyError:
+        histogram = self.histograms[(route, phase)] = Histogram()
+
+      histogram.observe(seconds)
+
+  def snapshot(self) -> typing.Dict[str, typing.Any]:
+    return {
+      'pid': os.getpid(),
+      'active': len(self.connections),
+      'counters': {name: getattr(self, name) for name, metric, description in COUNTERS},
+      'histograms': [[route, phase, histogram.counts, histogram.sum] for (route, phase), histogram in self.histograms.items()],
+    }
+
+  def _path(self, pid: int) -> str:
+    return os.path.join(self.directory, f'{pid}.json')
+
+  def publish(self) -> None:
+    """
+    Replaces this worker's snapshot file, readers never see a partial write
+    """
+    if self.directory is None:
+      return None
+
+    path = self._path(os.getpid())
+    try:
+      with open(f'{path}.tmp', 'w') as stream:
+        json.dump(self.snapshot(), stream)
+
+      os.replace(f'{path}.tmp', path)
+    except OSError as err:
+      logger.warning(f'Unable to publish metrics to {path}: {err}')
+
+  def collect(self) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    This worker's live snapshot and the last published snapshot of every other live worker
+    """
+    snapshots = [self.snapshot()]
+    if self.directory is None:
+      return snapshots
+
+    try:
+      names = os.listdir(self.directory)
+    except OSError:
+      return snapshots
+
+    for name in names:
+      pid, _, extension = name.partition('.')
+      if extension != 'json' or not pid.isdigit() or int(pid) == os.getpid():
+        continue
+
+      try:
+        # Workers that died took their counters with them, the supervisor starts a fresh one
+        os.kill(int(pid), 0)
+      except ProcessLookupError:
+        try:
+          os.unlink(self._path(int(pid)))
+        except OSError:
+          pass
+
+        continue
+      except PermissionError:
+        pass
+
+      try:
+        with open(self._path(int(pid))) as stream:
+          snapshots.append(json.load(stream))
+      except (OSError, ValueError):
+        continue
+
+    return snapshots
+
+  def render(self, snapshots: typing.List[typing.Dict[str, typing.Any]]) -> str:
+    """
+    Prometheus text exposition of the merged snapshots
+    """
+    counters = {name: 0 for name, metric, description in COUNTERS}
+    histograms = {}
+    active = 0
+    for snapshot in snapshots:
+      active += snapshot['active']
+      for name, value in snapshot['counters'].items():
+        if name in counters:
+          counters[name] += value
+
+      for route, phase, counts, seconds in snapshot['histograms']:
+        try:
+          histogram = histograms[(route, phase)]
+        except KeyError:
+          histogram = histograms[(route, phase)] = Histogram()
+
+        histogram.merge(counts, seconds)
+
+    lines = [
+      '# HELP panic_workers Workers reporting',
+      '# TYPE panic_workers gauge',
+      f'panic_workers {len(snapshots)}',
+      '# HELP panic_connections_active Open connections',
+      '# TYPE panic_connections_active gauge',
+      f'panic_connections_active {active}',
+    ]
+    for name, metric, description in COUNTERS:
+      lines.append(f'# HELP {metric} {description}')
+      lines.append(f'# TYPE {metric} counter')
+      lines.append(f'{metric} {counters[name]}')
+
+    lines.append('# HELP panic_keep_alive_reuse_ratio Share of requests served on an already used connection')
+    lines.append('# TYPE panic_keep_alive_reuse_ratio gauge')
+    lines.append(f'panic_keep_alive_reuse_ratio {counters["reused"] / counters["requests"] if counters["requests"] else 0.0}')
+
+    lines.append('# HELP panic_request_duration_seconds Request latency per route and phase')
+    lines.append('# TYPE panic_request_duration_seconds histogram')
+    for (route, phase), histogram in sorted(histograms.items()):
+      labels = f'route="{_escape(route)}",phase="{phase}"'
+      cumulative = 0
+      for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+        cumulative += count
+        lines.append(f'panic_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+
+      lines.append(f'panic_request_duration_seconds_sum{{{labels}}} {histogram.sum}')
+      lines.append(f'panic_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+    lines.append('')
+    return '\n'.join(lines)
+
+  async def handler(self, request: typing.Any) -> panic_response.Response:
+    return panic_response.Response(self.render(self.collect()).encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+  def __repr__(self) -> str:
+    return f'Metrics[{self.requests}:{len(self.histograms)}]'
@@ -0,0 +1,315 @@
+import logging
+import tempfile
+import typing
+
+from collections import deque
+
+from panic import \
+    datatypes as panic_datatypes, \
+    exceptions as panic_exceptions
+
+logger = logging.getLogger(__name__)
+
+# https://tools.ietf.org/html/rfc7578
+MAX_HEADER_SIZE = 2 ** 14
+SPILL_SIZE = panic_datatypes.ServerParams.multipart_spill_size
+READ_SIZE = 2 ** 16
+
+PREAMBLE = 0
+DELIMITER = 1
+HEADERS = 2
+BODY = 3
+EPILOGUE = 4
+
+class MultipartParser:
+  """
+  Incremental multipart/form-data parser. `feed` takes the body in arbitrary chunks and returns
+  `('headers', RequestHeaders)`, `('data', bytes)` and `('end', None)` events; part data is emitted as
+  soon as it can't be the start of the next boundary, so only a boundary's worth of bytes is held back.
+  """
+  _buffer: bytearray
+  __slots__ = ('_first', '_delimiter', '_buffer', '_state')
+
+  def __init__(self, boundary: bytes) -> None:
+    self._first = b'--' + boundary
+    self._delimiter = b'\r\n--' + boundary
+    self._buffer = bytearray()
+    self._state = PREAMBLE
+
+  @property
+  def complete(self) -> bool:
+    return self._state == EPILOGUE
+
+  def feed(self, data: bytes) -> typing.List[typing.Tuple[str, typing.Any]]:
+    buffer = self._buffer
+    buffer += data
+    events = []
+    while True:
+      if self._state == PREAMBLE:
+        index = buffer.find(self._first)
+        if index < 0:
+          del buffer[:-len(self._first)]
+          break
+
+        del buffer[:index + len(self._first)]
+        self._state = DELIMITER
+
+      elif self._state == DELIMITER:
+        if len(buffer) < 2:
+          break
+
+        if buffer[:2] == b'--':
+          self._state = EPILOGUE
+          continue
+
+        # Transport padding may sit between the boundary and its CRLF
+        index = buffer.find(b'\r\n')
+        if index < 0:
+          if len(buffer) > MAX_HEADER_SIZE:
+            raise panic_exceptions.BadRequest('Malformed multipart boundary')
+
+          break
+
+        del buffer[:index + 2]
+        self._state = HEADERS
+
+      elif self._state == HEADERS:
+        if buffer[:2] == b'\r\n':
+          del buffer[:2]
+          events.append(('headers', panic_datatypes.RequestHeaders()))
+          self._state = BODY
+          continue
+
+        index = buffer.find(b'\r\n\r\n')
+        if index < 0:
+          if len(buffer) > MAX_HEADER_SIZE:
+            raise panic_exceptions.BadRequest('Multipart part headers too large')
+
+          break
+
+        headers = panic_datatypes.RequestHeaders()
+        for line in bytes(buffer[:index]).split(b'\r\n'):
+          name, separator, value = line.partition(b':')
+          if not separator:
+            raise panic_exceptions.BadRequest('Malformed multipart part header')
+
+          headers.append_raw(name.strip(), value.strip())
+
+        del buffer[:index + 4]
+        events.append(('headers', headers))
+        self._state = BODY
+
+      elif self._state == BODY:
+        index = buffer.find(self._delimiter)
+        if index < 0:
+          keep = len(self._delimiter) - 1
+          if len(buffer) > keep:
+            events.append(('data', bytes(buffer[:-keep])))
+            del buffer[:-keep]
+
+          break
+
+        if index:
+          events.append(('data', bytes(buffer[:index])))
+
+        events.append(('end', None))
+        del buffer[:index + len(self._delimiter)]
+        self._state = DELIMITER
+
+      else:
+        buffer.clear()
+        break
+
+    return events
+
+  def feed_eof(self) -> None:
+    if self._state != EPILOGUE:
+      raise panic_exceptions.BadRequest('Incomplete multipart body')
+
+class MultipartPart:
+  """
+  Metadata shared by spooled and streamed parts
+  """
+  headers: panic_datatypes.RequestHeaders
+  content_type: str
+  parameters: typing.Dict[str, str]
+
+  def __init__(self, headers: panic_datatypes.RequestHeaders) -> None:
+    self.headers = headers
+    content_type = headers.get('content-type')
+    self.content_type = content_type.value if content_type is not None else None
+    disposition = headers.get('content-disposition')
+    self.parameters = dict(disposition.parameters) if disposition is not None else {}
+
+  @property
+  def name(self) -> typing.Optional[str]:
+    return self.parameters.get('name')
+
+  @property
+  def filename(self) -> typing.Optional[str]:
+    return self.parameters.get('filename')
+
+  def __repr__(self) -> str:
+    return f'{type(self).__name__}[{self.name}:{self.content_type}]'
+
+class SpooledPart(MultipartPart):
+  """
+  A part received in full. Its content stays in memory up to `spill_size` bytes and is moved to an
+  anonymous temporary file past that.
+  """
+  size: int
+  file: tempfile.SpooledTemporaryFile
+
+  def __init__(self, headers: panic_datatypes.RequestHeaders, spill_size: int) -> None:
+    super().__init__(headers)
+    self.size = 0
+    self.file = tempfile.SpooledTemporaryFile(max_size=spill_size)
+
+  @property
+  def spilled(self) -> bool:
+    return self.file._rolled
+
+  def write(self, data: bytes) -> None:
+    self.size += len(data)
+    self.file.write(data)
+
+  @property
+  def body(self) -> bytes:
+    self.file.seek(0)
+    return self.file.read()
+
+  def __aiter__(self) -> typing.AsyncIterator[bytes]:
+    return self._chunks()
+
+  async def _chunks(self) -> typing.AsyncIterator[bytes]:
+    self.file.seek(0)
+    while True:
+      chunk = self.file.read(READ_SIZE)
+      if not chunk:
+        break
+
+      yield chunk
+
+  def close(self) -> None:
+    self.file.close()
+
+class MultipartBody:
+  """
+  RequestBody for buffered multipart/form-data requests. Chunks are parsed as `on_body` delivers them
+  and written straight into SpooledParts, the raw body is never kept.
+  """
+  parts: typing.List[SpooledPart]
+
+  def __init__(self, boundary: bytes, spill_size: int = SPILL_SIZE) -> None:
+    self.parts = []
+    self._parser = MultipartParser(boundary)
+    self._spill_size = spill_size
+    self._current = None
+
+  def append(self, chunk: bytes) -> None:
+    for event, datum in self._parser.feed(chunk):
+      if event == 'data':
+        self._current.write(datum)
+
+      elif event == 'headers':
+        self._current = SpooledPart(datum, self._spill_size)
+        self.parts.append(self._current)
+
+      else:
+        self._current = None
+
+  def feed_eof(self) -> None:
+    self._parser.feed_eof()
+
+  @property
+  def extract(self) -> bytes:
+    raise panic_exceptions.ServerError('Multipart request-body is only available through `form` or `multipart()`')
+
+  def close(self) -> None:
+    for part in self.parts:
+      part.close()
+
+  def __repr__(self) -> str:
+    return f'MultipartBody[{len(self.parts)}]'
+
+class StreamingPart(MultipartPart):
+  """
+  A part of a streamed request-body, its content is read from the connection while iterating
+  """
+  def __init__(self, headers: panic_datatypes.RequestHeaders, reader: 'MultipartReader') -> None:
+    super().__init__(headers)
+    self._reader = reader
+    self._complete = False
+
+  def __aiter__(self) -> 'StreamingPart':
+    return self
+
+  async def __anext__(self) -> bytes:
+    while not self._complete:
+      event, datum = await self._reader._next_event()
+      if event == 'data':
+        return datum
+
+      if event == 'end':
+        self._complete = True
+
+    raise StopAsyncIteration
+
+  async def read(self) -> bytes:
+    return b''.join([chunk async for chunk in self])
+
+  async def spool(self, spill_size: int = SPILL_SIZE) -> SpooledPart:
+    """
+    Drains the rest of the part into a SpooledPart
+    """
+    part = SpooledPart(self.headers, spill_size)
+    async for chunk in self:
+      part.write(chunk)
+
+    return part
+
+class MultipartReader:
+  """
+  Iterates the parts of a streamed multipart/form-data body, `async for part in request.multipart()`.
+  Parts must be consumed in order; advancing skips whatever is left of the current part.
+  """
+  def __init__(self, body: typing.AsyncIterable[bytes], boundary: bytes) -> None:
+    self._body = body.__aiter__()
+    self._parser = MultipartParser(boundary)
+    self._events = deque()
+    self._current = None
+
+  async def _next_event(self) -> typing.Tuple[str, typing.Any]:
+    while not self._events:
+      if self._parser.complete:
+        # The closing delimiter was parsed, the epilogue is read and discarded
+        async for chunk in self._body:
+          pass
+
+        raise StopAsyncIteration
+
+      try:
+        chunk = await self._body.__anext__()
+      except StopAsyncIteration:
+        # Raises BadRequest unless the closing delimiter made it into the last chunk
+        self._parser.feed_eof()
+        raise
+
+      self._events.extend(self._parser.feed(chunk))
+
+    return self._events.popleft()
+
+  def __aiter__(self) -> 'MultipartReader':
+    return self
+
+  async def __anext__(self) -> StreamingPart:
+    if self._current is not None:
+      async for chunk in self._current:
+        pass
+
+    event, datum = await self._next_event()
+    if event != 'headers':
+      raise panic_exceptions.BadRequest('Malformed multipart body')
+
+    self._current = StreamingPart(datum, self)
+    return self._current
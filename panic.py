@@ -2,9 +2,8 @@ import asyncio
 import inspect
 import logging
 import os
-
-# TODO,
-# from signal import signal, SIGTERM, SIGINT
+import shutil
+import tempfile
 
 from panic import \
     utils as panic_utils, \
@@ -12,7 +11,13 @@ from panic import \
     router as panic_routers, \
     response as panic_responses, \
     datatypes as panic_datatypes, \
-    handlers as panic_handlers
+    handlers as panic_handlers, \
+    metrics as panic_metrics, \
+    tracing as panic_tracing, \
+    server as panic_server, \
+    topics as panic_topics
+
+from panic.server import protocols as panic_protocols
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +32,13 @@ class Panic:
     self.router = panic_routers.RouterAPI(self)
     self.request_handler = panic_handlers.RequestHandler(self)
     self.exception_handler = panic_handlers.ExceptionHandler(self)
+    self.topics = panic_topics.TopicHub()
+    self.metrics = None
+    if self.params.metrics:
+      self.metrics = panic_metrics.Metrics()
+      self.router.get(self.params.metrics_route)(self.metrics.handler)
+
+    self.tracer = panic_tracing.Tracer(self.params) if self.params.trace else None
 
   # Decorator
   def exception(self, *exceptions):
@@ -44,3 +56,52 @@ class Panic:
 
     return _wrapper
 
+
+  def run(self,
+      host: str = None,
+      port: int = None,
+      workers: int = 1,
+      debug: bool = False,
+      sock: object = None,
+      reuse_port: bool = False,
+      protocol: asyncio.Protocol = None) -> None:
+    """
+    Runs the service, forking `workers` processes when more than one is requested
+
+    :param reuse_port: bind every worker to the port with SO_REUSEPORT instead of sharing one socket
+    """
+    params = panic_datatypes.ServerParams()
+    params.host = host or params.host or '127.0.0.1'
+    params.port = port or params.port
+    params.sock = sock
+    params.debug = debug
+    params.reuse_port = reuse_port
+    params.connections = set()
+    params.protocol = protocol or panic_protocols.HttpProtocol
+    params.request_handler = self.request_handler
+    params.error_handler = self.exception_handler
+    params.metrics = self.metrics
+    params.metrics_interval = self.params.metrics_interval
+    params.tracer = self.tracer
+    if debug:
+      self.params.debug = debug
+
+    if workers > 1:
+      if self.metrics is not None:
+        self.metrics.directory = self.params.metrics_dir or tempfile.mkdtemp(prefix='panic-metrics-')
+        os.makedirs(self.metrics.directory, exist_ok=True)
+
+      try:
+        panic_server.serve_multiple(params, workers)
+      finally:
+        if self.metrics is not None and self.params.metrics_dir is None:
+          shutil.rmtree(self.metrics.directory, ignore_errors=True)
+
+    else:
+      params.loop = asyncio.new_event_loop()
+      asyncio.set_event_loop(params.loop)
+      try:
+        panic_server.serve(params)
+      finally:
+        self.request_handler.threads.shutdown()
+        self.request_handler.processes.shutdown()
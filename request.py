@@ -1,21 +1,36 @@
+import asyncio
 import logging
 import typing
 
-from collections import namedtuple
+from collections import deque
 from http.cookies import SimpleCookie
 from httptools import parse_url
 from urllib.parse import parse_qsl, parse_qs
 from ujson import loads as json_loads
 from panic import \
     datatypes as panic_datatypes, \
-    exceptions as panic_exceptions
+    exceptions as panic_exceptions, \
+    multipart as panic_multipart
 
 logger = logging.getLogger(__name__)
 
-DEFAULT_HTTP_CONTENT_TYPE = "application/octet-stream"
+DEFAULT_HTTP_CONTENT_TYPE = panic_datatypes.MEDIA_OCTET_STREAM
 # HTTP/1.1: https://www.w3.org/Protocols/rfc2616/rfc2616-sec7.html#sec7.2.1
 # > If the media type remains unknown, the recipient SHOULD treat it
 # > as type "application/octet-stream"
+FORM_MEDIA_TYPES = frozenset([
+  panic_datatypes.MEDIA_FORM_URLENCODED,
+  panic_datatypes.MEDIA_MULTIPART,
+  DEFAULT_HTTP_CONTENT_TYPE,
+])
+RECORD_MEDIA_TYPES = frozenset([
+  panic_datatypes.MEDIA_NDJSON,
+  panic_datatypes.MEDIA_JSON_LINES,
+])
+
+async def _aiter(items: typing.Iterable) -> typing.AsyncIterator:
+  for item in items:
+    yield item
 
 class RequestParameters(dict):
   """
@@ -50,20 +65,108 @@ class RequestBody:
   def append(self, part: bytes) -> None:
     self._parts.append(part)
 
+  def reset(self) -> 'RequestBody':
+    self._parts.clear()
+    return self
+
   def __repr__(self) -> str:
     return f'RequestBody[{len(self._parts)}]'
 
   @property
   def extract(self) -> bytes:
+    if len(self._parts) == 1:
+      return self._parts[0]
+
     return b''.join(self._parts)
 
+class StreamingRequestBody(RequestBody):
+  """
+  Body handed to `stream_body` routes before it has arrived. Handlers consume it with `async for`,
+  the protocol pauses reading from the transport while `max_parts` chunks are waiting.
+  """
+  _parts: typing.Deque[bytes]
+
+  def __init__(self,
+      max_parts: int,
+      pause: typing.Callable[[], None],
+      resume: typing.Callable[[], None]) -> None:
+    self._parts = deque()
+    self._max_parts = max(max_parts, 1)
+    self._pause = pause
+    self._resume = resume
+    self._paused = False
+    self._complete = False
+    self._error = None
+    self._waiter = None
+
+  @property
+  def complete(self) -> bool:
+    return self._complete
+
+  def append(self, part: bytes) -> None:
+    self._parts.append(part)
+    self._wake()
+    if not self._paused and len(self._parts) >= self._max_parts:
+      self._paused = True
+      self._pause()
+
+  def feed_eof(self) -> None:
+    self._complete = True
+    self._wake()
+
+  def feed_error(self, error: Exception) -> None:
+    self._error = error
+    self._wake()
+
+  def _wake(self) -> None:
+    if self._waiter is not None and not self._waiter.done():
+      self._waiter.set_result(None)
+
+  def __aiter__(self) -> 'StreamingRequestBody':
+    return self
+
+  async def __anext__(self) -> bytes:
+    while not self._parts:
+      if self._error is not None:
+        raise self._error
+
+      if self._complete:
+        raise StopAsyncIteration
+
+      self._waiter = asyncio.get_event_loop().create_future()
+      try:
+        await self._waiter
+      finally:
+        self._waiter = None
+
+    part = self._parts.popleft()
+    if self._paused and len(self._parts) <= self._max_parts // 2:
+      self._paused = False
+      self._resume()
+
+    return part
+
+  async def read(self) -> bytes:
+    return b''.join([part async for part in self])
+
+  @property
+  def extract(self) -> bytes:
+    raise panic_exceptions.ServerError('Streaming request-body must be consumed with `async for` or `read()`')
+
+  def __repr__(self) -> str:
+    return f'StreamingRequestBody[{len(self._parts)}:{self._complete}]'
+
 class Request(dict):
   url: str
-  headers: panic_datatypes.HTTPHeaders
+  headers: panic_datatypes.RequestHeaders
   version: str
   method: panic_datatypes.HTTPMethod
   query_string: str
   body: RequestBody
+  # url of the matched route, set by the RequestHandler
+  route: typing.Optional[str]
+  # perf_counter marks of the request's phases, only kept with metrics or tracing enabled
+  timings: typing.Optional[typing.Dict[str, float]]
   _parsed: typing.Dict[str, typing.Any]
   _encoding: str
 
@@ -78,9 +181,10 @@ class Request(dict):
 
   def __init__(self,
     url: bytes,
-    headers: panic_datatypes.HTTPHeaders,
+    headers: panic_datatypes.RequestHeaders,
     version: str,
-    method: panic_datatypes.HTTPMethod):
+    method: panic_datatypes.HTTPMethod,
+    body: RequestBody = None):
 
     # Assume UTF-8 for all communications.
     self._encoding = 'utf-8'
@@ -93,35 +197,77 @@ class Request(dict):
     self.headers = headers
     self.version = version
     self.method = method
-    self.body = RequestBody()
+    self.body = RequestBody() if body is None else body
+    self.route = None
+    self.timings = None
     self._parsed = {}
 
   @property
   def json(self):
-    if not self.headers['content-type'] in ['application/json']:
+    if self.headers['content-type'].media_type is not panic_datatypes.MEDIA_JSON:
       raise panic_exceptions.ServerError(f'Content-Type[{self.headers["content-type"].value}] not supported')
 
     if not 'json' in self._parsed.keys():
       try:
-        self._parsed['json'] = json_loads(self.body.extract.decode(self._encoding))
+        # ujson decodes UTF-8 bytes itself, no intermediate str
+        self._parsed['json'] = json_loads(self.body.extract)
 
       except ValueError as err:
         raise panic_exceptions.BadRequest(f'Unable to decode request-body of Content-Type[{self.headers["content-type"].value}]')
 
-      except Exception as err:
-        print(err)
-        import ipdb;ipdb.set_trace()
-        raise err
-
     return self._parsed['json']
 
+  async def records(self) -> typing.AsyncIterator[typing.Any]:
+    """
+    Decodes an NDJSON / JSON-lines body one record at a time. On `stream_body` routes records are
+    yielded as their chunks arrive, so memory is bounded by the longest line instead of the body.
+    """
+    if self.headers['content-type'].media_type not in RECORD_MEDIA_TYPES:
+      raise panic_exceptions.ServerError(f'Content-Type[{self.headers["content-type"].value}] not supported')
+
+    chunks = self.body if isinstance(self.body, StreamingRequestBody) else _aiter([self.body.extract])
+    pending = []
+    number = 0
+    async for chunk in chunks:
+      lines = chunk.split(b'\n')
+      if len(lines) == 1:
+        pending.append(chunk)
+        continue
+
+      if pending:
+        pending.append(lines[0])
+        lines[0] = b''.join(pending)
+        pending = []
+
+      tail = lines.pop()
+      if tail:
+        pending.append(tail)
+
+      for line in lines:
+        number += 1
+        if line.strip():
+          yield self._record(line, number)
+
+    if pending:
+      line = b''.join(pending)
+      if line.strip():
+        yield self._record(line, number + 1)
+
+  def _record(self, line: bytes, number: int) -> typing.Any:
+    try:
+      return json_loads(line)
+
+    except ValueError as err:
+      raise panic_exceptions.BadRequest(f'Unable to decode record {number} of Content-Type[{self.headers["content-type"].value}]')
+
   @property
   def form(self):
-    if not self.headers['content-type'] in ['application/x-www-form-urlencoded', 'multipart/form-data', DEFAULT_HTTP_CONTENT_TYPE]:
+    media_type = self.headers['content-type'].media_type
+    if media_type not in FORM_MEDIA_TYPES:
       raise panic_exceptions.ServerError(f'Content-Type[{self.headers["content-type"].value}] not supported')
 
     if not 'form' in self._parsed.keys():
-      if self.headers['content-type'] in ['application/x-www-form-urlencoded']:
+      if media_type is panic_datatypes.MEDIA_FORM_URLENCODED:
         self._parsed['form'] = {}
         for name, value in parse_qsl(''.join(self.body.extract.decode(self._encoding))):
           try:
@@ -133,33 +279,41 @@ class Request(dict):
             logger.debug(err)
             self._parsed['form'][name] = value
 
-      elif self.headers['content-type'] in ['multipart/form-data']:
-        File = namedtuple('File', ['content_type', 'body', 'parameters'])
-        self._parsed['form'] = {'files': []}
-        for part in self.body.extract.split(self.headers['content-type'].parameters['boundary'].encode(self._encoding))[1:-1]:
-          headers, body = part.split(b'\r\n\r\n')
-          headers = panic_datatypes.HTTPHeaders().parse([header for header in headers.decode(self._encoding).split('\r\n') if header])
-          body = body.strip(b'\r\n--')
-          try:
-            content_type = headers['content-type'].value
-          except AttributeError as err:
-            content_type = None
-            pass
-
-          try:
-            parameters = headers['content-disposition'].parameters
-          except AttributeError as err:
-            parameters = None
-            pass
+      elif media_type is panic_datatypes.MEDIA_MULTIPART:
+        body = self.body
+        if not isinstance(body, panic_multipart.MultipartBody):
+          body = panic_multipart.MultipartBody(self.boundary)
+          body.append(self.body.extract)
+          body.feed_eof()
 
-          self._parsed['form']['files'].append(File(content_type, body, parameters))
+        self._parsed['form'] = {'files': body.parts}
 
       else:
-        import ipdb; ipdb.set_trace()
-        raise NotImplementedError
+        raise panic_exceptions.BadRequest(f'Content-Type[{self.headers["content-type"].value}] is not a form')
 
     return self._parsed['form']
 
+  @property
+  def boundary(self) -> bytes:
+    if self.headers['content-type'].media_type is not panic_datatypes.MEDIA_MULTIPART:
+      raise panic_exceptions.ServerError(f'Content-Type[{self.headers["content-type"].value}] not supported')
+
+    boundary = self.headers['content-type'].parameters.get('boundary')
+    if not boundary:
+      raise panic_exceptions.BadRequest('Multipart request-body without boundary')
+
+    return boundary.encode('latin-1')
+
+  def multipart(self) -> typing.AsyncIterator[panic_multipart.MultipartPart]:
+    """
+    Async iterator over the parts of a multipart/form-data body. `stream_body` routes read each part
+    from the connection while iterating, other routes iterate the parts spooled by `form`.
+    """
+    if isinstance(self.body, StreamingRequestBody):
+      return panic_multipart.MultipartReader(self.body, self.boundary)
+
+    return _aiter(self.form['files'])
+
   @property
   def cookies(self):
     raise NotImplementedError
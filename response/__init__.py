@@ -1,14 +1,52 @@
+import re
 import typing
 
-import json as pjson
-
 from panic import \
     exceptions as panic_exceptions, \
     datatypes as panic_datatypes
 from panic.response import \
-    datatypes as response_datatypes
+    compression as response_compression, \
+    datatypes as response_datatypes, \
+    serializers as response_serializers
+
+KEEP_ALIVE = panic_datatypes.ServerParams.keep_alive_timeout
+# Appended to every response that doesn't set its own keep-alive header
+DEFAULT_HEADERS = f'connection:keep-alive\r\nkeep-alive:timeout={KEEP_ALIVE}\r\n'.encode()
+# Bodies above this are handed to the transport next to the header block instead of being copied into it
+VECTORED_THRESHOLD = 2 ** 14
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+STAT_CACHE = response_datatypes.StatCache()
+JSON_SERIALIZER = response_serializers.get(panic_datatypes.ServiceParams.json_serializer)
+# `json_array` collects encoded items up to this size before writing a chunk
+JSON_ARRAY_CHUNK = 2 ** 14
+
+def body_length(body: typing.Union[bytes, bytearray, memoryview]) -> int:
+  return body.nbytes if isinstance(body, memoryview) else len(body)
+
+def write_buffers(transport: typing.Any, buffers: typing.Iterable[typing.Union[bytes, bytearray, memoryview]]) -> None:
+  """
+  Writes `buffers` in order without copying the large ones. Up to Python 3.11 `transport.writelines`
+  joins everything into one bytes object, while `transport.write` sends a buffer straight to the
+  socket when nothing is queued. What the socket didn't take is still copied into the transport's
+  own buffer on 3.11, 3.12 queues it as a view. Small buffers are joined, so they go out in one send.
+  """
+  pending = []
+  for buffer in buffers:
+    if body_length(buffer) < VECTORED_THRESHOLD:
+      pending.append(buffer)
+      continue
+
+    if pending:
+      transport.write(b''.join(pending))
+      pending.clear()
+
+    # The transport slices off what the socket took, a memoryview keeps that slice from copying
+    transport.write(buffer if isinstance(buffer, memoryview) else memoryview(buffer))
+
+  if pending:
+    transport.write(b''.join(pending))
 
-KEEP_ALIVE = 5
 class Response:
   __slots__ = ('body', 'status', 'headers', 'cookies')
   def __init__(self, body: bytes = None, status: int = 200, headers: typing.Dict = {}, cookies: typing.Dict = {}) -> None:
@@ -16,12 +54,6 @@ class Response:
     if 'content-type' not in self.headers:
       raise panic_exceptions.MissingRequiredHeader('Content-Type')
 
-    if 'keep-alive' not in self.headers:
-      self.headers.append('connection', 'keep-alive')
-      self.headers.append('keep-alive', f'timeout={KEEP_ALIVE}')
-
-    self.headers.append('content-length', str(len(body)))
-
     self.cookies = panic_datatypes.HTTPCookies().merge(cookies)
     self.body = body
     self.status = status
@@ -37,17 +69,53 @@ class Response:
       b'',
       b''])
 
-  def output(self, version: str = '1.1') -> bytes:
+  def head(self, version: str = '1.1') -> bytes:
     return b'\r\n'.join([
-      f'HTTP/{version} {self.status:d}'.encode(),
+      response_datatypes.status_line(self.status, str(version)),
       self.headers.render(),
       #self.cookies.render(),
+      b'%bcontent-length:%d' % (DEFAULT_HEADERS if 'keep-alive' not in self.headers else b'', body_length(self.body)),
       b'',
-      self.body
-    ])
+      b''])
+
+  def output(self, version: str = '1.1') -> bytes:
+    return b''.join([self.head(version), self.body])
+
+  def with_body(self, body: typing.Union[bytes, bytearray, memoryview]) -> 'Response':
+    """
+    Copy of this response with another body and its own headers, the original is left untouched
+    """
+    response = Response.__new__(Response)
+    response.body = body
+    response.status = self.status
+    response.headers = self.headers.copy()
+    response.cookies = self.cookies
+    return response
+
+  def output_parts(self, version: str = '1.1') -> typing.List[typing.Union[bytes, bytearray, memoryview]]:
+    """
+    Header block and body as separate buffers for `write_buffers`, so large bodies, including
+    bytearray and memoryview bodies, are never copied to prepend the headers
+    """
+    if body_length(self.body) < VECTORED_THRESHOLD:
+      return [self.output(version)]
+
+    body = self.body
+    if isinstance(body, memoryview) and body.format != 'B':
+      # Transports count bytes, typed views are re-exposed as unsigned bytes without copying
+      body = body.cast('B')
+
+    return [self.head(version), body]
+
+  def freeze(self) -> 'FrozenResponse':
+    """
+    Renders this response once for every HTTP version, for fixed responses such as health checks
+    or canned errors
+    """
+    return FrozenResponse(self)
 
   def __repr__(self):
-    return 'Response[%s:%s]' % (self.headers['content-length'], self.headers['content-type'])
+    return 'Response[%s:%s]' % (body_length(self.body), self.headers['content-type'])
 
   # @property
   # https://tools.ietf.org/html/rfc6265#section-3.1
@@ -57,27 +125,231 @@ class Response:
 
   #  return self._cookies
 
-def json_dumps(datum: typing.Dict[typing.Any, typing.Any]) -> str:
-  # ujson
-  return pjson.dumps(datum)
+class FrozenResponse:
+  """
+  Immutable, pre-rendered Response. `output` returns the same bytes object every time.
+  """
+  __slots__ = ('status', '_rendered', '_heads')
+  def __init__(self, response: Response) -> None:
+    self.status = response.status
+    self._rendered = {version: response.output(version) for version in response_datatypes.HTTP_VERSIONS}
+    self._heads = {version: response.head(version) for version in response_datatypes.HTTP_VERSIONS}
+
+  def head(self, version: str = '1.1') -> bytes:
+    return self._heads[str(version)]
+
+  def output(self, version: str = '1.1') -> bytes:
+    return self._rendered[str(version)]
+
+  def output_parts(self, version: str = '1.1') -> typing.List[bytes]:
+    return [self._rendered[str(version)]]
+
+  def __repr__(self):
+    return 'FrozenResponse[%s]' % self.status
+
+class FileResponse:
+  """
+  Response whose body is `count` bytes of the file at `path` starting at `offset`. The protocol sends
+  it with `loop.sendfile`, which uses os.sendfile where the transport allows and chunked reads otherwise.
+  """
+  __slots__ = ('path', 'offset', 'count', 'status', 'headers', 'cookies')
+  def __init__(self, path: str, offset: int, count: int, status: int = 200, headers: typing.Dict = {}, cookies: typing.Dict = {}) -> None:
+    self.headers = panic_datatypes.HTTPHeaders().merge(headers)
+    self.cookies = panic_datatypes.HTTPCookies().merge(cookies)
+    self.path = path
+    self.offset = offset
+    self.count = count
+    self.status = status
+
+  def head(self, version: str = '1.1') -> bytes:
+    return b'\r\n'.join([
+      response_datatypes.status_line(self.status, str(version)),
+      self.headers.render(),
+      b'%bcontent-length:%d' % (DEFAULT_HEADERS if 'keep-alive' not in self.headers else b'', self.count),
+      b'',
+      b''])
+
+  def __repr__(self):
+    return 'FileResponse[%s:%s-%s]' % (self.path, self.offset, self.offset + self.count)
+
+class StreamingResponse:
+  """
+  Response whose body is an async iterator of bytes or str. The protocol writes `head()` and then
+  every chunk as it's produced, using chunked transfer encoding for HTTP/1.1 clients.
+  """
+  __slots__ = ('body', 'status', 'headers', 'cookies', 'chunked')
+  def __init__(self, body: typing.AsyncIterator, status: int = 200, headers: typing.Dict = {}, cookies: typing.Dict = {}) -> None:
+    self.headers = panic_datatypes.HTTPHeaders().merge(headers)
+    if 'content-type' not in self.headers:
+      raise panic_exceptions.MissingRequiredHeader('Content-Type')
+
+    self.cookies = panic_datatypes.HTTPCookies().merge(cookies)
+    self.body = body
+    self.status = status
+    self.chunked = True
+
+  def head(self, version: str = '1.1') -> bytes:
+    # HTTP/1.0 doesn't know chunked encoding, the body is delimited by closing the connection
+    self.chunked = version != '1.0'
+    return b'\r\n'.join([
+      response_datatypes.status_line(self.status, version),
+      self.headers.render(),
+      b'%btransfer-encoding:chunked' % (DEFAULT_HEADERS if 'keep-alive' not in self.headers else b'') if self.chunked else b'connection:close',
+      b'',
+      b''])
+
+  def encode(self, datum: typing.Union[bytes, str]) -> bytes:
+    if isinstance(datum, str):
+      datum = datum.encode('utf-8')
+
+    if self.chunked:
+      return b'%x\r\n%b\r\n' % (len(datum), datum)
+
+    return datum
+
+  def tail(self) -> bytes:
+    return b'0\r\n\r\n' if self.chunked else b''
+
+  def with_body(self, body: typing.AsyncIterator) -> 'StreamingResponse':
+    """
+    Copy of this response with another body and its own headers, the original is left untouched
+    """
+    response = StreamingResponse.__new__(StreamingResponse)
+    response.body = body
+    response.status = self.status
+    response.headers = self.headers.copy()
+    response.cookies = self.cookies
+    response.chunked = self.chunked
+    return response
+
+  def __repr__(self):
+    return 'StreamingResponse[%s:%s]' % (self.status, self.headers['content-type'])
+
+def set_json_serializer(serializer: typing.Union[str, response_serializers.JSONSerializer]) -> None:
+  global JSON_SERIALIZER
+  if not isinstance(serializer, response_serializers.JSONSerializer):
+    serializer = response_serializers.get(serializer)
 
-def json(body: typing.Dict, status: int = 200, headers: typing.Dict[str, str] = {}) -> Response:
+  JSON_SERIALIZER = serializer
+
+def json_dumps(datum: typing.Any, serializer: response_serializers.JSONSerializer = None) -> bytes:
+  return (serializer or JSON_SERIALIZER).dumps(datum)
+
+def json(body: typing.Any,
+    status: int = 200,
+    headers: typing.Dict[str, str] = {},
+    serializer: response_serializers.JSONSerializer = None) -> Response:
+  headers = dict(headers)
   headers['Content-Type'] = 'application/json'
-  return Response(json_dumps(body).encode('utf-8'), status=status, headers=headers)
+  return Response(json_dumps(body, serializer), status=status, headers=headers)
+
+async def _aiter(items: typing.Iterable) -> typing.AsyncIterator:
+  for item in items:
+    yield item
+
+async def _json_array(items: typing.Union[typing.Iterable, typing.AsyncIterable], serializer: response_serializers.JSONSerializer) -> typing.AsyncIterator[bytes]:
+  dumps = (serializer or JSON_SERIALIZER).dumps
+  buffer = bytearray(b'[')
+  separator = b''
+  async for item in items if hasattr(items, '__aiter__') else _aiter(items):
+    buffer += separator
+    buffer += dumps(item)
+    separator = b','
+    if len(buffer) >= JSON_ARRAY_CHUNK:
+      yield bytes(buffer)
+      buffer.clear()
+
+  buffer += b']'
+  yield bytes(buffer)
+
+def json_array(items: typing.Union[typing.Iterable, typing.AsyncIterable],
+    status: int = 200,
+    headers: typing.Dict[str, str] = {},
+    serializer: response_serializers.JSONSerializer = None) -> StreamingResponse:
+  """
+  Streams a JSON array whose items are encoded one at a time, for result sets too large to render at once
+  """
+  return stream(_json_array(items, serializer), status=status, headers=headers, content_type='application/json')
 
 def text(body: str, status: int = 200, headers: typing.Dict[str, str] = {}) -> Response:
   headers['Content-Type'] = 'text/plain'
   return Response(body.encode('utf-8'), status=status, headers=headers)
 
-# async def file(location, mime_type=None, headers=None):
-#     filename = path.split(location)[-1]
-# 
-#     async with open_async(location, mode='rb') as _file:
-#         out_stream = await _file.read()
-# 
-#     mime_type = mime_type or guess_type(filename)[0] or 'text/plain'
-# 
-#     return HTTPResponse(status=200,
-#                         headers=headers,
-#                         content_type=mime_type,
-#                         body_bytes=out_stream)
+def stream(body: typing.AsyncIterator, status: int = 200, headers: typing.Dict[str, str] = {}, content_type: str = 'application/octet-stream') -> StreamingResponse:
+  headers = dict(headers)
+  headers.setdefault('Content-Type', content_type)
+  return StreamingResponse(body, status=status, headers=headers)
+
+def file(location: str,
+    request: typing.Any = None,
+    status: int = 200,
+    headers: typing.Dict[str, str] = {},
+    mime_type: str = None) -> typing.Union[Response, FileResponse]:
+  """
+  Answers conditional (If-None-Match, If-Modified-Since) and single `Range` requests from the stat
+  cache, without opening the file. A precompressed `.br` or `.gz` sibling is sent instead of the file
+  when the client accepts its coding.
+  """
+  try:
+    stat = STAT_CACHE.get(location)
+  except OSError as err:
+    raise panic_exceptions.FileNotFound(f'File[{location}] not found', location, getattr(request, 'url', None))
+
+  headers = dict(headers)
+  headers.setdefault('Content-Type', mime_type or stat.content_type)
+  request_headers = request.headers if request is not None else None
+
+  if request_headers is not None and 'range' not in request_headers:
+    accept_encoding = request_headers.get('accept-encoding')
+    if accept_encoding is not None:
+      for coding, suffix in response_compression.PRECOMPRESSED:
+        if not response_compression.accepts(accept_encoding.value, coding):
+          continue
+
+        try:
+          stat = STAT_CACHE.get(location + suffix)
+        except OSError:
+          continue
+
+        location = stat.path
+        headers['Content-Encoding'] = coding
+        headers['Vary'] = 'Accept-Encoding'
+        break
+
+  headers['ETag'] = stat.etag
+  headers['Last-Modified'] = stat.last_modified
+  headers['Accept-Ranges'] = 'bytes'
+
+  if request_headers is not None:
+    if_none_match = request_headers.get('if-none-match')
+    if if_none_match is not None:
+      if stat.etag in [tag.strip() for tag in if_none_match.value.split(',')] or if_none_match.value.strip() == '*':
+        return Response(b'', status=response_datatypes.StatusCode.NotModified.value, headers=headers)
+
+    else:
+      if_modified_since = request_headers.get('if-modified-since')
+      if if_modified_since is not None and not stat.modified_since(if_modified_since.value):
+        return Response(b'', status=response_datatypes.StatusCode.NotModified.value, headers=headers)
+
+    range_header = request_headers.get('range')
+    if range_header is not None and status == 200:
+      match = RANGE_PATTERN.match(range_header.value.strip())
+      # Multiple ranges aren't supported, the full file is a valid answer to those
+      if match is not None and any(match.groups()):
+        start, end = match.groups()
+        if start:
+          offset = int(start)
+          last = min(int(end), stat.size - 1) if end else stat.size - 1
+
+        else:
+          offset = max(stat.size - int(end), 0)
+          last = stat.size - 1
+
+        if offset >= stat.size or last < offset:
+          headers['Content-Range'] = f'bytes */{stat.size}'
+          return Response(b'', status=response_datatypes.StatusCode.RequestedRangeNotSatisfiable.value, headers=headers)
+
+        headers['Content-Range'] = f'bytes {offset}-{last}/{stat.size}'
+        return FileResponse(location, offset, last - offset + 1, status=response_datatypes.StatusCode.PartialContent.value, headers=headers)
+
+  return FileResponse(location, 0, stat.size, status=status, headers=headers)
@@ -0,0 +1,345 @@
+import logging
+import typing
+import zlib
+
+from collections import OrderedDict
+from functools import lru_cache
+
+from panic import \
+    exceptions as panic_exceptions, \
+    response as panic_response
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = frozenset([
+  'application/json',
+  'application/javascript',
+  'application/x-javascript',
+  'application/xml',
+  'application/x-ndjson',
+  'application/jsonl',
+  'application/wasm',
+  'image/svg+xml',
+])
+# Statuses whose responses carry no body
+UNCOMPRESSED_STATUSES = frozenset([204, 304])
+
+def compressible(media_type: str) -> bool:
+  return media_type.startswith('text/') or media_type in COMPRESSIBLE_TYPES or media_type.endswith(('+json', '+xml'))
+
+class ZlibStream:
+  __slots__ = ('_compressor',)
+  def __init__(self, level: int, wbits: int) -> None:
+    self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+  def compress(self, datum: bytes) -> bytes:
+    # Sync-flushed so every chunk reaches the client as soon as it's produced
+    return self._compressor.compress(datum) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+  def finish(self) -> bytes:
+    return self._compressor.flush(zlib.Z_FINISH)
+
+class BrotliStream:
+  __slots__ = ('_compressor',)
+  def __init__(self, level: int) -> None:
+    self._compressor = brotli.Compressor(quality=level)
+
+  def compress(self, datum: bytes) -> bytes:
+    return self._compressor.process(datum) + self._compressor.flush()
+
+  def finish(self) -> bytes:
+    return self._compressor.finish()
+
+class ZstdStream:
+  __slots__ = ('_compressor',)
+  def __init__(self, level: int) -> None:
+    self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+  def compress(self, datum: bytes) -> bytes:
+    return self._compressor.compress(datum) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+  def finish(self) -> bytes:
+    return self._compressor.flush()
+
+class Codec:
+  """
+  A content-coding at a fixed level: `compress` for whole bodies, `stream` for chunked responses
+  """
+  name: str
+  level: int
+  __slots__ = ('name', 'level')
+
+  def __init__(self, name: str, level: int) -> None:
+    self.name = name
+    self.level = level
+
+  def compress(self, datum: bytes) -> bytes:
+    if self.name == 'br':
+      return brotli.compress(bytes(datum), quality=self.level)
+
+    if self.name == 'zstd':
+      return zstandard.ZstdCompressor(level=self.level).compress(datum)
+
+    # zlib.compress only takes wbits from Python 3.11 on
+    compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31 if self.name == 'gzip' else 15)
+    return compressor.compress(datum) + compressor.flush()
+
+  def stream(self) -> typing.Union[ZlibStream, BrotliStream, ZstdStream]:
+    if self.name == 'br':
+      return BrotliStream(self.level)
+
+    if self.name == 'zstd':
+      return ZstdStream(self.level)
+
+    return ZlibStream(self.level, 31 if self.name == 'gzip' else 15)
+
+  def __repr__(self) -> str:
+    return f'Codec[{self.name}:{self.level}]'
+
+# Server preference, first is used when a client accepts several equally
+DEFAULT_LEVELS = OrderedDict((name, level) for name, level, module in (
+  ('br', 4, brotli),
+  ('zstd', 3, zstandard),
+  ('gzip', 6, zlib),
+  ('deflate', 6, zlib),
+) if module is not None)
+# Suffixes of precompressed siblings served by `response.file`
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+@lru_cache(maxsize=256)
+def parse_accept_encoding(value: str) -> typing.Dict[str, float]:
+  """
+  Content-codings of an Accept-Encoding value with their q-values, memoized per distinct value
+  """
+  qualities = {}
+  for item in value.split(','):
+    name, _, parameters = item.partition(';')
+    name = name.strip().lower()
+    if not name:
+      continue
+
+    quality = 1.0
+    for parameter in parameters.split(';'):
+      key, _, datum = parameter.partition('=')
+      if key.strip().lower() == 'q':
+        try:
+          quality = float(datum)
+        except ValueError:
+          quality = 0.0
+
+    qualities['gzip' if name == 'x-gzip' else name] = quality
+
+  return qualities
+
+def accepts(value: str, coding: str) -> bool:
+  qualities = parse_accept_encoding(value)
+  return qualities.get(coding, qualities.get('*', 0.0)) > 0
+
+def negotiate(value: str, codings: typing.Iterable[str]) -> typing.Optional[str]:
+  """
+  Best of `codings` for an Accept-Encoding value, ties go to the earlier coding
+  """
+  qualities = parse_accept_encoding(value)
+  wildcard = qualities.get('*', 0.0)
+  best, best_quality = None, 0.0
+  for coding in codings:
+    quality = qualities.get(coding, wildcard)
+    if quality > best_quality:
+      best, best_quality = coding, quality
+
+  return best
+
+class CompressionCache:
+  """
+  LRU of compressed bodies keyed by content-coding and the uncompressed bytes, bounded by the bytes it
+  holds. Bytes objects cache their hash, so a repeated body object is looked up without rehashing.
+  """
+  max_size: int
+  size: int
+  hits: int
+  misses: int
+  _entries: typing.Dict[typing.Tuple[str, bytes], bytes]
+  __slots__ = ('max_size', 'size', 'hits', 'misses', '_entries')
+
+  def __init__(self, max_size: int) -> None:
+    self.max_size = max_size
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+
+  def get(self, coding: str, body: bytes) -> typing.Optional[bytes]:
+    compressed = self._entries.get((coding, body))
+    if compressed is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    self._entries.move_to_end((coding, body))
+    return compressed
+
+  def put(self, coding: str, body: bytes, compressed: bytes) -> None:
+    cost = len(body) + len(compressed)
+    # A single entry may not take more than a sixteenth of the cache
+    if cost * 16 > self.max_size or (coding, body) in self._entries:
+      return
+
+    self._entries[(coding, body)] = compressed
+    self.size += cost
+    while self.size > self.max_size:
+      (_, evicted), evicted_compressed = self._entries.popitem(last=False)
+      self.size -= len(evicted) + len(evicted_compressed)
+
+  def stats(self) -> typing.Dict[str, int]:
+    return {'entries': len(self._entries), 'size': self.size, 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+  def __repr__(self) -> str:
+    return f'CompressionCache[{self.size}/{self.max_size}]'
+
+class CompressedStream:
+  """
+  Compressed chunks of a streaming body. Closing it closes the body too, even when it was never
+  iterated, as for a HEAD request.
+  """
+  body: typing.AsyncIterator
+  stream: typing.Union[ZlibStream, BrotliStream, ZstdStream]
+  __slots__ = ('body', 'stream', '_chunks')
+
+  def __init__(self, body: typing.AsyncIterator, stream: typing.Union[ZlibStream, BrotliStream, ZstdStream]) -> None:
+    self.body = body
+    self.stream = stream
+    self._chunks = self._compress()
+
+  async def _compress(self) -> typing.AsyncIterator[bytes]:
+    async for datum in self.body:
+      if isinstance(datum, str):
+        datum = datum.encode('utf-8')
+
+      compressed = self.stream.compress(datum)
+      if compressed:
+        yield compressed
+
+    tail = self.stream.finish()
+    if tail:
+      yield tail
+
+  def __aiter__(self) -> 'CompressedStream':
+    return self
+
+  def __anext__(self) -> typing.Awaitable[bytes]:
+    return self._chunks.__anext__()
+
+  async def aclose(self) -> None:
+    await self._chunks.aclose()
+    if hasattr(self.body, 'aclose'):
+      await self.body.aclose()
+
+  def __repr__(self) -> str:
+    return f'CompressedStream[{type(self.stream).__name__}]'
+
+class Compression:
+  """
+  Compresses responses for clients that accept it. Bodies below `threshold` are left alone, bodies above
+  `executor_threshold` are compressed on `executor` so the event loop keeps serving, streaming responses
+  are compressed chunk by chunk. Pre-rendered and file responses are passed through.
+  """
+  codecs: typing.Dict[str, Codec]
+  threshold: int
+  executor_threshold: int
+  cache: CompressionCache
+
+  def __init__(self, params: typing.Any, executor: typing.Callable = None) -> None:
+    levels = dict(DEFAULT_LEVELS)
+    for item in params.compression_levels.split(','):
+      name, _, level = item.partition('=')
+      if name.strip() in levels and level.strip():
+        levels[name.strip()] = int(level)
+
+    self.codecs = OrderedDict((name, Codec(name, level)) for name, level in levels.items())
+    self.threshold = params.compression_threshold
+    self.executor_threshold = params.compression_executor_threshold
+    self.cache = CompressionCache(params.compression_cache_size)
+    self.executor = executor
+
+  def _compressible(self, response: typing.Any) -> bool:
+    if response.status in UNCOMPRESSED_STATUSES or 'content-encoding' in response.headers:
+      return False
+
+    return compressible(response.headers['content-type'].media_type)
+
+  def _coding(self, request: typing.Any) -> typing.Optional[Codec]:
+    accept_encoding = request.headers.get('accept-encoding')
+    if accept_encoding is None:
+      return None
+
+    coding = negotiate(accept_encoding.value, self.codecs)
+    return None if coding is None else self.codecs[coding]
+
+  def _encoded(self, response: typing.Any, body: typing.Any, codec: typing.Optional[Codec]) -> typing.Any:
+    """
+    Copy of `response` with `body` in `codec` and Vary set, handlers may return the same response
+    object to every request so it's never changed itself
+    """
+    encoded = response.with_body(body)
+    if codec is not None:
+      encoded.headers.append('Content-Encoding', codec.name)
+
+    vary = response.headers.get('vary')
+    if vary is None:
+      encoded.headers.append('Vary', 'Accept-Encoding')
+
+    elif 'accept-encoding' not in vary.value.lower():
+      encoded.headers.append('Vary', f'{vary.value}, Accept-Encoding')
+
+    return encoded
+
+  async def __call__(self, request: typing.Any, response: typing.Any) -> typing.Any:
+    if type(response) is panic_response.StreamingResponse:
+      if not self._compressible(response):
+        return response
+
+      codec = self._coding(request)
+      return self._encoded(response, response.body if codec is None else CompressedStream(response.body, codec.stream()), codec)
+
+    if type(response) is not panic_response.Response or panic_response.body_length(response.body) < self.threshold:
+      return response
+
+    if not self._compressible(response):
+      return response
+
+    codec = self._coding(request)
+    if codec is None:
+      return self._encoded(response, response.body, None)
+
+    body = response.body
+    cacheable = type(body) is bytes
+    compressed = self.cache.get(codec.name, body) if cacheable else None
+    if compressed is None:
+      compressed = await self._compress(codec, body)
+      if cacheable:
+        self.cache.put(codec.name, body, compressed)
+
+    return self._encoded(response, compressed, codec)
+
+  async def _compress(self, codec: Codec, body: bytes) -> bytes:
+    if self.executor is not None and panic_response.body_length(body) >= self.executor_threshold:
+      try:
+        return await self.executor(codec.compress, body)
+      except panic_exceptions.ServiceUnavailable:
+        # The pool is saturated, compressing here is better than rejecting the response
+        pass
+
+    return codec.compress(body)
+
+  def __repr__(self) -> str:
+    return f'Compression[{",".join(self.codecs)}]'
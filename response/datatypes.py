@@ -1,4 +1,13 @@
 import enum
+import mimetypes
+import os
+import stat as pstat
+import time
+import typing
+
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
 
 class StatusCode(enum.Enum):
   Continue: int = 100
@@ -59,3 +68,112 @@ class StatusCode(enum.Enum):
   NotExtended: int = 510
   NetworkAuthenticationRequired: int = 511
 
+
+HTTP_VERSIONS = ('1.0', '1.1')
+
+def reason_phrase(status: int) -> str:
+  try:
+    return HTTPStatus(status).phrase
+  except ValueError:
+    return ''
+
+# Rendered once at import, `Response.output` only does a dict lookup per response
+STATUS_LINES: typing.Dict[typing.Tuple[str, int], bytes] = {
+  (version, code.value): f'HTTP/{version} {code.value:d} {reason_phrase(code.value)}'.encode()
+  for version in HTTP_VERSIONS
+  for code in StatusCode
+}
+
+def status_line(status: int, version: str = '1.1') -> bytes:
+  try:
+    return STATUS_LINES[(version, status)]
+  except KeyError:
+    return f'HTTP/{version} {status:d} {reason_phrase(status)}'.encode()
+
+class FileStat:
+  """
+  What a file response needs from `os.stat`, with the validators rendered once
+  """
+  path: str
+  size: int
+  mtime: int
+  etag: str
+  last_modified: str
+  content_type: str
+  checked: float
+  __slots__ = ('path', 'size', 'mtime', 'etag', 'last_modified', 'content_type', 'checked')
+
+  def __init__(self, path: str, stat: os.stat_result, checked: float) -> None:
+    self.path = path
+    self.size = stat.st_size
+    self.mtime = int(stat.st_mtime)
+    self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    self.last_modified = formatdate(self.mtime, usegmt=True)
+    self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    self.checked = checked
+
+  def modified_since(self, value: str) -> bool:
+    try:
+      return self.mtime > parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+      return True
+
+  def __repr__(self) -> str:
+    return f'FileStat[{self.path}:{self.size}]'
+
+class StatCache:
+  """
+  Bounded LRU of FileStat, entries are re-validated with `os.stat` once they're older than `ttl`.
+  Missing files are remembered for `ttl` as well, precompressed siblings are probed on every request.
+  """
+  size: int
+  ttl: float
+  _entries: typing.Dict[str, FileStat]
+  _missing: typing.Dict[str, float]
+  __slots__ = ('size', 'ttl', '_entries', '_missing')
+
+  def __init__(self, size: int = 1024, ttl: float = 1.0) -> None:
+    self.size = size
+    self.ttl = ttl
+    self._entries = OrderedDict()
+    self._missing = OrderedDict()
+
+  def get(self, path: str) -> FileStat:
+    """
+    Raises FileNotFoundError for missing files and IsADirectoryError for directories
+    """
+    now = time.monotonic()
+    entry = self._entries.get(path)
+    if entry is not None and now - entry.checked < self.ttl:
+      self._entries.move_to_end(path)
+      return entry
+
+    checked = self._missing.get(path)
+    if checked is not None and now - checked < self.ttl:
+      raise FileNotFoundError(path)
+
+    try:
+      stat = os.stat(path)
+    except FileNotFoundError:
+      self._entries.pop(path, None)
+      self._missing[path] = now
+      self._missing.move_to_end(path)
+      if len(self._missing) > self.size:
+        self._missing.popitem(last=False)
+
+      raise
+
+    self._missing.pop(path, None)
+    if not pstat.S_ISREG(stat.st_mode):
+      self._entries.pop(path, None)
+      raise IsADirectoryError(path)
+
+    entry = self._entries[path] = FileStat(path, stat, now)
+    self._entries.move_to_end(path)
+    if len(self._entries) > self.size:
+      self._entries.popitem(last=False)
+
+    return entry
+
+  def __repr__(self) -> str:
+    return f'StatCache[{len(self._entries)}/{self.size}]'
@@ -0,0 +1,120 @@
+import dataclasses
+import datetime
+import decimal
+import enum
+import json as pjson
+import typing
+import uuid
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import ujson
+except ImportError:
+  ujson = None
+
+def default(datum: typing.Any) -> typing.Any:
+  """
+  Fallback for types the serializers don't know natively. NumPy arrays and scalars are recognised by
+  their `tolist` method, so numpy is never imported here.
+  """
+  if hasattr(datum, 'tolist'):
+    return datum.tolist()
+
+  if isinstance(datum, (datetime.datetime, datetime.date, datetime.time)):
+    return datum.isoformat()
+
+  if dataclasses.is_dataclass(datum) and not isinstance(datum, type):
+    return dataclasses.asdict(datum)
+
+  if isinstance(datum, enum.Enum):
+    return datum.value
+
+  if isinstance(datum, (uuid.UUID, decimal.Decimal)):
+    return str(datum)
+
+  if isinstance(datum, (set, frozenset, tuple)):
+    return list(datum)
+
+  raise TypeError(f'Type[{type(datum).__name__}] is not JSON serializable')
+
+def decimals_to_str(datum: typing.Any) -> typing.Any:
+  """
+  Copy of `datum` with its Decimals as strings. ujson writes Decimals as numbers without calling
+  `default`, handlers returning Decimals pass them through this so every serializer writes the same
+  JSON. It walks the whole value, so serializers never call it themselves.
+  """
+  if isinstance(datum, dict):
+    return {key: decimals_to_str(value) for key, value in datum.items()}
+
+  if isinstance(datum, (list, tuple, set, frozenset)):
+    return [decimals_to_str(value) for value in datum]
+
+  if isinstance(datum, decimal.Decimal):
+    return str(datum)
+
+  return datum
+
+class JSONSerializer:
+  """
+  Turns a value into JSON encoded as UTF-8 bytes
+  """
+  name: str = None
+
+  def dumps(self, datum: typing.Any) -> bytes:
+    raise NotImplementedError
+
+  def __repr__(self) -> str:
+    return f'JSONSerializer[{self.name}]'
+
+class OrjsonSerializer(JSONSerializer):
+  name = 'orjson'
+
+  def __init__(self) -> None:
+    # orjson handles datetimes, dataclasses and UUIDs itself and returns bytes
+    self._options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+  def dumps(self, datum: typing.Any) -> bytes:
+    return orjson.dumps(datum, default=default, option=self._options)
+
+class UjsonSerializer(JSONSerializer):
+  """
+  ujson converts Decimals to floats itself, before `default` sees them: `Decimal('2.50')` is written
+  as `2.5` where orjson and the standard library write `"2.50"`. See `decimals_to_str`.
+  """
+  name = 'ujson'
+
+  def dumps(self, datum: typing.Any) -> bytes:
+    return ujson.dumps(datum, default=default, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+
+class StdlibSerializer(JSONSerializer):
+  name = 'json'
+
+  def __init__(self) -> None:
+    self._encoder = pjson.JSONEncoder(default=default, ensure_ascii=False, separators=(',', ':'))
+
+  def dumps(self, datum: typing.Any) -> bytes:
+    return self._encoder.encode(datum).encode('utf-8')
+
+SERIALIZERS = {
+  serializer.name: serializer for serializer, module in (
+    (OrjsonSerializer, orjson),
+    (UjsonSerializer, ujson),
+    (StdlibSerializer, pjson),
+  ) if module is not None
+}
+
+def get(name: str = 'auto') -> JSONSerializer:
+  """
+  `auto` picks the fastest installed serializer: orjson, then ujson, then the standard library
+  """
+  if name == 'auto':
+    name = next(iter(SERIALIZERS))
+
+  try:
+    return SERIALIZERS[name]()
+  except KeyError:
+    raise ValueError(f'JSON serializer[{name}] is not available, installed: {", ".join(SERIALIZERS)}')
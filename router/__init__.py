@@ -1,13 +1,16 @@
 import inspect
+import os
 import re
 import typing
+import urllib.parse
 
 from collections import defaultdict
-from functools import lru_cache
 from panic import \
+    codec as panic_codec, \
     exceptions as panic_exceptions, \
     datatypes as panic_datatypes, \
-    request as panic_request
+    request as panic_request, \
+    response as panic_response
 
 from panic.router import datatypes as router_datatypes
 
@@ -17,70 +20,217 @@ REGEX_TYPES = {
   'int': (int, r'\d+'),
   'number': (float, r'[0-9\\.]+'),
   'alpha': (str, r'[A-Za-z]+'),
+  # Matches the rest of the url, slashes included, and must be the last segment
+  'path': (str, r'.+'),
 }
 
+PRIORITY = {kind: index for index, kind in enumerate(['int', 'number', 'alpha', 'string', 'path'])}
+
 class Router:
   _routes: typing.Dict[str, router_datatypes.URIRoute]
+  _static: typing.Dict[str, typing.Dict[panic_datatypes.HTTPMethod, router_datatypes.URIRoute]]
+  _tree: router_datatypes.RouteNode
+  cache: router_datatypes.RouteCache
 
   def __init__(self, service: object):
     self._service = service
     self.methods = {method.name.lower():method for method in service.params.supported_methods}
     self._routes = {}
+    self._static = {}
+    self._tree = router_datatypes.RouteNode()
+    cache_size = service.params.route_cache_size
+    self.cache = router_datatypes.RouteCache(CACHE_SIZE if cache_size is None else cache_size)
 
   def __contains__(self, item):
     return item in self._routes
 
+  def _register(self, route: router_datatypes.URIRoute) -> None:
+    if route in self:
+      raise panic_exceptions.InvalidRoute(f'Route[{route}] already exists.')
+
+    try:
+      route.segments = router_datatypes.URIRoute.parse(route.url, REGEX_TYPES)
+      for segment in route.segments[:-1]:
+        if isinstance(segment, router_datatypes.RouteParameter) and segment.kind == 'path':
+          raise ValueError(f'Parameter[{segment.name}] of type[path] must be the last segment')
+
+      node = self._tree
+      for segment in route.segments:
+        node = node.child(segment, PRIORITY)
+
+    except ValueError as err:
+      raise panic_exceptions.InvalidRoute(f'Route[{route}] is invalid: {err}')
+
+    if route.method in node.routes:
+      raise panic_exceptions.InvalidRoute(f'Route[{route}] conflicts with Route[{node.routes[route.method]}]')
+
+    node.routes[route.method] = route
+    if not route.dynamic:
+      self._static.setdefault(route.url, node.routes)
+
+    self._routes[route.identity] = route
+    self.cache.clear()
+
   def _method_factory(self, method_name):
     if method_name in ['channel']:
-      def _wrapper(url, socket_encoding, socket_protocol):
+      def _wrapper(url, socket_encoding='application/octet-stream', socket_protocol='topics', **socket_options):
+        if socket_protocol == 'topics':
+          # Broadcast frames are compressed once for every subscriber, which needs a fresh
+          # deflate context per message
+          if socket_options.get('server_no_context_takeover') is False:
+            raise panic_exceptions.InvalidRoute(f'Channel[{url}] with socket_protocol[topics] requires server_no_context_takeover')
+
+          socket_options['server_no_context_takeover'] = True
+
+        try:
+          socket_params = router_datatypes.SocketParams(**socket_options)
+          codec = panic_codec.get(socket_encoding)
+        except (TypeError, ValueError) as err:
+          raise panic_exceptions.InvalidRoute(f'Channel[{url}] has invalid options: {err}')
+
         def _handler(handler):
           route = router_datatypes.URIRoute(url, panic_datatypes.HTTPMethod.channel, handler,
               inspect.iscoroutinefunction(handler),
               inspect.isasyncgenfunction(handler),
-              socket_encoding, socket_protocol)
-
-          if route in self:
-            raise panic_exceptions.InvalidRoute(f'Route[{route}] already exists.')
-
-          self._routes[route.identity] = route
+              socket_encoding, socket_protocol,
+              socket_params=socket_params,
+              codec=codec)
 
+          self._register(route)
           return handler
         return _handler
       return _wrapper
 
     else:
-      def _wrapper(url):
+      def _wrapper(url, stream_body=False, process=False):
         def _handler(handler):
-          #import ipdb;ipdb.set_trace()
           route = router_datatypes.URIRoute(url, panic_datatypes.HTTPMethod.Match(method_name), handler,
               inspect.iscoroutinefunction(handler),
-              inspect.isasyncgenfunction(handler))
-          if route in self:
-            raise panic_exceptions.InvalidRoute(f'Route[{route}] already exists.')
+              inspect.isasyncgenfunction(handler),
+              stream_body=stream_body,
+              process=process)
+          if process and (route.awaitable or route.streamable or route.stream_body):
+            raise panic_exceptions.InvalidRoute(f'Route[{route}] must be a synchronous handler to run on the process pool')
 
-          self._routes[route.identity] = route
+          self._register(route)
           return handler
   
         return _handler
       return _wrapper
 
-  # Server API
-  # lru-cache
-  def get(self, method: panic_datatypes.HTTPMethod, url: str) -> router_datatypes.URIRoute:
-    route_identity = hash(router_datatypes.URIRoute.route_hasher(url, method))
+  def _resolve(self,
+      node: router_datatypes.RouteNode,
+      segments: typing.List[str],
+      index: int,
+      parameters: typing.Dict[str, typing.Any]) -> typing.Optional[router_datatypes.RouteNode]:
+    if index == len(segments):
+      return node if node.routes else None
+
+    segment = segments[index]
     try:
-      return self._routes[route_identity]
-    except KeyError as err:
+      found = self._resolve(node.static[segment], segments, index + 1, parameters)
+      if found is not None:
+        return found
+
+    except KeyError:
+      pass
+
+    for parameter, child in node.dynamic:
+      if parameter.kind == 'path':
+        try:
+          value = parameter.match('/'.join(segments[index:]))
+        except ValueError:
+          continue
+
+        if child.routes:
+          parameters[parameter.name] = value
+          return child
+
+        continue
+
       try:
-        route_identity = hash(router_datatypes.URIRoute.route_hasher(url, panic_datatypes.HTTPMethod.channel))
-        self._routes[route_identity]
-        raise panic_exceptions.InvalidHTTPMethod(method, url)
-      except KeyError as err:
-        raise panic_exceptions.NotFound(url)
+        value = parameter.match(segment)
+      except ValueError:
+        continue
+
+      found = self._resolve(child, segments, index + 1, parameters)
+      if found is not None:
+        parameters[parameter.name] = value
+        return found
 
-      except AttributeError as err:
+    return None
+
+  # Server API
+  def get(self, method: panic_datatypes.HTTPMethod, url: str) -> typing.Tuple[router_datatypes.URIRoute, typing.Dict[str, typing.Any]]:
+    """
+    Resolves a request path to its route and the casted path parameters, memoized per `(method, url)`
+    """
+    key = (method, url)
+    entry = self.cache.get(key)
+    if entry is None:
+      try:
+        entry = self._lookup(method, url)
+      except (panic_exceptions.NotFound, panic_exceptions.InvalidHTTPMethod) as err:
+        entry = (type(err), str(err), getattr(err, 'allow', None))
+
+      self.cache.put(key, entry)
+
+    if entry[0] is None:
+      return entry[1:]
+
+    if entry[2] is None:
+      raise entry[0](entry[1])
+
+    raise entry[0](entry[1], allow=entry[2])
+
+  @staticmethod
+  def allow(routes: typing.Dict[panic_datatypes.HTTPMethod, router_datatypes.URIRoute]) -> str:
+    """
+    Value of the `Allow` header for a path, HEAD and OPTIONS are implied
+    """
+    methods = set(routes.keys()) | {panic_datatypes.HTTPMethod.options}
+    if panic_datatypes.HTTPMethod.get in methods:
+      methods.add(panic_datatypes.HTTPMethod.head)
+
+    return ', '.join(method.name.upper() for method in panic_datatypes.HTTP_ALLOWABLE if method in methods)
+
+  def _lookup(self, method: panic_datatypes.HTTPMethod, url: str) -> typing.Tuple[None, router_datatypes.URIRoute, typing.Dict[str, typing.Any]]:
+    """
+    Static routes take a single dict lookup, dynamic routes walk the route tree
+    """
+    parameters = {}
+    try:
+      routes = self._static[url]
+    except KeyError:
+      node = self._resolve(self._tree, url.split('/')[1:], 0, parameters)
+      if node is None:
         raise panic_exceptions.NotFound(url)
 
+      routes = node.routes
+
+    try:
+      return None, routes[method], parameters
+    except KeyError as err:
+      pass
+
+    # HEAD runs the GET handler, the protocol writes the head of its response only
+    if method is panic_datatypes.HTTPMethod.head and panic_datatypes.HTTPMethod.get in routes:
+      return None, routes[panic_datatypes.HTTPMethod.get], parameters
+
+    allow = self.allow(routes)
+    if method is panic_datatypes.HTTPMethod.options:
+      # Named after a registered route of the path rather than the requested url
+      route_url = next(iter(routes.values())).url
+      return None, router_datatypes.URIRoute(route_url, method, _options_handler(allow), True), parameters
+
+    raise panic_exceptions.InvalidHTTPMethod(f'Method[{method.name}] not allowed for Route[{url}]', allow=allow)
+
+def _options_handler(allow: str) -> panic_datatypes.FunctionType:
+  response = panic_response.Response(b'', headers={'Allow': allow}).freeze()
+  async def _options(request, **parameters):
+    return response
+
+  return _options
 
 
 class RouterAPI:
@@ -95,40 +245,27 @@ class RouterAPI:
     if name in ['request']:
       return self._router.get
 
+    if name in ['cache']:
+      return self._router.cache
+
     raise panic_exceptions.InvalidHTTPMethod(name)
 
-  #@lru_cache(maxsize=CACHE_SIZE)
-  #def get(self, url, method):
-  #  """
-  #  Gets a request handler based on the URL of the request, or raises an
-  #  error.  Internal method for caching.
-  #  :param url: Request URL
-  #  :param method: Request method
-  #  :return: handler, arguments, keyword arguments
-  #  """
-  #  # Check against known static routes
-  #  route = self.routes_static.get(url)
-  #  if route:
-  #    match = route.pattern.match(url)
-  #  else:
-  #    # Move on to testing all regex routes
-  #    for route in self.routes_dynamic[url_hash(url)]:
-  #      match = route.pattern.match(url)
-  #      if match:
-  #        break
-  #    else:
-  #      # Lastly, check against all regex routes that cannot be hashed
-  #      for route in self.routes_always_check:
-  #        match = route.pattern.match(url)
-  #        if match:
-  #          break
-  #      else:
-  #        raise panic_exceptions.NotFound(f'Requested URL {url} not found')
-
-  #  if route.methods and method not in route.methods:
-  #    raise panic_exceptions.InvalidUsage(f'Method {method} not allowed for URL {url}', status_code=405)
-  #  kwargs = {p.name: p.cast(value)
-  #      for value, p
-  #      in zip(match.groups(1), route.parameters)}
-
-  #  return route.handler, [], kwargs
+  def static(self, url: str, directory: str) -> None:
+    """
+    Serves the files below `directory` at `url`, through the sendfile path of `response.file`
+    """
+    root = os.path.realpath(directory)
+
+    async def _static(request, path):
+      # The containment check runs on the decoded path, `%2e%2e/` must not slip past it
+      path = urllib.parse.unquote(path)
+      if '\x00' in path:
+        raise panic_exceptions.FileNotFound(f'File[{path}] not found', path, request.url)
+
+      location = os.path.realpath(os.path.join(root, path))
+      if not location.startswith(root + os.sep):
+        raise panic_exceptions.FileNotFound(f'File[{path}] not found', location, request.url)
+
+      return panic_response.file(location, request)
+
+    self._router._method_factory('get')(url.rstrip('/') + '/<path:path>')(_static)
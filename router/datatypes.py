@@ -1,22 +1,203 @@
 import hashlib
 import inspect
+import re
 import typing
 
+from collections import OrderedDict
 from urllib.parse import urlparse
 
 from panic import datatypes as panic_datatypes
 
 PWN = typing.TypeVar('PWN')
+PARAMETER_PATTERN = re.compile(r'^<([A-Za-z_][A-Za-z0-9_]*)(?::([A-Za-z]+))?>$')
+
+class RouteParameter:
+  name: str
+  kind: str
+  cast: typing.Callable[[str], typing.Any]
+  pattern: typing.Pattern
+  __slots__ = ('name', 'kind', 'cast', 'pattern')
+
+  def __init__(self, name: str, kind: str, cast: typing.Callable[[str], typing.Any], pattern: str) -> None:
+    self.name = name
+    self.kind = kind
+    self.cast = cast
+    self.pattern = re.compile(pattern)
+
+  def match(self, segment: str) -> typing.Any:
+    """
+    Returns the casted segment or raises ValueError
+    """
+    if self.pattern.fullmatch(segment) is None:
+      raise ValueError(segment)
+
+    return self.cast(segment)
+
+  def __repr__(self) -> str:
+    return f'RouteParameter[{self.name}:{self.kind}]'
+
+class RouteNode:
+  """
+  One segment of the route tree. Static children are resolved with a dict lookup, typed children are
+  tried in priority order and only when no static child can complete the path.
+  """
+  static: typing.Dict[str, 'RouteNode']
+  dynamic: typing.List[typing.Tuple[RouteParameter, 'RouteNode']]
+  routes: typing.Dict[panic_datatypes.HTTPMethod, 'URIRoute']
+  __slots__ = ('static', 'dynamic', 'routes')
+
+  def __init__(self) -> None:
+    self.static = {}
+    self.dynamic = []
+    self.routes = {}
+
+  def child(self, segment: typing.Union[str, RouteParameter], priority: typing.Dict[str, int]) -> 'RouteNode':
+    if isinstance(segment, str):
+      try:
+        return self.static[segment]
+      except KeyError:
+        node = self.static[segment] = RouteNode()
+        return node
+
+    for parameter, node in self.dynamic:
+      if parameter.kind == segment.kind:
+        if parameter.name != segment.name:
+          raise ValueError(f'Parameter[{segment.name}] conflicts with Parameter[{parameter.name}]')
+
+        return node
+
+    node = RouteNode()
+    self.dynamic.append((segment, node))
+    self.dynamic.sort(key=lambda item: priority.get(item[0].kind, len(priority)))
+    return node
+
+  def __repr__(self) -> str:
+    return f'RouteNode[{len(self.static)}:{len(self.dynamic)}:{len(self.routes)}]'
+
+class RouteCache:
+  """
+  Bounded LRU of resolved `(HTTPMethod, path)` lookups. Misses are cached as the exception type and
+  message so NotFound and InvalidHTTPMethod are answered without touching the route tree.
+  """
+  size: int
+  hits: int
+  misses: int
+  evictions: int
+  _entries: typing.Dict[typing.Tuple[panic_datatypes.HTTPMethod, str], typing.Any]
+  __slots__ = ('size', 'hits', 'misses', 'evictions', '_entries')
+
+  def __init__(self, size: int) -> None:
+    self.size = size
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def get(self, key: typing.Tuple[panic_datatypes.HTTPMethod, str]) -> typing.Any:
+    try:
+      entry = self._entries[key]
+    except KeyError:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    self._entries.move_to_end(key)
+    return entry
+
+  def put(self, key: typing.Tuple[panic_datatypes.HTTPMethod, str], entry: typing.Any) -> None:
+    if self.size <= 0:
+      return None
+
+    self._entries[key] = entry
+    if len(self._entries) > self.size:
+      self._entries.popitem(last=False)
+      self.evictions += 1
+
+  def clear(self) -> None:
+    self._entries.clear()
+
+  def stats(self) -> typing.Dict[str, int]:
+    return {
+      'size': self.size,
+      'entries': len(self._entries),
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+    }
+
+  def __repr__(self) -> str:
+    return f'RouteCache[{len(self._entries)}/{self.size}]'
+
+class SocketParams:
+  """
+  Websocket options of a channel route. `max_size`, `max_queue`, `read_limit` and `write_limit` are
+  handed to the websocket protocol, `send_queue` and `overflow` bound a topics Channel. With
+  `compression` the server accepts permessage-deflate offers, messages below `compression_threshold`
+  bytes are sent uncompressed.
+  """
+  __slots__ = (
+    'max_size', 'max_queue', 'read_limit', 'write_limit', 'send_queue', 'overflow',
+    'compression', 'compression_threshold', 'compression_level',
+    'server_no_context_takeover', 'client_no_context_takeover',
+    'server_max_window_bits', 'client_max_window_bits',
+  )
+
+  def __init__(self,
+      max_size: int = panic_datatypes.ServiceParams.channel_max_size,
+      max_queue: int = panic_datatypes.ServiceParams.channel_max_queue,
+      read_limit: int = panic_datatypes.ServiceParams.channel_read_limit,
+      write_limit: int = panic_datatypes.ServiceParams.channel_write_limit,
+      send_queue: int = panic_datatypes.ServiceParams.channel_queue,
+      overflow: str = panic_datatypes.ServiceParams.channel_overflow,
+      compression: bool = panic_datatypes.ServiceParams.channel_compression,
+      compression_threshold: int = panic_datatypes.ServiceParams.channel_compression_threshold,
+      compression_level: int = panic_datatypes.ServiceParams.channel_compression_level,
+      server_no_context_takeover: bool = False,
+      client_no_context_takeover: bool = False,
+      server_max_window_bits: int = None,
+      client_max_window_bits: int = None) -> None:
+    if overflow not in ('drop', 'disconnect'):
+      raise ValueError(f'overflow[{overflow}] must be drop or disconnect')
+
+    for bits in (server_max_window_bits, client_max_window_bits):
+      if bits is not None and not 8 <= bits <= 15:
+        raise ValueError(f'window bits[{bits}] must be between 8 and 15')
+
+    self.max_size = max_size
+    self.max_queue = max_queue
+    self.read_limit = read_limit
+    self.write_limit = write_limit
+    self.send_queue = send_queue
+    self.overflow = overflow
+    self.compression = compression
+    self.compression_threshold = compression_threshold
+    self.compression_level = compression_level
+    self.server_no_context_takeover = server_no_context_takeover
+    self.client_no_context_takeover = client_no_context_takeover
+    self.server_max_window_bits = server_max_window_bits
+    self.client_max_window_bits = client_max_window_bits
+
+  def __repr__(self) -> str:
+    return f'SocketParams[{self.max_size}:{"deflate" if self.compression else "plain"}]'
+
 class URIRoute:
   url: str
   handler: panic_datatypes.FunctionType
   method: panic_datatypes.HTTPMethod
   awaitable: bool
+  segments: typing.List[typing.Union[str, RouteParameter]]
 
   @property
   def identity(self):
     return self.__hash__()
 
+  @property
+  def dynamic(self) -> bool:
+    return any(isinstance(segment, RouteParameter) for segment in self.segments)
+
   @staticmethod
   def route_hasher(typed_url: str, method: panic_datatypes.HTTPMethod) -> str:
     return hashlib.md5(':'.join([
@@ -24,6 +205,28 @@ class URIRoute:
       method.name.lower(),
     ]).encode('utf-8')).hexdigest()
 
+  @staticmethod
+  def parse(url: str, types: typing.Dict[str, typing.Tuple[type, str]]) -> typing.List[typing.Union[str, RouteParameter]]:
+    """
+    Splits a typed url, `/users/<id:int>/orders/<oid>`, into static segments and RouteParameters
+    """
+    segments = []
+    for segment in url.split('/')[1:]:
+      match = PARAMETER_PATTERN.match(segment)
+      if match is None:
+        segments.append(segment)
+        continue
+
+      name, kind = match.group(1), match.group(2) or 'string'
+      try:
+        cast, pattern = types[kind]
+      except KeyError as err:
+        raise ValueError(f'Parameter[{name}] has unknown type[{kind}]')
+
+      segments.append(RouteParameter(name, kind, cast, pattern))
+
+    return segments
+
   def __init__(self,
       url: str,
       method: panic_datatypes.HTTPMethod,
@@ -31,7 +234,11 @@ class URIRoute:
       awaitable: bool = False,
       streamable: bool = False,
       socket_encoding: str = 'application/octet-stream',
-      socket_protocol: str = 'topics') -> None:
+      socket_protocol: str = 'topics',
+      stream_body: bool = False,
+      process: bool = False,
+      socket_params: SocketParams = None,
+      codec: typing.Any = None) -> None:
     self.url = url
     self.handler = handler
     self.method = method
@@ -41,6 +248,14 @@ class URIRoute:
     # https://tools.ietf.org/html/rfc6455#page-12
     self.socket_encoding = socket_encoding
     self.socket_protocol = socket_protocol
+    self.socket_params = SocketParams() if socket_params is None else socket_params
+    # panic.codec.Codec of `socket_encoding` for channel routes
+    self.codec = codec
+    # The handler starts once headers are parsed and reads request.body with `async for`
+    self.stream_body = stream_body
+    # Synchronous, CPU-bound handler dispatched to the process pool instead of the thread pool
+    self.process = process
+    self.segments = []
 
   def __hash__(self) -> int:
     return hash(URIRoute.route_hasher(self.url, self.method))
@@ -1,15 +1,20 @@
 import asyncio
 import logging
+import multiprocessing
+import os
+import signal
+import socket
 import time
 
 from functools import partial
+from multiprocessing.connection import wait
 from signal import SIGINT, SIGTERM
 
 from panic import \
     datatypes as panic_datatypes
 
 logger = logging.getLogger(__name__)
-current_time = None
+current_time = time.monotonic()
 
 def update_current_time(loop):
     """
@@ -20,12 +25,36 @@ def update_current_time(loop):
     :return:
     """
     global current_time
-    current_time = time.time()
+    current_time = time.monotonic()
     loop.call_later(1, partial(update_current_time, loop))
 
+def sweep_timeouts(params: panic_datatypes.ServerParams, interval: float = 1) -> None:
+  """
+  Expires idle and stalled connections in one pass over `params.connections`, instead of keeping a
+  timer handle per connection
+  """
+  params.loop.call_later(interval, partial(sweep_timeouts, params, interval))
+  for connection in list(params.connections):
+    try:
+      connection.check_timeout(current_time)
+    except Exception:
+      # One broken connection mustn't end timeout enforcement for the others
+      logger.exception(f'Timeout check failed for {connection}')
+
+def publish_metrics(params: panic_datatypes.ServerParams) -> None:
+  params.metrics.publish()
+  params.loop.call_later(params.metrics_interval, partial(publish_metrics, params))
+
+def bind_socket(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+  """
+  Binds the listening socket in the supervisor so forked workers can inherit it
+  """
+  sock = socket.create_server((host, port), reuse_port=reuse_port, backlog=100)
+  sock.set_inheritable(True)
+  return sock
 
 def serve(params: panic_datatypes.ServerParams) -> None:
-  logger.info(f'Goin\' Fast @ http://{params.host}:{params.port}')
+  logger.info(f'Goin\' Fast @ http://{params.host}:{params.port} [{os.getpid()}]')
 
   server = partial(params.protocol, params)
   #  params.protocol,
@@ -38,14 +67,24 @@ def serve(params: panic_datatypes.ServerParams) -> None:
   #  request_timeout=params.request_timeout
   #)
 
-  server_coroutine = params.loop.create_server(
-    server,
-    host=params.host,
-    port=params.port,
-    reuse_port=params.reuse_port)
-  #sock=params.sock)
+  if params.sock is None:
+    server_coroutine = params.loop.create_server(
+      server,
+      host=params.host,
+      port=params.port,
+      reuse_port=params.reuse_port)
+
+  else:
+    server_coroutine = params.loop.create_server(server, sock=params.sock)
 
   params.loop.call_soon(partial(update_current_time, params.loop))
+  params.loop.call_soon(partial(sweep_timeouts, params))
+  if params.metrics is not None:
+    params.metrics.connections = params.connections
+    params.loop.call_soon(partial(publish_metrics, params))
+
+  if params.tracer is not None:
+    params.tracer.start(params.loop)
 
   try:
     http_server = params.loop.run_until_complete(server_coroutine)
@@ -76,3 +115,78 @@ def serve(params: panic_datatypes.ServerParams) -> None:
 
     params.loop.close()
 
+
+def _serve_worker(params: panic_datatypes.ServerParams) -> None:
+  # Workers start with default signal dispositions, serve() installs its own drain handlers
+  signal.signal(SIGINT, signal.SIG_DFL)
+  signal.signal(SIGTERM, signal.SIG_DFL)
+  params.loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(params.loop)
+  params.connections = set()
+  try:
+    serve(params)
+  finally:
+    params.request_handler.threads.shutdown()
+    # Waits for the pool, a worker leaves through os._exit once its multiprocessing finalizers ran and
+    # they'd close the pool's call queue before its manager thread sent its children their sentinels
+    params.request_handler.processes.shutdown(wait=True)
+
+def serve_multiple(params: panic_datatypes.ServerParams, workers: int, grace_period: float = 30.0) -> None:
+  """
+  Pre-fork supervisor. Starts `workers` processes sharing either the inherited listening socket in
+  `params.sock` or the same port through SO_REUSEPORT, restarts workers that die and forwards SIGTERM
+  to let every worker drain its connections.
+  """
+  if params.sock is None and not params.reuse_port:
+    params.sock = bind_socket(params.host, params.port)
+
+  context = multiprocessing.get_context('fork')
+  processes = {}
+  state = {'stopping': False}
+
+  def _start() -> None:
+    # Not daemonic, a daemonic worker can't start the process pool of `process=True` routes. The
+    # supervisor joins, terminates and kills its workers itself
+    process = context.Process(target=_serve_worker, args=(params,), daemon=False)
+    process.start()
+    processes[process.sentinel] = (process, time.monotonic())
+
+  def _shutdown(signum, frame) -> None:
+    if state['stopping']:
+      return None
+
+    logger.info(f'Signal[{signum}] received, draining {len(processes)} workers...')
+    state['stopping'] = True
+    for process, started in processes.values():
+      process.terminate()
+
+  signal.signal(SIGINT, _shutdown)
+  signal.signal(SIGTERM, _shutdown)
+
+  for _ in range(workers):
+    _start()
+
+  while not state['stopping']:
+    for sentinel in wait(list(processes.keys()), timeout=1):
+      process, started = processes.pop(sentinel)
+      process.join()
+      if state['stopping']:
+        continue
+
+      logger.error(f'Worker[{process.pid}] exited with code[{process.exitcode}], restarting')
+      # Don't spin when a worker crashes on boot
+      if time.monotonic() - started < 1:
+        time.sleep(1)
+
+      _start()
+
+  deadline = time.monotonic() + grace_period
+  for process, started in processes.values():
+    process.join(max(0, deadline - time.monotonic()))
+    if process.is_alive():
+      logger.error(f'Worker[{process.pid}] did not drain in {grace_period}s, killing')
+      process.kill()
+      process.join()
+
+  if params.sock is not None:
+    params.sock.close()
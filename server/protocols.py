@@ -1,40 +1,111 @@
 import asyncio
-import datetime
 import logging
+import time
+import typing
 import uuid
 
+from collections import deque
+from functools import partial
 from pprint import pprint
 from httptools import HttpRequestParser, HttpParserUpgrade
 from httptools.parser.errors import HttpParserError
 
 from panic import \
+    server as panic_server, \
     datatypes as panic_datatypes, \
     utils as panic_utils, \
     exceptions as panic_exceptions, \
+    multipart as panic_multipart, \
     request as panic_request, \
     response as panic_response
+from panic.router import \
+    datatypes as router_datatypes
 
 from websockets import WebSocketCommonProtocol, InvalidHandshake, handshake
+from websockets.http import Headers
+from websockets.exceptions import NegotiationError
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.framing import CTRL_OPCODES, OP_CONT
+from websockets.headers import parse_extension_list, build_extension_list
 
 logger = logging.getLogger(__name__)
 
+# File responses are handed to loop.sendfile in slices of this size, every slice sent counts as activity
+# against request_timeout
+SENDFILE_CHUNK = 2 ** 18
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+  """
+  permessage-deflate that sends messages below `threshold` bytes uncompressed, RFC 7692 lets a sender
+  choose per message
+  """
+  threshold: int = 0
+
+  def encode(self, frame):
+    if frame.fin and frame.opcode not in CTRL_OPCODES and frame.opcode != OP_CONT and len(frame.data) < self.threshold:
+      return frame
+
+    return super().encode(frame)
+
+class DeflateFactory(ServerPerMessageDeflateFactory):
+  def __init__(self, socket_params: router_datatypes.SocketParams) -> None:
+    super().__init__(
+        server_no_context_takeover=socket_params.server_no_context_takeover,
+        client_no_context_takeover=socket_params.client_no_context_takeover,
+        server_max_window_bits=socket_params.server_max_window_bits,
+        client_max_window_bits=socket_params.client_max_window_bits,
+        compress_settings={'level': socket_params.compression_level})
+    self.threshold = socket_params.compression_threshold
+
+  def process_request_params(self, params, accepted_extensions):
+    response_params, extension = super().process_request_params(params, accepted_extensions)
+    extension = ThresholdPerMessageDeflate(
+        extension.remote_no_context_takeover,
+        extension.local_no_context_takeover,
+        extension.remote_max_window_bits,
+        extension.local_max_window_bits,
+        extension.compress_settings)
+    extension.threshold = self.threshold
+    return response_params, extension
+
+def negotiate_extensions(headers: panic_datatypes.RequestHeaders, socket_params: router_datatypes.SocketParams) -> typing.Tuple[typing.Optional[str], typing.List[typing.Any]]:
+  """
+  Accepts the first permessage-deflate offer of Sec-WebSocket-Extensions that the route's options
+  allow, returns the response header value and the extensions for the websocket
+  """
+  if not socket_params.compression:
+    return None, []
+
+  factory = DeflateFactory(socket_params)
+  for header in headers.getall('sec-websocket-extensions'):
+    for name, request_params in parse_extension_list(header.value):
+      if name != factory.name:
+        continue
+
+      try:
+        response_params, extension = factory.process_request_params(request_params, [])
+      except NegotiationError as err:
+        logger.debug(err)
+        continue
+
+      return build_extension_list([(name, response_params)]), [extension]
+
+  return None, []
+
 class WebSocketProtocol(asyncio.Protocol):
   def __init__(self, params: panic_datatypes.ServerParams):
     self.enabled = False
     self.params = params
     self.websocket = None
+    self.channel = None
     self.transport = None
     self.timeout = params.request_timeout or 10
-    self.max_size = 2 ** 20
-    self.max_queue = 2 ** 5
-    self.read_limit =  2 ** 16
-    self.write_limit = 2 ** 16
 
     self.url = None
     self.connections = params.connections
 
     self.request = None
-    self.headers = panic_datatypes.HTTPHeaders()
+    self.headers = panic_datatypes.RequestHeaders()
     self.parser = HttpRequestParser(self)
 
     self._last_request_time = None
@@ -44,26 +115,36 @@ class WebSocketProtocol(asyncio.Protocol):
 
   def connection_made(self, transport):
     self.connections.add(self)
-    self._timeout_handler = self.params.loop.call_later(self.timeout, self.connection_timeout)
     self.transport = transport
-    self._last_request_time = datetime.datetime.utcnow()
+    self._last_request_time = panic_server.current_time
 
   def connection_lost(self, exc):
     self.connections.discard(self)
-    self._timeout_handler.cancel()
+    if self.websocket is not None:
+      self.websocket.connection_lost(exc)
+
     self.cleanup()
 
+  def pause_writing(self):
+    if self.websocket is not None:
+      self.websocket.pause_writing()
+
+    if self.channel is not None:
+      self.channel.pause()
+
+  def resume_writing(self):
+    if self.websocket is not None:
+      self.websocket.resume_writing()
+
+    if self.channel is not None:
+      self.channel.resume()
+
   def cleanup(self):
     self.websocket = None
+    self.channel = None
     self.transport = None
-    self.timeout = 10
-    self.max_size = 1
-    self.max_queue = 1
-    self.read_limit = 2 ** 16
-    self.write_limit = 2 ** 16
     self.enabled = False
     self.url = None
-    logger.warn('handle connections')
     self.connections = None
     self.request = None
     self.headers = None
@@ -71,23 +152,17 @@ class WebSocketProtocol(asyncio.Protocol):
     self._last_request_time = None
     self._request_handler_task = None
 
-  def connection_timeout(self):
-    time_elapsed = datetime.datetime.utcnow() - self._last_request_time
-    seconds_elapsed = round(time_elapsed.seconds + float('0.%d' % time_elapsed.microseconds))
-    if seconds_elapsed <= self.timeout:
-      logger.info('Handler Timed out for WebSocket/Channel')
-
-      #import ipdb; ipdb.set_trace()
-      pass
-      #if self._request_handler_task:
-      #  self._request_handler_task.cancel()
-
-      #exception = panic_exceptions.RequestTimeout('Request Timeout')
-      #self.write_error(exception)
+  def check_timeout(self, now: float) -> None:
+    """
+    Called by the server's periodic sweep. Once upgraded, the websocket's own ping/close handling owns
+    the connection, so only a stalled handshake is timed out here.
+    """
+    if not self.enabled and now - self._last_request_time > self.timeout:
+      self.connection_timeout()
 
-    else:
-      time_left = self.timeout - seconds_elapsed
-      self._timeout_handler = self.params.loop.call_later(time_left, self.connection_timeout)
+  def connection_timeout(self):
+    logger.info('Handshake Timed out for WebSocket/Channel')
+    self.transport.close()
 
 
   def data_received(self, data):
@@ -99,7 +174,6 @@ class WebSocketProtocol(asyncio.Protocol):
 
     except HttpParserError as err:
       logger.debug(err)
-      import ipdb; ipdb.set_trace()
       exception = panic_exceptions.InvalidUsage('Bad Request')
       self.write_error(exception)
 
@@ -108,23 +182,35 @@ class WebSocketProtocol(asyncio.Protocol):
       self.enabled = True
 
       response = panic_response.Response(b'')
+      socket_params = self.params.request_handler.socket_params(self.request)
       try:
-        key = handshake.check_request(lambda x: self.headers.get(x).value)
-        handshake.build_response(response.assimilate, key)
+        key = handshake.check_request(self.handshake_headers())
+        response_headers = Headers()
+        handshake.build_response(response_headers, key)
+        extensions_header, extensions = negotiate_extensions(self.headers, socket_params)
       except InvalidHandshake:
         exception = panic_exceptions.InvalidUsage('Invalid websocket request')
         self.write_error(exception)
 
       else:
+        for name, value in response_headers.raw_items():
+          response.assimilate(name, value)
+
+        if extensions_header is not None:
+          response.assimilate('Sec-WebSocket-Extensions', extensions_header)
+
         self.transport.write(response.channel('1.1'))
         self.websocket = WebSocketCommonProtocol(
-            timeout=self.timeout,
-            max_size=self.max_size,
-            max_queue=self.max_queue,
-            read_limit=self.read_limit,
-            write_limit=self.write_limit)
+            close_timeout=self.timeout,
+            max_size=socket_params.max_size,
+            max_queue=socket_params.max_queue,
+            read_limit=socket_params.read_limit,
+            write_limit=socket_params.write_limit)
 
+        self.websocket.extensions = extensions
         self.websocket.subprotocol = None
+        self.websocket.is_client = False
+        self.websocket.side = 'server'
         #subprotocol
         self.websocket.connection_made(self.transport)
         self.websocket.connection_open()
@@ -132,6 +218,17 @@ class WebSocketProtocol(asyncio.Protocol):
         self._request_handler_task = self.params.loop.create_task(
             self.params.request_handler(self.request, self.websocket, self.transport))
 
+  def handshake_headers(self) -> Headers:
+    """
+    The request's headers as the websockets handshake reads them
+    """
+    headers = Headers()
+    for name in self.headers.keys():
+      for header in self.headers.getall(name):
+        headers[name] = header.value
+
+    return headers
+
   def on_url(self, url):
     self.url = url
 
@@ -142,7 +239,7 @@ class WebSocketProtocol(asyncio.Protocol):
     #    self.params.request_handler(self.request, self.write_response))
 
   def on_header(self, name, value):
-    self.headers.append(name.decode(), value.decode('utf-8'))
+    self.headers.append_raw(name, value)
 
   def on_headers_complete(self):
     remote_addr = self.transport.get_extra_info('peername')
@@ -170,13 +267,38 @@ class WebSocketProtocol(asyncio.Protocol):
       self.transport.write(response.output(float(version)))
       self.transport.close()
     except Exception as err:
-      # logger.exception(err)
-      import traceback
-      traceback.print_stack()
-      import ipdb;ipdb.set_trace()
-      self.signal.stopped 
-      import sys; sys.exit(1)
-      self.bail_out("Writing error failed, connection closed {}".format(e))
+      # Answering with another error could fail the same way
+      logger.exception(f'Writing error failed, connection closed: {err}')
+      self.transport.close()
+
+class PipelinedRequest:
+  """
+  A parsed request waiting on its handler. Responses leave the connection strictly in request order,
+  whichever handler finishes first.
+  """
+  request: panic_request.Request
+  response: typing.Any
+  keep_alive: bool
+  task: asyncio.Task
+  __slots__ = ('request', 'response', 'keep_alive', 'task')
+
+  def __init__(self, request: panic_request.Request, keep_alive: bool) -> None:
+    self.request = request
+    self.response = None
+    self.keep_alive = keep_alive
+    self.task = None
+
+  def body_consumed(self) -> bool:
+    """
+    A streamed request-body that wasn't read to the end leaves unparsed bytes on the connection
+    """
+    if isinstance(self.request.body, panic_request.StreamingRequestBody):
+      return self.request.body.complete
+
+    return True
+
+  def __repr__(self) -> str:
+    return f'PipelinedRequest[{self.request.method.name}:{self.request.url}]'
 
 class HttpProtocol(asyncio.Protocol):
   # http://book.pythontips.com/en/latest/__slots__magic.html
@@ -193,10 +315,30 @@ class HttpProtocol(asyncio.Protocol):
     self.connections = params.connections
     self.request_handler = params.request_handler
     self.request_timeout = params.request_timeout
+    self.keep_alive_timeout = params.keep_alive_timeout
+    self.max_pipeline = params.max_pipeline
+    self.metrics = params.metrics
+    self.tracer = params.tracer
+    # Requests are timed for either of them, see Request.timings
+    self._timed = params.metrics is not None or params.tracer is not None
     self._total_request_size = 0
-    self._timeout_handler = None
+    self._requests = 0
+    self._started = None
+    self._body_size = 0
+    self._max_body_size = params.max_body_size
+    self._multipart = False
     self._last_request_time = None
-    self._request_handler_task = None
+    self._parsing = False
+    self._failed = False
+    self._pipeline = deque()
+    self._streaming = None
+    self._reading_paused = False
+    self._pauses = 0
+    self._remote_addr = None
+    self._headers_pool = []
+    self._body_pool = []
+    self._writable = asyncio.Event()
+    self._writable.set()
     self._identity = uuid.uuid4()
 
   # -------------------------------------------- #
@@ -204,111 +346,451 @@ class HttpProtocol(asyncio.Protocol):
   # -------------------------------------------- #
   def connection_made(self, transport):
     self.connections.add(self)
-    self._timeout_handler = self.loop.call_later(self.request_timeout, self.connection_timeout)
+    if self.metrics is not None:
+      self.metrics.accepted += 1
+
     self.transport = transport
-    self._last_request_time = datetime.datetime.utcnow()
+    self.transport.set_write_buffer_limits(high=self.params.write_high_water, low=self.params.write_low_water)
+    self._last_request_time = panic_server.current_time
+    remote_addr = transport.get_extra_info('peername')
+    if remote_addr:
+      self._remote_addr = (remote_addr[0].encode(), str(remote_addr[1]).encode())
 
   def connection_lost(self, exc):
     self.connections.discard(self)
-    self._timeout_handler.cancel()
+    self._cancel_pending()
+    if self._parsing and self.request is not None:
+      self._close_body(self.request)
+
+    # Wake a paused stream so it notices the closed transport
+    self._writable.set()
     self.cleanup()
 
+  def pause_writing(self):
+    self._writable.clear()
+
+  def resume_writing(self):
+    self._writable.set()
+
+  def _idle(self) -> bool:
+    return not self._parsing and not self._pipeline and self._streaming is None
+
+  def _cancel_pending(self) -> None:
+    for slot in self._pipeline:
+      if slot.task:
+        slot.task.cancel()
+
+      if self.tracer is not None:
+        self.tracer.discard(slot)
+
+      self._close_body(slot.request)
+
+    if self._streaming is not None:
+      if self._streaming.task:
+        self._streaming.task.cancel()
+
+      if self.tracer is not None:
+        self.tracer.discard(self._streaming)
+
+      self._close_body(self._streaming.request)
+
+  def _close_body(self, request: panic_request.Request) -> None:
+    # Spooled multipart parts keep their temporary files open until they're closed
+    if request is not None and isinstance(request.body, panic_multipart.MultipartBody):
+      request.body.close()
+
+  def check_timeout(self, now: float) -> None:
+    """
+    Called by the server's periodic sweep with the cached monotonic clock. Connections between
+    requests expire after `keep_alive_timeout`, requests in flight after `request_timeout`.
+    """
+    elapsed = now - self._last_request_time
+    if self._idle():
+      if elapsed > self.keep_alive_timeout:
+        if self.metrics is not None:
+          self.metrics.expired += 1
+
+        self.transport.close()
+
+    elif elapsed > self.request_timeout:
+      self.connection_timeout()
+
   def connection_timeout(self):
-    time_elapsed = datetime.datetime.utcnow() - self._last_request_time
-    try:
-      if time_elapsed.seconds < self.request_timeout:
-        time_left = self.request_timeout - time_elapsed.seconds
-        self._timeout_handler = self.loop.call_later(time_left, self.connection_timeout)
-    except Exception as err:
-      print(err)
-      import ipdb; ipdb.set_trace()
-      pass
+    if self.metrics is not None:
+      self.metrics.timeouts += 1
 
-    else:
-      if self._request_handler_task:
-        self._request_handler_task.cancel()
+    streaming = self._streaming is not None
+    self._cancel_pending()
+    if streaming:
+      # A streamed or file response's head is already on the wire, a 408 would land in its body
+      self.transport.close()
+      return None
 
-      exception = panic_exceptions.RequestTimeout('Request Timeout')
-      self.write_error(exception)
+    exception = panic_exceptions.RequestTimeout('Request Timeout')
+    self.write_error(exception)
 
   # -------------------------------------------- #
   # Parsing
   # -------------------------------------------- #
 
   def data_received(self, data):
-    # Check for the request itself getting too large and exceeding
-    # memory limits
-    # TODO: ^
     self._total_request_size += len(data)
+    if self.metrics is not None:
+      self.metrics.bytes_received += len(data)
+
+    if self._failed:
+      # The parser stopped at a malformed request, the connection closes once its error is written
+      return None
 
     # Create parser if this is the first time we're receiving data
     if self.parser is None:
-      assert self.request is None
-      self.headers = panic_datatypes.HTTPHeaders()
       self.parser = HttpRequestParser(self)
 
     # Parse request chunk or close connection
     try:
       self.parser.feed_data(data)
     except HttpParserError as err:
-      import ipdb;ipdb.set_trace()
-      exception = panic_exceptions.InvalidUsage('Bad Request')
-      self.write_error(exception)
+      if self.metrics is not None:
+        self.metrics.parser_errors += 1
+
+      # Exceptions raised inside parser callbacks surface as the context of HttpParserCallbackError
+      if isinstance(err.__context__, panic_exceptions.PanicException):
+        exception = err.__context__
+      else:
+        exception = panic_exceptions.InvalidUsage('Bad Request')
+
+      if self.request and isinstance(self.request.body, panic_request.StreamingRequestBody):
+        self.request.body.feed_error(exception)
+
+      self._fail(exception)
+
+  def _fail(self, exception: panic_exceptions.PanicException) -> None:
+    """
+    Queues the error response of a request the parser rejected behind the requests already in flight,
+    so their responses are written first, and closes the connection after it
+    """
+    self._failed = True
+    self._parsing = False
+    # Never resumed
+    self._pause_reading()
+    request = self.request
+    pending = list(self._pipeline) if self._streaming is None else [self._streaming, *self._pipeline]
+    for slot in pending:
+      if request is not None and slot.request is request:
+        # A stream_body request that was already dispatched, its handler gets the error from its body
+        slot.keep_alive = False
+        return None
+
+    if request is None:
+      request = panic_request.Request(b'/', panic_datatypes.RequestHeaders(), '1.1', panic_datatypes.HTTPMethod.get)
+
+    slot = PipelinedRequest(request, False)
+    slot.response = self.params.error_handler(request, exception)
+    self._pipeline.append(slot)
+    self._flush()
+
+  def on_message_begin(self):
+    self._parsing = True
+    self._last_request_time = panic_server.current_time
+    self._body_size = 0
+    self._multipart = False
+    self.request = None
+    self.url = None
+    self.headers = self._headers_pool.pop() if self._headers_pool else panic_datatypes.RequestHeaders()
+    if self._timed:
+      self._started = time.perf_counter()
+
+    if self.metrics is not None:
+      self.metrics.requests += 1
+      if self._requests:
+        self.metrics.reused += 1
+
+    self._requests += 1
 
   def on_url(self, url):
     self.url = url
 
   def on_header(self, name, value):
-    #if name == b'Content-Length' and int(value) > 1000:
-    #  exception = PayloadTooLarge('Payload Too Large')
-    #  self.write_error(exception)
+    if self._max_body_size and name.lower() == b'content-length' and int(value) > self._max_body_size:
+      raise panic_exceptions.PayloadTooLarge('Payload Too Large')
 
-    self.headers.append(name.decode(), value.decode('utf-8'))
+    if value[:19].lower() == b'multipart/form-data' and name.lower() == b'content-type':
+      self._multipart = True
+
+    self.headers.append_raw(name, value)
 
   def on_headers_complete(self):
-    remote_addr = self.transport.get_extra_info('peername')
-    if remote_addr:
-      self.headers.append(remote_addr[0], str(remote_addr[1]))
+    if self._remote_addr:
+      self.headers.append_raw(*self._remote_addr)
 
     self.request = panic_request.Request(
       url = self.url,
       headers = self.headers,
       version = self.parser.get_http_version(),
-      method = panic_datatypes.HTTPMethod.Match(self.parser.get_method().decode())
+      method = panic_datatypes.HTTPMethod.Parse(self.parser.get_method()),
+      body = self._body_pool.pop() if self._body_pool and not self._multipart else None
     )
+    if self._timed:
+      self.request.timings = {'started': self._started}
+
+    if self.request_handler.streams_body(self.request):
+      self.request.body = panic_request.StreamingRequestBody(
+          self.params.body_queue_size, self._pause_reading, self._resume_reading)
+      self._dispatch()
+
+    elif self._multipart:
+      # Parts are parsed and spooled as the body arrives instead of buffering the raw body
+      self.request.body = panic_multipart.MultipartBody(self.request.boundary, self.params.multipart_spill_size)
 
   def on_body(self, body):
+    self._last_request_time = panic_server.current_time
+    self._body_size += len(body)
+    if self._max_body_size and self._body_size > self._max_body_size:
+      raise panic_exceptions.PayloadTooLarge('Payload Too Large')
+
     self.request.body.append(body)
 
   def on_message_complete(self):
-    self._request_handler_task = self.loop.create_task(self.request_handler(self.request, self.write_response))
+    self._parsing = False
+    if isinstance(self.request.body, panic_request.StreamingRequestBody):
+      self.request.body.feed_eof()
+
+    else:
+      if self._multipart:
+        self.request.body.feed_eof()
+
+      self._dispatch()
+
+  def _dispatch(self) -> None:
+    """
+    Queues the parsed request and starts its handler right away, so pipelined requests run
+    concurrently while their responses wait their turn in `_flush`
+    """
+    if self.request.timings is not None:
+      self.request.timings['dispatched'] = time.perf_counter()
+
+    slot = PipelinedRequest(self.request, self.parser.should_keep_alive())
+    self._pipeline.append(slot)
+    slot.task = self.loop.create_task(self.request_handler(self.request, partial(self.write_response, slot)))
+    if self.tracer is not None:
+      self.tracer.begin(slot)
+
+    if len(self._pipeline) >= self.max_pipeline and not self._reading_paused:
+      self._reading_paused = True
+      self._pause_reading()
+
+  def _pause_reading(self) -> None:
+    """
+    Stops reading from the transport until every pause is matched by a `_resume_reading`. A full
+    pipeline, a streamed body's queue and a parser error each hold their own pause.
+    """
+    self._pauses += 1
+    if self._pauses == 1:
+      self.transport.pause_reading()
+
+  def _resume_reading(self) -> None:
+    self._pauses -= 1
+    if self._pauses == 0 and self.transport is not None and not self.transport.is_closing():
+      self.transport.resume_reading()
 
   # -------------------------------------------- #
   # Responding
   # -------------------------------------------- #
 
-  def write_response(self, response):
-    if self.parser:
-      keep_alive = self.parser.should_keep_alive() and not self.signal.stopped
+  def write_response(self, slot, response):
+    slot.response = response
+    if slot.request.timings is not None:
+      slot.request.timings['responded'] = time.perf_counter()
+
+    self._flush()
+
+  def _flush(self) -> None:
+    while self._pipeline and self._streaming is None:
+      slot = self._pipeline[0]
+      if slot.response is None:
+        break
+
+      self._pipeline.popleft()
+      if slot.request.timings is not None:
+        slot.request.timings['writing'] = time.perf_counter()
+
+      if slot.request.method is panic_datatypes.HTTPMethod.head:
+        # Same headers as the GET, including its length, but no body. Streams are never started, only
+        # closed so their generator doesn't wait on the garbage collector
+        keep_alive = slot.keep_alive and not self.signal.stopped and slot.body_consumed()
+        head = slot.response.head(slot.request.version)
+        if isinstance(slot.response, panic_response.StreamingResponse) and hasattr(slot.response.body, 'aclose'):
+          self.loop.create_task(slot.response.body.aclose())
+
+        self.transport.write(head)
+        if self.metrics is not None:
+          self.metrics.bytes_sent += len(head)
+
+        self._release(slot)
+        if not keep_alive:
+          self._cancel_pending()
+          self.transport.close()
+          return None
+
+        continue
+
+      if isinstance(slot.response, panic_response.StreamingResponse):
+        self._streaming = slot
+        slot.task = self.loop.create_task(self.stream_response(slot))
+        return None
+
+      if isinstance(slot.response, panic_response.FileResponse):
+        self._streaming = slot
+        slot.task = self.loop.create_task(self.send_file(slot))
+        return None
+
+      keep_alive = slot.keep_alive and not self.signal.stopped and slot.body_consumed()
+      try:
+        parts = slot.response.output_parts(slot.request.version)
+        if len(parts) == 1:
+          self.transport.write(parts[0])
+        else:
+          panic_response.write_buffers(self.transport, parts)
 
-    else:
+        if self.metrics is not None:
+          self.metrics.bytes_sent += sum(panic_response.body_length(part) for part in parts)
+
+      except RuntimeError as err:
+        logger.error(err)
+
+      self._release(slot)
+
+      if not keep_alive:
+        self._cancel_pending()
+        self.transport.close()
+        return None
+
+      self._last_request_time = panic_server.current_time
+
+    if self._reading_paused and len(self._pipeline) <= self.max_pipeline // 2:
+      self._reading_paused = False
+      self._resume_reading()
+
+  async def stream_response(self, slot):
+    """
+    Writes every chunk of a StreamingResponse as it's produced, waiting on the transport's
+    write-buffer watermarks through pause_writing/resume_writing
+    """
+    response = slot.response
+    version = slot.request.version
+    keep_alive = version != '1.0' and slot.keep_alive and not self.signal.stopped
+    transport = self.transport
+    sent = 0
+    try:
+      head = response.head(version)
+      transport.write(head)
+      sent += len(head)
+      async for datum in response.body:
+        if not datum:
+          continue
+
+        if not self._writable.is_set():
+          await self._writable.wait()
+
+        if transport.is_closing():
+          keep_alive = False
+          break
+
+        chunk = response.encode(datum)
+        transport.write(chunk)
+        sent += panic_response.body_length(chunk)
+        self._last_request_time = panic_server.current_time
+
+      else:
+        tail = response.tail()
+        transport.write(tail)
+        sent += len(tail)
+
+    except Exception as err:
+      # Headers are already on the wire, the only way to signal failure is to drop the connection
+      logger.exception(err)
       keep_alive = False
 
+    finally:
+      if hasattr(response.body, 'aclose'):
+        await response.body.aclose()
+
+      if self.metrics is not None:
+        self.metrics.bytes_sent += sent
+
+      self._streaming = None
+
+    self._finish(slot, keep_alive, transport)
+
+  async def send_file(self, slot):
+    """
+    Writes a FileResponse through `loop.sendfile`, zero-copy with os.sendfile on plain sockets and
+    chunked reads where the transport can't
+    """
+    response = slot.response
+    keep_alive = slot.keep_alive and not self.signal.stopped
+    transport = self.transport
     try:
-      self.transport.write(response.output(getattr(self.request, 'version', '1.1')))
-    except RuntimeError as err:
-      logger.error(err)
+      head = response.head(slot.request.version)
+      transport.write(head)
+      if response.count:
+        with open(response.path, 'rb') as fileobj:
+          offset, end = response.offset, response.offset + response.count
+          while offset < end:
+            offset += await self.loop.sendfile(transport, fileobj, offset, min(SENDFILE_CHUNK, end - offset))
+            self._last_request_time = panic_server.current_time
+
+      if self.metrics is not None:
+        self.metrics.bytes_sent += len(head) + response.count
 
     except Exception as err:
-      import ipdb; ipdb.set_trace()
-      pass
+      # Headers are already on the wire, the only way to signal failure is to drop the connection
+      logger.exception(err)
+      keep_alive = False
+
+    finally:
+      self._streaming = None
 
-    if keep_alive:
-      self._last_request_time = datetime.datetime.utcnow()
-      self.cleanup()
+    self._finish(slot, keep_alive, transport)
+
+  def _finish(self, slot: PipelinedRequest, keep_alive: bool, transport: asyncio.Transport) -> None:
+    if keep_alive and slot.body_consumed() and not transport.is_closing():
+      self._last_request_time = panic_server.current_time
+      self._release(slot)
+      self._flush()
 
     else:
-      self.transport.close()
+      self._observe(slot)
+      self._close_body(slot.request)
+      self._cancel_pending()
+      transport.close()
+
+  def _observe(self, slot: PipelinedRequest) -> None:
+    request = slot.request
+    if request is None or request.timings is None or 'dispatched' not in request.timings:
+      return None
+
+    request.timings['written'] = time.perf_counter()
+    if self.metrics is not None:
+      self.metrics.observe(request.route, request.timings)
+
+    if self.tracer is not None:
+      self.tracer.end(slot, request)
+
+  def _release(self, slot: PipelinedRequest) -> None:
+    """
+    Hands the answered request's headers and body back to the connection for the next request
+    """
+    self._observe(slot)
+    request = slot.request
+    self._close_body(request)
+    if len(self._headers_pool) < self.max_pipeline:
+      self._headers_pool.append(request.headers.reset())
+
+    if type(request.body) is panic_request.RequestBody and len(self._body_pool) < self.max_pipeline:
+      self._body_pool.append(request.body.reset())
+
+    slot.request = None
 
   def write_error(self, exception):
     try:
@@ -326,15 +808,12 @@ class HttpProtocol(asyncio.Protocol):
       #self.write_error(exception)
 
     except Exception as err:
-      # logger.exception(err)
-      import traceback
-      traceback.print_stack()
-      import ipdb;ipdb.set_trace()
-      import sys; sys.exit(1)
-      self.bail_out("Writing error failed, connection closed {}".format(e))
+      # Answering with another error could fail the same way
+      logger.exception(f'Writing error failed, connection closed: {err}')
+      self.transport.close()
 
   def bail_out(self, message):
-    exception = ServerError(message)
+    exception = panic_exceptions.ServerError(message)
     self.write_error(exception)
     logger.error(message)
 
@@ -343,14 +822,16 @@ class HttpProtocol(asyncio.Protocol):
     self.request = None
     self.url = None
     self.headers = None
-    self._request_handler_task = None
+    self._parsing = False
+    self._pipeline.clear()
+    self._streaming = None
 
   def close_if_idle(self):
     """
     Close the connection if a request is not being sent or received
     :return: boolean - True if closed, false if staying open
     """
-    if not self.parser:
+    if self._idle():
       self.transport.close()
       return True
 
@@ -0,0 +1,75 @@
+import pytest
+
+from panic import \
+    codec as panic_codec, \
+    datatypes as panic_datatypes, \
+    exceptions as panic_exceptions, \
+    panic
+
+def test_registry_shares_instances():
+  pytest.importorskip('msgpack')
+  pytest.importorskip('numpy')
+  assert panic_codec.get('application/msgpack') is panic_codec.get('application/msgpack')
+  assert type(panic_codec.get('application/x-msgpack')) is panic_codec.MsgpackCodec
+  assert panic_codec.get('application/x-numpy; dtype=float32').dtype.name == 'float32'
+
+  with pytest.raises(ValueError):
+    panic_codec.get('application/unknown')
+
+def test_register_custom_codec():
+  @panic_codec.register
+  class UpperCodec(panic_codec.Codec):
+    media_type = 'text/x-upper'
+
+    def encode(self, datum):
+      return datum.upper().encode('utf-8'), True
+
+    def decode(self, data):
+      return data.lower()
+
+  try:
+    assert panic_codec.get('text/x-upper').encode('hi') == (b'HI', True)
+  finally:
+    del panic_codec.CODECS['text/x-upper']
+    panic_codec._instances.clear()
+
+@pytest.mark.parametrize('socket_encoding, module', [
+  ('application/json', 'ujson'),
+  ('application/msgpack', 'msgpack'),
+  ('application/cbor', 'cbor2'),
+])
+def test_roundtrip(socket_encoding, module):
+  pytest.importorskip(module)
+  codec = panic_codec.get(socket_encoding)
+  payload, text = codec.encode({'ints': [1, 2], 'name': 'ok', 'price': 1.5})
+  assert text is (socket_encoding == 'application/json')
+  assert codec.decode(bytes(payload)) == {'ints': [1, 2], 'name': 'ok', 'price': 1.5}
+
+def test_octet_stream_passes_buffers_through():
+  codec = panic_codec.get('application/octet-stream')
+  view = memoryview(b'raw')
+  assert codec.encode(view)[0] is view
+  assert codec.encode('text') == (b'text', True)
+  assert codec.decode(b'raw') == b'raw'
+
+def test_numpy_without_copies():
+  numpy = pytest.importorskip('numpy')
+  codec = panic_codec.get('application/x-numpy; dtype=float64')
+  array = numpy.arange(4, dtype='float64')
+  payload, text = codec.encode(array)
+  assert not text and numpy.shares_memory(numpy.frombuffer(payload, dtype='float64'), array)
+
+  received = codec.decode(bytes(payload))
+  assert (received == array).all() and not received.flags.writeable
+
+def test_arrow_record_batch():
+  pyarrow = pytest.importorskip('pyarrow')
+  codec = panic_codec.get('application/vnd.apache.arrow.stream')
+  batch = pyarrow.record_batch([pyarrow.array([1, 2, 3]), pyarrow.array(['a', 'b', 'c'])], names=['id', 'name'])
+  payload, text = codec.encode(batch)
+  assert not text and codec.decode(bytes(payload)).to_pydict() == {'id': [1, 2, 3], 'name': ['a', 'b', 'c']}
+
+def test_channel_with_unknown_encoding_is_rejected():
+  app = panic.Panic(panic_datatypes.ServiceParams())
+  with pytest.raises(panic_exceptions.InvalidRoute):
+    app.router.channel('/feed', socket_encoding='application/unknown')
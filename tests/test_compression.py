@@ -0,0 +1,97 @@
+import asyncio
+import gzip
+
+import pytest
+
+from panic import \
+    datatypes as panic_datatypes, \
+    request as panic_request, \
+    response as panic_response
+from panic.response import \
+    compression as response_compression
+
+BODY = b'compressible ' * 200
+
+def _request(accept_encoding: str = None) -> panic_request.Request:
+  headers = panic_datatypes.RequestHeaders()
+  if accept_encoding is not None:
+    headers.append('Accept-Encoding', accept_encoding)
+
+  return panic_request.Request(b'/', headers, '1.1', panic_datatypes.HTTPMethod.get)
+
+def _compress(request, response):
+  compression = response_compression.Compression(panic_datatypes.ServiceParams())
+  return asyncio.run(compression(request, response))
+
+def test_shared_response_is_left_untouched():
+  shared = panic_response.text(BODY.decode())
+  compressed = _compress(_request('gzip'), shared)
+  assert compressed is not shared
+  assert gzip.decompress(compressed.body) == BODY and compressed.headers['content-encoding'].value == 'gzip'
+
+  assert shared.body == BODY
+  assert 'content-encoding' not in shared.headers and 'vary' not in shared.headers
+
+  plain = _compress(_request(), shared)
+  assert plain.body == BODY and 'content-encoding' not in plain.headers
+  assert plain.headers['vary'].value == 'Accept-Encoding'
+
+@pytest.mark.parametrize('accept_encoding, coding', [
+  ('gzip, deflate', 'gzip'),
+  ('deflate;q=0.5, gzip;q=0.4', 'deflate'),
+  ('x-gzip', 'gzip'),
+  ('*;q=0.1, br;q=0, zstd;q=0', 'gzip'),
+  ('gzip;q=0, identity', None),
+  ('', None),
+])
+def test_negotiate(accept_encoding, coding):
+  assert response_compression.negotiate(accept_encoding, ['br', 'zstd', 'gzip', 'deflate']) == coding
+
+def test_levels_from_params():
+  params = panic_datatypes.ServiceParams()
+  params.compression_levels = 'gzip=1, unknown=3'
+  codecs = response_compression.Compression(params).codecs
+  assert codecs['gzip'].level == 1 and codecs['deflate'].level == 6 and 'unknown' not in codecs
+
+@pytest.mark.parametrize('response', [
+  panic_response.Response(b'x' * 100, headers={'Content-Type': 'text/plain'}),
+  panic_response.Response(b'x' * 4096, headers={'Content-Type': 'image/png'}),
+  panic_response.Response(b'x' * 4096, status=204, headers={'Content-Type': 'text/plain'}),
+  panic_response.Response(b'x' * 4096, headers={'Content-Type': 'text/plain', 'Content-Encoding': 'br'}),
+])
+def test_left_uncompressed(response):
+  assert _compress(_request('gzip'), response) is response
+
+def test_repeated_body_compressed_once():
+  compression = response_compression.Compression(panic_datatypes.ServiceParams())
+  async def run():
+    return [await compression(_request('gzip'), panic_response.text(BODY.decode())) for _ in range(3)]
+
+  responses = asyncio.run(run())
+  assert responses[0].body is responses[2].body
+  assert (compression.cache.hits, compression.cache.misses) == (2, 1)
+
+def test_streaming_response_compressed_per_chunk():
+  async def chunks():
+    for index in range(3):
+      yield f'chunk {index} ' * 100
+
+  async def run():
+    compression = response_compression.Compression(panic_datatypes.ServiceParams())
+    response = await compression(_request('gzip'), panic_response.stream(chunks(), content_type='text/plain'))
+    return response, [datum async for datum in response.body]
+
+  response, data = asyncio.run(run())
+  assert response.headers['content-encoding'].value == 'gzip' and len(data) > 1
+  assert gzip.decompress(b''.join(data)) == ''.join(f'chunk {index} ' * 100 for index in range(3)).encode()
+
+def test_precompressed_sibling(tmp_path):
+  location = tmp_path / 'app.js'
+  location.write_bytes(b'plain')
+  (tmp_path / 'app.js.gz').write_bytes(gzip.compress(b'plain'))
+
+  response = panic_response.file(str(location), _request('gzip'))
+  assert response.path == str(location) + '.gz'
+  assert response.headers['content-encoding'].value == 'gzip' and response.headers['vary'].value == 'Accept-Encoding'
+
+  assert panic_response.file(str(location), _request('br')).path == str(location)
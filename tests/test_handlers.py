@@ -0,0 +1,47 @@
+from panic import \
+    datatypes as panic_datatypes, \
+    exceptions as panic_exceptions, \
+    panic, \
+    response as panic_response
+
+def _app():
+  app = panic.Panic(panic_datatypes.ServiceParams())
+  app.params.debug = False
+  return app
+
+def _named(name: str):
+  def _handler(request, exception):
+    return panic_response.text(name)
+
+  return _handler
+
+def test_closest_handler_in_mro():
+  app = _app()
+  handlers = app.exception_handler
+  app.exception(panic_exceptions.PanicException)(_named('panic'))
+  app.exception(panic_exceptions.NotFound)(_named('not found'))
+
+  assert handlers(None, panic_exceptions.FileNotFound('gone', '/x', '/x')).body == b'not found'
+  assert handlers(None, panic_exceptions.BadRequest('bad')).body == b'panic'
+  assert handlers.resolve(panic_exceptions.FileNotFound) is handlers.handlers[panic_exceptions.NotFound]
+  assert handlers.resolve(KeyError) is None
+
+def test_resolution_cache_cleared_on_registration():
+  app = _app()
+  handlers = app.exception_handler
+  app.exception(panic_exceptions.PanicException)(_named('panic'))
+  assert handlers(None, panic_exceptions.FileNotFound('gone', '/x', '/x')).body == b'panic'
+
+  app.exception(panic_exceptions.FileNotFound)(_named('file'))
+  assert handlers(None, panic_exceptions.FileNotFound('gone', '/x', '/x')).body == b'file'
+
+def test_default_responses_are_shared_per_kind():
+  handlers = _app().exception_handler
+  first = handlers(None, panic_exceptions.NotFound('/a'))
+  second = handlers(None, panic_exceptions.NotFound('/b'))
+  assert first is second and isinstance(first, panic_response.FrozenResponse)
+  assert first.output().startswith(b'HTTP/1.1 404 Not Found\r\n') and first.output().endswith(b'Error: Not Found')
+
+  not_allowed = handlers(None, panic_exceptions.InvalidHTTPMethod('no', allow='GET, HEAD, OPTIONS'))
+  assert b'allow:GET, HEAD, OPTIONS\r\n' in not_allowed.output()
+  assert handlers(None, panic_exceptions.InvalidHTTPMethod('no', allow='POST, OPTIONS')) is not not_allowed
@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from panic import \
+    metrics as panic_metrics
+
+def _timings(parse: float, handler: float, write: float):
+  return {'started': 0.0, 'dispatched': parse, 'responded': parse + handler, 'written': parse + handler + write}
+
+@pytest.mark.parametrize('seconds, bound', [
+  (0.0, '0.0005'),
+  (0.0005, '0.0005'),
+  (0.00051, '0.001'),
+  (1.0, '1.0'),
+  (10.0, '10.0'),
+  (10.5, '+Inf'),
+])
+def test_bucket_boundaries_are_inclusive(seconds, bound):
+  histogram = panic_metrics.Histogram()
+  histogram.observe(seconds)
+  bounds = panic_metrics.BUCKETS + ('+Inf',)
+  assert str(bounds[histogram.counts.index(1)]) == bound
+
+def test_render():
+  metrics = panic_metrics.Metrics()
+  metrics.requests, metrics.reused = 4, 1
+  metrics.observe('/users/<id:int>', _timings(0.0002, 0.003, 0.0001))
+  metrics.observe('/users/<id:int>', _timings(0.0002, 0.3, 0.0001))
+  metrics.observe(None, _timings(0.0002, 0.0, 0.0))
+  lines = metrics.render(metrics.collect()).splitlines()
+
+  assert 'panic_workers 1' in lines and 'panic_requests_total 4' in lines
+  assert 'panic_keep_alive_reuse_ratio 0.25' in lines
+  labels = 'route="/users/<id:int>",phase="handler"'
+  assert f'panic_request_duration_seconds_bucket{{{labels},le="0.0025"}} 0' in lines
+  assert f'panic_request_duration_seconds_bucket{{{labels},le="0.005"}} 1' in lines
+  assert f'panic_request_duration_seconds_bucket{{{labels},le="0.25"}} 1' in lines
+  assert f'panic_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in lines
+  assert f'panic_request_duration_seconds_count{{{labels}}} 2' in lines
+  assert 'panic_request_duration_seconds_count{route="<unmatched>",phase="parse"} 1' in lines
+
+def test_label_escaping():
+  metrics = panic_metrics.Metrics()
+  metrics.observe('/a"b\\c', _timings(0.0, 0.0, 0.0))
+  assert 'panic_request_duration_seconds_count{route="/a\\"b\\\\c",phase="write"} 1' in metrics.render(metrics.collect())
+
+def test_snapshots_merged_across_workers(tmp_path):
+  other = panic_metrics.Metrics()
+  other.requests = 2
+  other.connections = {object()}
+  other.observe('/', _timings(0.0, 0.02, 0.0))
+  snapshot = other.snapshot()
+  # A live worker that published a snapshot, and a dead one whose snapshot is discarded
+  snapshot['pid'] = os.getppid()
+  (tmp_path / f'{os.getppid()}.json').write_text(json.dumps(snapshot))
+  dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+  dead.wait()
+  (tmp_path / f'{dead.pid}.json').write_text(json.dumps(dict(snapshot, pid=dead.pid)))
+
+  metrics = panic_metrics.Metrics(str(tmp_path))
+  metrics.requests = 3
+  metrics.observe('/', _timings(0.0, 0.02, 0.0))
+  metrics.publish()
+  assert (tmp_path / f'{os.getpid()}.json').exists()
+
+  lines = metrics.render(metrics.collect()).splitlines()
+  assert 'panic_workers 2' in lines and 'panic_requests_total 5' in lines and 'panic_connections_active 1' in lines
+  assert 'panic_request_duration_seconds_bucket{route="/",phase="handler",le="0.025"} 2' in lines
+  assert not (tmp_path / f'{dead.pid}.json').exists()
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from panic import \
+    exceptions as panic_exceptions, \
+    multipart as panic_multipart
+
+BOUNDARY = b'XX'
+BODY = (
+  b'--XX\r\nContent-Disposition: form-data; name="a"\r\n\r\nv\r\n'
+  b'--XX\r\nContent-Disposition: form-data; name="b"; filename="b.bin"\r\nContent-Type: application/octet-stream\r\n\r\n'
+  b'\r\n--X\x00\xff\r\n'
+  b'--XX--\r\n'
+)
+EXPECTED = [('a', b'v'), ('b', b'\r\n--X\x00\xff')]
+
+async def _chunks(*chunks):
+  for chunk in chunks:
+    yield chunk
+
+async def _read(*chunks):
+  return [(part.name, await part.read()) async for part in panic_multipart.MultipartReader(_chunks(*chunks), BOUNDARY)]
+
+def _buffered(*chunks):
+  body = panic_multipart.MultipartBody(BOUNDARY)
+  for chunk in chunks:
+    body.append(chunk)
+
+  body.feed_eof()
+  try:
+    return [(part.name, part.body) for part in body.parts]
+  finally:
+    body.close()
+
+@pytest.mark.parametrize('offset', range(len(BODY) + 1))
+def test_reader_split_at_every_offset(offset):
+  assert asyncio.run(_read(BODY[:offset], BODY[offset:])) == EXPECTED
+
+@pytest.mark.parametrize('offset', range(len(BODY) + 1))
+def test_buffered_split_at_every_offset(offset):
+  assert _buffered(BODY[:offset], BODY[offset:]) == EXPECTED
+
+def test_reader_byte_by_byte():
+  assert asyncio.run(_read(*[BODY[index:index + 1] for index in range(len(BODY))])) == EXPECTED
+
+@pytest.mark.parametrize('offset', range(len(BODY) - 4))
+def test_reader_truncated(offset):
+  with pytest.raises(panic_exceptions.BadRequest):
+    asyncio.run(_read(BODY[:offset]))
+
+def test_spooled_parts_closed():
+  body = panic_multipart.MultipartBody(BOUNDARY, spill_size=1)
+  body.append(BODY)
+  body.feed_eof()
+  body.close()
+  assert all(part.file.closed for part in body.parts)
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from panic import \
+    datatypes as panic_datatypes, \
+    response as panic_response
+from panic.response import \
+    compression as response_compression
+from panic.server import \
+    protocols as server_protocols
+
+class Transport:
+  def __init__(self) -> None:
+    self.reading = True
+    self.closed = False
+    self.written = []
+
+  def set_write_buffer_limits(self, high: int, low: int) -> None:
+    pass
+
+  def get_extra_info(self, name: str):
+    return None
+
+  def is_closing(self) -> bool:
+    return False
+
+  def pause_reading(self) -> None:
+    assert self.reading
+    self.reading = False
+
+  def resume_reading(self) -> None:
+    assert not self.reading
+    self.reading = True
+
+  def write(self, data: bytes) -> None:
+    self.written.append(data)
+
+  def close(self) -> None:
+    self.closed = True
+
+class RequestHandler:
+  """
+  Streams the body of every request, reading it one chunk at a time when told to
+  """
+  def __init__(self) -> None:
+    self.read = asyncio.Event()
+
+  def streams_body(self, request) -> bool:
+    return True
+
+  async def __call__(self, request, respond):
+    await self.read.wait()
+    respond(panic_response.text(str(len(await request.body.read()))))
+
+def test_body_resume_keeps_full_pipeline_paused():
+  async def run():
+    params = panic_datatypes.ServerParams()
+    params.loop = asyncio.get_running_loop()
+    params.connections = set()
+    params.request_handler = RequestHandler()
+    params.max_pipeline = 1
+    params.body_queue_size = 1
+    protocol = server_protocols.HttpProtocol(params)
+    transport = Transport()
+    protocol.connection_made(transport)
+
+    # The pipeline is full once the request is dispatched and the body's queue with its first chunk
+    protocol.data_received(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 4\r\n\r\nab')
+    assert not transport.reading
+
+    # The handler drains the body's queue while its request still fills the pipeline
+    body = protocol.request.body
+    assert await body.__anext__() == b'ab'
+    assert not transport.reading
+
+    protocol.data_received(b'cd')
+    params.request_handler.read.set()
+    for _ in range(10):
+      await asyncio.sleep(0)
+
+    assert transport.reading
+    assert transport.written[-1].endswith(b'\r\n\r\n2')
+
+  asyncio.run(run())
+
+class StreamHandler:
+  """
+  Answers every request with a stream, optionally compressed
+  """
+  def __init__(self, compressed: bool) -> None:
+    self.compressed = compressed
+    self.generator = None
+
+  def streams_body(self, request) -> bool:
+    return False
+
+  async def __call__(self, request, respond):
+    async def chunks():
+      yield 'chunk'
+
+    self.generator = chunks()
+    response = panic_response.stream(self.generator, content_type='text/plain')
+    if self.compressed:
+      response.body = response_compression.CompressedStream(response.body, response_compression.Codec('gzip', 6).stream())
+      response.headers.append('Content-Encoding', 'gzip')
+
+    respond(response)
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_head_closes_stream(compressed):
+  async def run():
+    params = panic_datatypes.ServerParams()
+    params.loop = asyncio.get_running_loop()
+    params.connections = set()
+    params.request_handler = StreamHandler(compressed)
+    protocol = server_protocols.HttpProtocol(params)
+    transport = Transport()
+    protocol.connection_made(transport)
+    protocol.data_received(b'HEAD / HTTP/1.1\r\nHost: x\r\n\r\n')
+    for _ in range(10):
+      await asyncio.sleep(0)
+
+    assert b''.join(transport.written).endswith(b'\r\n\r\n')
+    assert params.request_handler.generator.ag_frame is None
+
+  asyncio.run(run())
+
+@pytest.mark.parametrize('protocol_class', [server_protocols.HttpProtocol, server_protocols.WebSocketProtocol])
+def test_failing_error_handler_closes_connection(protocol_class, caplog):
+  def error_handler(request, exception):
+    raise RuntimeError('handler is broken')
+
+  async def run():
+    params = panic_datatypes.ServerParams()
+    params.loop = asyncio.get_running_loop()
+    params.connections = set()
+    params.request_handler = RequestHandler()
+    params.error_handler = error_handler
+    protocol = protocol_class(params)
+    transport = Transport()
+    protocol.connection_made(transport)
+    protocol.write_error(ValueError('boom'))
+    return transport
+
+  transport = asyncio.run(run())
+  assert transport.closed and not transport.written
+  assert 'Writing error failed, connection closed: handler is broken' in caplog.text
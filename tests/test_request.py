@@ -0,0 +1,13 @@
+import pytest
+
+from panic import \
+    datatypes as panic_datatypes, \
+    exceptions as panic_exceptions, \
+    request as panic_request
+
+def test_form_of_a_non_form_body():
+  headers = panic_datatypes.RequestHeaders()
+  headers.append('Content-Type', 'application/octet-stream')
+  request = panic_request.Request(b'/', headers, '1.1', panic_datatypes.HTTPMethod.post)
+  with pytest.raises(panic_exceptions.BadRequest):
+    request.form
@@ -0,0 +1,23 @@
+from panic import \
+    response as panic_response
+
+class Transport:
+  def __init__(self) -> None:
+    self.written = []
+
+  def write(self, data) -> None:
+    self.written.append(data)
+
+def test_large_body_is_written_without_copy():
+  body = bytearray(2 ** 20)
+  response = panic_response.Response(body, headers={'Content-Type': 'application/octet-stream'})
+  transport = Transport()
+  panic_response.write_buffers(transport, response.output_parts())
+  assert len(transport.written) == 2 and transport.written[1].obj is body
+  assert transport.written[0].endswith(b'content-length:1048576\r\n\r\n')
+
+def test_small_buffers_are_joined():
+  large = memoryview(bytes(panic_response.VECTORED_THRESHOLD))
+  transport = Transport()
+  panic_response.write_buffers(transport, [b'a', b'b', large, b'c'])
+  assert transport.written[0] == b'ab' and transport.written[1] is large and transport.written[2] == b'c'
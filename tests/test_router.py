@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from panic import \
+    datatypes as panic_datatypes, \
+    exceptions as panic_exceptions, \
+    panic
+from panic.router import \
+    datatypes as router_datatypes
+
+GET = panic_datatypes.HTTPMethod.get
+
+def _handler(request, **parameters):
+  return None
+
+def _router(*urls: str):
+  app = panic.Panic(panic_datatypes.ServiceParams())
+  for url in urls:
+    app.router.get(url)(_handler)
+
+  return app.router
+
+@pytest.mark.parametrize('url, route, parameters', [
+  ('/users/me', '/users/me', {}),
+  ('/users/42', '/users/<id:int>', {'id': 42}),
+  ('/users/bob', '/users/<name:alpha>', {'name': 'bob'}),
+  ('/users/bob-1', '/users/<slug:string>', {'slug': 'bob-1'}),
+  ('/users/42/orders/a1', '/users/<id:int>/orders/<oid:string>', {'id': 42, 'oid': 'a1'}),
+  ('/users/42/profile', '/users/<slug:string>/profile', {'slug': '42'}),
+  ('/price/1.5', '/price/<value:number>', {'value': 1.5}),
+  ('/files/a/b.txt', '/files/<rest:path>', {'rest': 'a/b.txt'}),
+])
+def test_precedence_and_conversion(url, route, parameters):
+  router = _router(
+      '/users/<slug:string>', '/users/<name:alpha>', '/users/<id:int>', '/users/me',
+      '/users/<id:int>/orders/<oid:string>', '/users/<slug:string>/profile',
+      '/price/<value:number>', '/files/<rest:path>')
+
+  uri_route, found = router.request(GET, url)
+  assert uri_route.url == route
+  assert found == parameters and all(type(found[name]) is type(value) for name, value in parameters.items())
+
+def test_unmatched_path():
+  router = _router('/users/<id:int>')
+  with pytest.raises(panic_exceptions.NotFound):
+    router.request(GET, '/users/42/orders')
+
+@pytest.mark.parametrize('urls', [
+  ['/files/<rest:path>/meta'],
+  ['/users/<id:int>', '/users/<id:int>'],
+])
+def test_invalid_routes(urls):
+  with pytest.raises(panic_exceptions.InvalidRoute):
+    _router(*urls)
+
+def test_cache_counts_and_replays_misses():
+  router = _router('/users/<id:int>')
+  cache = router.cache
+  for _ in range(2):
+    with pytest.raises(panic_exceptions.NotFound):
+      router.request(GET, '/nope')
+
+    with pytest.raises(panic_exceptions.InvalidHTTPMethod) as err:
+      router.request(panic_datatypes.HTTPMethod.post, '/users/1')
+
+    assert err.value.allow == 'GET, HEAD, OPTIONS'
+    assert router.request(GET, '/users/1')[1] == {'id': 1}
+
+  assert (cache.hits, cache.misses, len(cache)) == (3, 3, 3)
+
+def test_cache_invalidated_by_new_route():
+  router = _router('/users/<id:int>')
+  with pytest.raises(panic_exceptions.NotFound):
+    router.request(GET, '/users/me')
+
+  router.get('/users/me')(_handler)
+  assert router.request(GET, '/users/me')[0].url == '/users/me'
+
+def test_cache_evicts_least_recently_used():
+  cache = router_datatypes.RouteCache(2)
+  cache.put((GET, '/a'), 'a')
+  cache.put((GET, '/b'), 'b')
+  assert cache.get((GET, '/a')) == 'a'
+  cache.put((GET, '/c'), 'c')
+  assert cache.get((GET, '/b')) is None and cache.get((GET, '/a')) == 'a'
+  assert cache.stats()['evictions'] == 1
+
+def test_head_runs_the_get_route():
+  router = _router('/users/<id:int>')
+  router.post('/posts')(_handler)
+  uri_route, parameters = router.request(panic_datatypes.HTTPMethod.head, '/users/1')
+  assert uri_route.method is GET and parameters == {'id': 1}
+
+  with pytest.raises(panic_exceptions.InvalidHTTPMethod) as err:
+    router.request(panic_datatypes.HTTPMethod.head, '/posts')
+
+  assert err.value.allow == 'POST, OPTIONS'
+
+@pytest.mark.parametrize('url, allow', [
+  ('/users/1', b'allow:GET, POST, HEAD, OPTIONS\r\n'),
+  ('/posts', b'allow:POST, OPTIONS\r\n'),
+])
+def test_options_answers_allow(url, allow):
+  router = _router('/users/<id:int>')
+  router.post('/users/<id:int>')(_handler)
+  router.post('/posts')(_handler)
+  uri_route, parameters = router.request(panic_datatypes.HTTPMethod.options, url)
+  response = asyncio.run(uri_route.handler(None, **parameters))
+  assert allow in response.output() and response.output().endswith(b'content-length:0\r\n\r\n')
@@ -0,0 +1,39 @@
+import dataclasses
+import decimal
+
+import pytest
+
+from panic.response import \
+    serializers as response_serializers
+
+@dataclasses.dataclass
+class Price:
+  amount: decimal.Decimal
+
+DECIMALS = [
+  (decimal.Decimal('1.1'), b'"1.1"'),
+  (decimal.Decimal('NaN'), b'"NaN"'),
+  ([{'price': decimal.Decimal('2.50')}, (decimal.Decimal('3'),)], b'[{"price":"2.50"},["3"]]'),
+  (Price(decimal.Decimal('0.10')), b'{"amount":"0.10"}'),
+]
+
+@pytest.mark.parametrize('name', list(response_serializers.SERIALIZERS))
+@pytest.mark.parametrize('datum, expected', DECIMALS)
+def test_decimals_to_str_agrees(name, datum, expected):
+  if isinstance(datum, Price):
+    datum = dataclasses.asdict(datum)
+
+  assert response_serializers.get(name).dumps(response_serializers.decimals_to_str(datum)) == expected
+
+@pytest.mark.parametrize('name', [name for name in response_serializers.SERIALIZERS if name != 'ujson'])
+@pytest.mark.parametrize('datum, expected', DECIMALS)
+def test_decimals_through_default(name, datum, expected):
+  assert response_serializers.get(name).dumps(datum) == expected
+
+@pytest.mark.parametrize('name', list(response_serializers.SERIALIZERS))
+def test_plain_payload_is_not_walked(name, monkeypatch):
+  def walk(datum):
+    raise AssertionError('walked')
+
+  monkeypatch.setattr(response_serializers, 'decimals_to_str', walk)
+  assert response_serializers.get(name).dumps({'a': [1, 2.5, 'x', None]}) == b'{"a":[1,2.5,"x",null]}'
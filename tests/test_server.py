@@ -0,0 +1,166 @@
+import asyncio
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+import urllib.request
+
+from panic import \
+    datatypes as panic_datatypes, \
+    server as panic_server
+
+APP = textwrap.dedent('''
+  import asyncio
+  import os
+
+  from panic import panic, response, datatypes
+
+  app = panic.Panic(datatypes.ServiceParams())
+  app.router.static('/files', os.path.join(os.path.dirname(__file__), 'files'))
+
+  @app.router.get('/cpu/<n:int>', process=True)
+  def cpu(request, n):
+    return response.text(str(sum(i * i for i in range(n))))
+
+  @app.router.get('/gap/<ms:int>')
+  async def gap(request, ms):
+    async def chunks():
+      yield 'before'
+      await asyncio.sleep(ms / 1000)
+      yield 'after'
+
+    return response.stream(chunks(), content_type='text/plain')
+
+  @app.router.get('/sleep/<ms:int>')
+  async def sleep(request, ms):
+    await asyncio.sleep(ms / 1000)
+    return response.text(f'slept {ms}')
+''')
+
+def _free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1]
+
+def _get(url: str, deadline: float) -> int:
+  while True:
+    try:
+      with urllib.request.urlopen(url, timeout=5) as response:
+        return response.status
+    except urllib.error.HTTPError as err:
+      return err.code
+    except OSError:
+      if time.monotonic() > deadline:
+        raise
+
+      time.sleep(0.1)
+
+@contextlib.contextmanager
+def _serve(tmp_path, workers: int, **environ: str):
+  (tmp_path / 'test_app.py').write_text(APP)
+  (tmp_path / 'files').mkdir(exist_ok=True)
+  port = _free_port()
+  env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmp_path)] + sys.path), **environ)
+  server = subprocess.Popen(
+      [sys.executable, '-m', 'panic', '--workers', str(workers), '--port', str(port), 'test_app.app'],
+      cwd=str(tmp_path), env=env)
+  try:
+    _get(f'http://127.0.0.1:{port}/sleep/0', time.monotonic() + 10)
+    yield port
+
+  finally:
+    server.terminate()
+    server.wait(30)
+
+def _exchange(port: int, payload: bytes) -> bytes:
+  with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+    sock.sendall(payload)
+    received = b''
+    while True:
+      data = sock.recv(2 ** 16)
+      if not data:
+        return received
+
+      received += data
+
+def test_process_pool_with_workers(tmp_path):
+  with _serve(tmp_path, 2) as port:
+    deadline = time.monotonic() + 10
+    statuses = [_get(f'http://127.0.0.1:{port}/cpu/1000', deadline) for _ in range(4)]
+    assert statuses == [200] * 4
+
+def test_parser_error_after_pipelined_request(tmp_path):
+  with _serve(tmp_path, 1) as port:
+    received = _exchange(port, b'GET /sleep/100 HTTP/1.1\r\nHost: x\r\n\r\nBAD \x00 request\r\n\r\n')
+    assert received.startswith(b'HTTP/1.1 200 OK')
+    assert received.index(b'slept 100') < received.index(b'HTTP/1.1 400')
+
+    received = _exchange(port, b'GET /sleep/100 HTTP/1.1\r\nHost: x\r\n\r\nPOST /sleep/1 HTTP/1.1\r\nContent-Length: 999999999999\r\n\r\n')
+    assert received.index(b'slept 100') < received.index(b'HTTP/1.1 413')
+
+def test_slow_file_transfer_outlives_request_timeout(tmp_path):
+  size = 5 * 2 ** 20
+  with _serve(tmp_path, 1, WWW_REQUEST_TIMEOUT='2', WWW_KEEP_ALIVE_TIMEOUT='1') as port:
+    (tmp_path / 'files' / 'big.bin').write_bytes(b'x' * size)
+    with socket.socket() as sock:
+      sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2 ** 14)
+      sock.connect(('127.0.0.1', port))
+      sock.sendall(b'GET /files/big.bin HTTP/1.1\r\nHost: x\r\n\r\n')
+      received = b''
+      while b'\r\n\r\n' not in received:
+        received += sock.recv(2 ** 14)
+
+      head, body = received.split(b'\r\n\r\n', 1)
+      received = len(body)
+      started = time.monotonic()
+      # Reads for about three request timeouts
+      while received < size:
+        data = sock.recv(2 ** 14)
+        assert data, f'closed after {received} bytes'
+        received += len(data)
+        time.sleep(max(0, started + 6 * received / size - time.monotonic()))
+
+    # Idle connections are still reaped after the transfer
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+      assert sock.recv(1) == b''
+
+def test_sweep_survives_a_failing_connection():
+  class Connection:
+    def __init__(self, fails: bool) -> None:
+      self.fails = fails
+      self.checked = 0
+
+    def check_timeout(self, now: float) -> None:
+      self.checked += 1
+      if self.fails:
+        raise RuntimeError('unable to write')
+
+  async def run():
+    params = panic_datatypes.ServerParams()
+    params.loop = asyncio.get_running_loop()
+    params.connections = {Connection(True), Connection(False)}
+    panic_server.sweep_timeouts(params, 0.01)
+    await asyncio.sleep(0.05)
+    return params.connections
+
+  assert all(connection.checked > 1 for connection in asyncio.run(run()))
+
+def test_timeout_in_streamed_body_closes_without_408(tmp_path):
+  with _serve(tmp_path, 1, WWW_REQUEST_TIMEOUT='1') as port:
+    received = _exchange(port, b'GET /gap/4000 HTTP/1.1\r\nHost: x\r\n\r\n')
+    assert received.startswith(b'HTTP/1.1 200 OK') and b'before' in received
+    assert b'408' not in received and b'after' not in received
+
+def test_static_files_are_served_by_their_decoded_path(tmp_path):
+  with _serve(tmp_path, 1) as port:
+    (tmp_path / 'files' / 'name with spaces é.txt').write_bytes(b'inside')
+    (tmp_path / 'secret.txt').write_bytes(b'outside')
+    received = _exchange(port, b'GET /files/name%20with%20spaces%20%C3%A9.txt HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+    assert received.startswith(b'HTTP/1.1 200 OK') and received.endswith(b'inside')
+
+    for path in [b'%2e%2e/secret.txt', b'..%2fsecret.txt', b'%2E%2E%2Fsecret.txt', b'x%00']:
+      received = _exchange(port, b'GET /files/' + path + b' HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+      assert received.startswith(b'HTTP/1.1 404') and b'outside' not in received, path
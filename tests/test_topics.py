@@ -0,0 +1,81 @@
+import asyncio
+
+from panic import \
+    codec as panic_codec, \
+    topics as panic_topics
+from panic.router import \
+    datatypes as router_datatypes
+
+HIGH_WATER = 64
+
+class Transport:
+  def __init__(self) -> None:
+    self.written = bytearray()
+    self.buffered = 0
+
+  def is_closing(self) -> bool:
+    return False
+
+  def write(self, data) -> None:
+    self.written += data
+
+  @property
+  def payloads(self):
+    # Every one byte payload sits behind its two byte frame header
+    return list(self.written[2::3])
+
+  def get_write_buffer_size(self) -> int:
+    return self.buffered
+
+  def get_write_buffer_limits(self):
+    return (HIGH_WATER // 4, HIGH_WATER)
+
+class WebSocket:
+  def __init__(self) -> None:
+    self.failed = None
+
+  def fail_connection(self, code: int, reason: str) -> None:
+    self.failed = code
+
+def _channel(hub, overflow: str):
+  transport = Transport()
+  channel = panic_topics.Channel(hub, WebSocket(), transport, router_datatypes.SocketParams(send_queue=4, overflow=overflow), panic_codec.get('application/octet-stream'))
+  channel.subscribe('t')
+  return channel, transport
+
+def _publish(hub, count: int) -> None:
+  async def publish():
+    for index in range(count):
+      hub.publish('t', bytes([index]))
+
+  asyncio.run(publish())
+
+def test_burst_is_written_not_dropped():
+  hub = panic_topics.TopicHub()
+  channel, transport = _channel(hub, 'drop')
+  _publish(hub, 10)
+  assert transport.payloads == list(range(10))
+  assert channel.dropped == 0
+
+def test_burst_does_not_disconnect():
+  hub = panic_topics.TopicHub()
+  channel, transport = _channel(hub, 'disconnect')
+  _publish(hub, 10)
+  assert not channel.closed and len(transport.payloads) == 10
+
+def test_drop_while_paused():
+  hub = panic_topics.TopicHub()
+  channel, transport = _channel(hub, 'drop')
+  channel.pause()
+  _publish(hub, 10)
+  assert transport.payloads == [] and channel.dropped == 6
+  channel.resume()
+  assert transport.payloads == [6, 7, 8, 9]
+
+def test_disconnect_over_high_water():
+  hub = panic_topics.TopicHub()
+  channel, transport = _channel(hub, 'disconnect')
+  transport.buffered = HIGH_WATER + 1
+  _publish(hub, 10)
+  assert channel.closed and channel.websocket.failed == panic_topics.CLOSE_POLICY_VIOLATION
+  assert hub.topics == {} and hub.disconnected == 1
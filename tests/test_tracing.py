@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import time
+
+from panic import \
+    datatypes as panic_datatypes, \
+    request as panic_request, \
+    response as panic_response, \
+    tracing as panic_tracing
+from panic.server import \
+    protocols as server_protocols
+
+class Transport:
+  def __init__(self) -> None:
+    self.written = []
+
+  def set_write_buffer_limits(self, high: int, low: int) -> None:
+    pass
+
+  def get_extra_info(self, name: str):
+    return None
+
+  def is_closing(self) -> bool:
+    return False
+
+  def write(self, data: bytes) -> None:
+    self.written.append(data)
+
+class RequestHandler:
+  def streams_body(self, request) -> bool:
+    return False
+
+  async def __call__(self, request, respond):
+    await self.slow_handler(0.3 if request.url == '/slow' else 0)
+    respond(panic_response.text('done'))
+
+  async def slow_handler(self, seconds: float) -> None:
+    await asyncio.sleep(seconds)
+
+def _params(tmp_path) -> panic_datatypes.ServiceParams:
+  params = panic_datatypes.ServiceParams()
+  params.trace_threshold = 0.1
+  params.trace_sample_interval = 0.01
+  params.trace_file = str(tmp_path / 'trace.log')
+  return params
+
+def test_slow_request_and_blocked_loop_are_written(tmp_path):
+  tracer = panic_tracing.Tracer(_params(tmp_path))
+
+  async def run():
+    params = panic_datatypes.ServerParams()
+    params.loop = asyncio.get_running_loop()
+    params.connections = set()
+    params.request_handler = RequestHandler()
+    params.tracer = tracer
+    tracer.start(params.loop)
+    protocol = server_protocols.HttpProtocol(params)
+    transport = Transport()
+    protocol.connection_made(transport)
+    protocol.data_received(b'GET /fast HTTP/1.1\r\nHost: x\r\n\r\nGET /slow HTTP/1.1\r\nHost: x\r\n\r\n')
+    while len(transport.written) < 2:
+      await asyncio.sleep(0.01)
+
+    time.sleep(0.3)
+    # The sampler thread writes what the loop queued
+    await asyncio.sleep(0.1)
+
+  try:
+    asyncio.run(run())
+  finally:
+    log = logging.getLogger(f'{panic_tracing.__name__}.{os.getpid()}')
+    for handler in log.handlers[:]:
+      handler.close()
+      log.removeHandler(handler)
+
+  written = (tmp_path / f'trace.{os.getpid()}.log').read_text()
+  assert 'Slow request GET /slow route[None]' in written and '/fast' not in written
+  assert 'parse=' in written and 'write=' in written
+  assert 'Handler stack at 0.1s' in written and 'in slow_handler' in written
+  assert 'Event loop blocked for' in written and 'in run' in written
+
+def test_missing_phases_are_folded_into_the_next(tmp_path):
+  tracer = panic_tracing.Tracer(_params(tmp_path))
+  request = panic_request.Request(b'/missing', panic_datatypes.RequestHeaders(), '1.1', panic_datatypes.HTTPMethod.get)
+  request.timings = {'started': 0.0, 'dispatched': 0.001, 'scheduled': 0.002, 'responded': 0.2, 'written': 0.25}
+  tracer.end(object(), request)
+  assert list(tracer._records) == ['Slow request GET /missing route[None] 250.0ms: parse=1.0ms loop=1.0ms compress=198.0ms write=50.0ms']
+
+  request.timings = {'started': 0.0, 'dispatched': 0.001, 'responded': 0.002, 'written': 0.003}
+  tracer.end(object(), request)
+  assert len(tracer._records) == 1
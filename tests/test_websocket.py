@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+import websockets
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+
+APP = textwrap.dedent('''
+  import asyncio
+  import sys
+
+  from panic import panic, datatypes
+  from panic.server import protocols
+
+  app = panic.Panic(datatypes.ServiceParams())
+
+  @app.router.channel('/echo', socket_encoding='application/json', compression=True, compression_threshold=0)
+  async def echo(request, channel):
+    message = await channel.recv()
+    channel.subscribe('echo')
+    channel.publish('echo', {'echo': message})
+    await asyncio.sleep(0.1)
+
+  app.run(port=int(sys.argv[1]), protocol=protocols.WebSocketProtocol)
+''')
+
+# websockets 8.1 hands loop= to asyncio primitives, which Python 3.10 removed
+pytestmark = pytest.mark.skipif(sys.version_info >= (3, 10), reason='websockets 8.1 requires Python < 3.10')
+
+def _free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1]
+
+async def _connect(url: str, deadline: float):
+  while True:
+    try:
+      return await websockets.connect(url, compression='deflate')
+    except OSError:
+      if time.monotonic() > deadline:
+        raise
+
+      await asyncio.sleep(0.1)
+
+def test_upgrade_negotiates_permessage_deflate(tmp_path):
+  (tmp_path / 'ws_app.py').write_text(APP)
+  port = _free_port()
+  env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmp_path)] + sys.path))
+  server = subprocess.Popen([sys.executable, str(tmp_path / 'ws_app.py'), str(port)], cwd=str(tmp_path), env=env)
+
+  async def exchange():
+    client = await _connect(f'ws://127.0.0.1:{port}/echo', time.monotonic() + 10)
+    try:
+      await client.send(json.dumps({'a': 'x' * 100}))
+      return client.extensions, json.loads(await client.recv())
+    finally:
+      await client.close()
+
+  try:
+    extensions, message = asyncio.run(exchange())
+  finally:
+    server.terminate()
+    server.wait(30)
+
+  assert [type(extension) for extension in extensions] == [PerMessageDeflate]
+  assert message == {'echo': {'a': 'x' * 100}}
@@ -0,0 +1,331 @@
+import asyncio
+import itertools
+import logging
+import struct
+import typing
+import zlib
+
+from collections import deque
+
+from panic import \
+    codec as panic_codec, \
+    response as panic_response
+from panic.router import \
+    datatypes as router_datatypes
+
+logger = logging.getLogger(__name__)
+
+# https://tools.ietf.org/html/rfc6455#section-5.2
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+# https://tools.ietf.org/html/rfc7692#section-7.2.1
+DEFLATE_TAIL = b'\x00\x00\xff\xff'
+# Payloads above this are written next to their frame header instead of being copied behind it
+VECTORED_THRESHOLD = 2 ** 14
+# https://tools.ietf.org/html/rfc6455#section-7.4.1
+CLOSE_POLICY_VIOLATION = 1008
+
+Buffer = typing.Union[bytes, bytearray, memoryview]
+Frame = typing.Tuple[Buffer, ...]
+
+def encode_frame(payload: Buffer, opcode: int = OP_BINARY, rsv1: bool = False) -> Frame:
+  """
+  Unmasked, unfragmented server frame as buffers ready for `response.write_buffers`. `rsv1` marks a
+  permessage-deflate payload.
+  """
+  first = 0x80 | (0x40 if rsv1 else 0) | opcode
+  length = panic_response.body_length(payload)
+  if length < 126:
+    head = struct.pack('!BB', first, length)
+  elif length < 65536:
+    head = struct.pack('!BBH', first, 126, length)
+  else:
+    head = struct.pack('!BBQ', first, 127, length)
+
+  if length < VECTORED_THRESHOLD:
+    return (head + payload,)
+
+  return (head, payload)
+
+def deflate(payload: Buffer, window_bits: int, level: int) -> bytes:
+  """
+  permessage-deflate payload compressed without context takeover
+  """
+  compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits)
+  data = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+  return data[:-4] if data.endswith(DEFLATE_TAIL) else data
+
+class Message:
+  """
+  An object sent to one or many channels. It's encoded once per codec and framed once per codec and
+  deflate setting, every connection asking for the same combination shares those buffers.
+  """
+  datum: typing.Any
+  _encoded: typing.Dict[panic_codec.Codec, typing.Tuple[Buffer, int]]
+  _frames: typing.Dict[typing.Tuple[panic_codec.Codec, typing.Optional[int], int], Frame]
+  __slots__ = ('datum', '_encoded', '_frames')
+
+  def __init__(self, datum: typing.Any) -> None:
+    self.datum = datum
+    self._encoded = {}
+    self._frames = {}
+
+  def encoded(self, codec: panic_codec.Codec) -> typing.Tuple[Buffer, int]:
+    try:
+      return self._encoded[codec]
+    except KeyError:
+      pass
+
+    payload, text = codec.encode(self.datum)
+    if isinstance(payload, memoryview) and payload.format != 'B':
+      payload = payload.cast('B')
+
+    encoded = self._encoded[codec] = (payload, OP_TEXT if text else OP_BINARY)
+    return encoded
+
+  def frame(self, codec: panic_codec.Codec, window_bits: int = None, level: int = -1, threshold: int = 0) -> Frame:
+    """
+    The plain frame, or a deflated one when `window_bits` is given and the payload reaches `threshold`
+    """
+    payload, opcode = self.encoded(codec)
+    if window_bits is not None and panic_response.body_length(payload) < threshold:
+      window_bits = None
+
+    key = (codec, window_bits, level)
+    try:
+      return self._frames[key]
+    except KeyError:
+      pass
+
+    if window_bits is None:
+      frame = encode_frame(payload, opcode)
+    else:
+      frame = encode_frame(deflate(payload, window_bits, level), opcode, rsv1=True)
+
+    self._frames[key] = frame
+    return frame
+
+  def __repr__(self) -> str:
+    return f'Message[{type(self.datum).__name__}]'
+
+class Channel:
+  """
+  A websocket connection on a channel route. Objects are sent and received through the route's
+  codec, buffer payloads go to the transport without being copied. Frames are queued and written
+  together once per loop tick, or as soon as `max_queue` of them are queued. While the transport is
+  paused or over its high-water mark they wait in the queue, and past `max_queue` frames the oldest
+  are dropped or the connection is closed, per `overflow`.
+  When permessage-deflate was negotiated, messages of `compression_threshold` bytes and more are sent
+  deflated. Anything else is delegated to the underlying websocket.
+  """
+  hub: 'TopicHub'
+  websocket: typing.Any
+  transport: asyncio.Transport
+  codec: panic_codec.Codec
+  topics: typing.Set[str]
+  max_queue: int
+  overflow: str
+  window_bits: typing.Optional[int]
+  compression_threshold: int
+  compression_level: int
+  dropped: int
+  closed: bool
+
+  def __init__(self,
+      hub: 'TopicHub',
+      websocket: typing.Any,
+      transport: asyncio.Transport,
+      socket_params: router_datatypes.SocketParams,
+      codec: panic_codec.Codec) -> None:
+    self.hub = hub
+    self.websocket = websocket
+    self.transport = transport
+    self.codec = codec
+    self.topics = set()
+    self.max_queue = max(socket_params.send_queue, 1)
+    self.overflow = socket_params.overflow
+    self.window_bits = None
+    for extension in getattr(websocket, 'extensions', None) or []:
+      if getattr(extension, 'local_no_context_takeover', False):
+        self.window_bits = extension.local_max_window_bits
+
+    self.compression_threshold = socket_params.compression_threshold
+    self.compression_level = socket_params.compression_level
+    self.dropped = 0
+    self.closed = False
+    self._queue = deque()
+    self._scheduled = False
+    self._paused = False
+
+  def subscribe(self, *topics: str) -> None:
+    for topic in topics:
+      self.hub.subscribe(self, topic)
+
+  def unsubscribe(self, *topics: str) -> None:
+    for topic in topics:
+      self.hub.unsubscribe(self, topic)
+
+  def publish(self, topic: str, message: typing.Any) -> int:
+    return self.hub.publish(topic, message)
+
+  async def recv(self) -> typing.Any:
+    return self.codec.decode(await self.websocket.recv())
+
+  async def send(self, message: typing.Any) -> None:
+    self.push(message if isinstance(message, Message) else Message(message))
+
+  def push(self, message: Message) -> bool:
+    """
+    Queues a message's frame, False when it was refused
+    """
+    if self.closed or self.transport.is_closing():
+      return False
+
+    frame = message.frame(self.codec, self.window_bits, self.compression_level, self.compression_threshold)
+
+    if len(self._queue) >= self.max_queue:
+      if not self._backlogged():
+        # A burst queued within one loop tick, the transport takes it right away
+        self._write()
+
+      elif self.overflow == 'disconnect':
+        self.disconnect()
+        return False
+
+      else:
+        self._queue.popleft()
+        self.dropped += 1
+        self.hub.dropped += 1
+
+    self._queue.append(frame)
+    if not self._scheduled and not self._paused:
+      self._scheduled = True
+      asyncio.get_event_loop().call_soon(self.flush)
+
+    return True
+
+  def flush(self) -> None:
+    self._scheduled = False
+    if self._paused or self.closed or not self._queue:
+      return
+
+    self._write()
+
+  def _write(self) -> None:
+    panic_response.write_buffers(self.transport, itertools.chain.from_iterable(self._queue))
+    self._queue.clear()
+
+  def _backlogged(self) -> bool:
+    """
+    Whether the client isn't keeping up: the transport is paused or buffers past its high-water mark
+    """
+    return self._paused or self.transport.get_write_buffer_size() > self.transport.get_write_buffer_limits()[1]
+
+  def pause(self) -> None:
+    self._paused = True
+
+  def resume(self) -> None:
+    self._paused = False
+    self.flush()
+
+  def disconnect(self) -> None:
+    """
+    Closes a consumer that can't keep up, its queued frames are discarded
+    """
+    self.closed = True
+    self.hub.disconnected += 1
+    self.hub.discard(self)
+    self._queue.clear()
+    logger.info(f'{self} is too slow, disconnecting')
+    self.websocket.fail_connection(CLOSE_POLICY_VIOLATION, 'Slow consumer')
+
+  async def close(self) -> None:
+    self.flush()
+    self.closed = True
+    self.hub.discard(self)
+    await self.websocket.close()
+
+  def __getattr__(self, name: str) -> typing.Any:
+    return getattr(self.websocket, name)
+
+  def __repr__(self) -> str:
+    return f'Channel[{len(self.topics)}:{len(self._queue)}/{self.max_queue}]'
+
+class TopicHub:
+  """
+  Topic subscriptions of the channels connected to this worker. A published message is encoded once
+  and the same frame buffers are queued on every subscriber.
+  """
+  topics: typing.Dict[str, typing.Set[Channel]]
+  published: int
+  delivered: int
+  dropped: int
+  disconnected: int
+
+  def __init__(self) -> None:
+    self.topics = {}
+    self.published = 0
+    self.delivered = 0
+    self.dropped = 0
+    self.disconnected = 0
+
+  def channel(self,
+      websocket: typing.Any,
+      transport: asyncio.Transport,
+      socket_params: router_datatypes.SocketParams,
+      codec: panic_codec.Codec) -> Channel:
+    channel = Channel(self, websocket, transport, socket_params, codec)
+    # The protocol forwards pause_writing/resume_writing to the channel
+    transport.get_protocol().channel = channel
+    return channel
+
+  def subscribe(self, channel: Channel, topic: str) -> None:
+    self.topics.setdefault(topic, set()).add(channel)
+    channel.topics.add(topic)
+
+  def unsubscribe(self, channel: Channel, topic: str) -> None:
+    subscribers = self.topics.get(topic)
+    if subscribers is not None:
+      subscribers.discard(channel)
+      if not subscribers:
+        del self.topics[topic]
+
+    channel.topics.discard(topic)
+
+  def discard(self, channel: Channel) -> None:
+    for topic in list(channel.topics):
+      self.unsubscribe(channel, topic)
+
+  def publish(self, topic: str, message: typing.Any) -> int:
+    """
+    Queues `message` on every subscriber of `topic`, returns how many accepted it
+    """
+    subscribers = self.topics.get(topic)
+    self.published += 1
+    if not subscribers:
+      return 0
+
+    if not isinstance(message, Message):
+      message = Message(message)
+
+    delivered = 0
+    # A slow consumer leaves the topic when it's disconnected
+    for channel in list(subscribers):
+      if channel.push(message):
+        delivered += 1
+
+    self.delivered += delivered
+    return delivered
+
+  def stats(self) -> typing.Dict[str, int]:
+    return {
+      'topics': len(self.topics),
+      'subscriptions': sum(len(subscribers) for subscribers in self.topics.values()),
+      'published': self.published,
+      'delivered': self.delivered,
+      'dropped': self.dropped,
+      'disconnected': self.disconnected,
+    }
+
+  def __repr__(self) -> str:
+    return f'TopicHub[{len(self.topics)}]'
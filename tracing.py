@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import logging.handlers
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+import typing
+
+from collections import Counter, deque
+
+from panic import \
+    datatypes as panic_datatypes
+
+logger = logging.getLogger(__name__)
+
+# Phases of a traced request, each one ends at its mark in `Request.timings`. A phase whose mark is
+# missing, the handler of a NotFound for one, is folded into the next.
+PHASES = (
+  ('parse', 'dispatched'),
+  ('loop', 'scheduled'),
+  ('route', 'routed'),
+  ('handler', 'handled'),
+  ('compress', 'responded'),
+  ('queue', 'writing'),
+  ('write', 'written'),
+)
+# Hot frames are attributed to the innermost frame outside of the standard library
+STDLIB = tuple({sysconfig.get_paths()['stdlib'], sysconfig.get_paths()['platstdlib']})
+SITE = tuple({sysconfig.get_paths()['purelib'], sysconfig.get_paths()['platlib']})
+HOT_FRAMES = 10
+
+def _format_stack(frame: typing.Any) -> str:
+  return ''.join(traceback.format_stack(frame))
+
+def _task_stack(task: asyncio.Task) -> str:
+  """
+  Stack of a suspended task, following the chain of awaited coroutines down to the handler's own frames
+  """
+  frames = []
+  awaitable = task.get_coro()
+  while awaitable is not None:
+    frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'ag_frame', None) or getattr(awaitable, 'gi_frame', None)
+    if frame is not None:
+      frames.append((frame, frame.f_lineno))
+
+    awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'ag_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+
+  return ''.join(traceback.StackSummary.extract(frames).format())
+
+def _hot_frame(frame: typing.Any) -> typing.Optional[str]:
+  while frame is not None:
+    filename = frame.f_code.co_filename
+    if not filename.startswith(STDLIB) or filename.startswith(SITE):
+      return f'{frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}'
+
+    frame = frame.f_back
+
+  return None
+
+class Tracer:
+  """
+  Slow-request tracer of one worker. Requests taking longer than `threshold` are written with the time
+  spent in each phase and their handler's stack, read while they were still running. A sampler thread
+  wakes every `interval` to note where the event loop and the pool handlers are, logs the loop's stack
+  when it hasn't ticked for `threshold` and writes the loop lag and hottest frames every
+  `report_interval`. Everything is written to a rotating file by the sampler thread, the event loop
+  only appends to a deque.
+  """
+  threshold: float
+  interval: float
+  report_interval: float
+  path: str
+  max_bytes: int
+  backup_count: int
+  inflight: typing.Dict[typing.Any, asyncio.Task]
+  threads: typing.Set[int]
+  hot: Counter
+  samples: int
+  lag_max: float
+  lag_total: float
+  ticks: int
+
+  def __init__(self, params: panic_datatypes.ServiceParams) -> None:
+    self.threshold = params.trace_threshold
+    self.interval = params.trace_sample_interval
+    self.report_interval = params.trace_report_interval
+    self.path = params.trace_file
+    self.max_bytes = params.trace_file_size
+    self.backup_count = params.trace_file_count
+    self.inflight = {}
+    self.threads = set()
+    self.hot = Counter()
+    self.samples = 0
+    self.lag_max = 0.0
+    self.lag_total = 0.0
+    self.ticks = 0
+    self._records = deque()
+    self._loop = None
+    self._loop_thread = None
+    self._heartbeat = None
+    self._expected = None
+    self._stalled = False
+    self._log = None
+
+  def start(self, loop: asyncio.AbstractEventLoop) -> None:
+    """
+    Starts sampling `loop`, from the thread running it. Each worker writes its own file.
+    """
+    base, extension = os.path.splitext(self.path)
+    handler = logging.handlers.RotatingFileHandler(f'{base}.{os.getpid()}{extension}', maxBytes=self.max_bytes, backupCount=self.backup_count)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    self._log = logging.getLogger(f'{__name__}.{os.getpid()}')
+    self._log.propagate = False
+    self._log.setLevel(logging.INFO)
+    self._log.addHandler(handler)
+
+    self._loop = loop
+    self._loop_thread = threading.get_ident()
+    self._heartbeat = self._expected = time.perf_counter()
+    loop.call_soon(self._tick)
+    threading.Thread(target=self._sample, name='panic-tracer', daemon=True).start()
+
+  # -------------------------------------------- #
+  # Requests, called from the event loop
+  # -------------------------------------------- #
+
+  def begin(self, slot: typing.Any) -> None:
+    self.inflight[slot] = slot.task
+
+  def discard(self, slot: typing.Any) -> None:
+    self.inflight.pop(slot, None)
+
+  def end(self, slot: typing.Any, request: typing.Any) -> None:
+    self.inflight.pop(slot, None)
+    timings = request.timings
+    elapsed = timings['written'] - timings['started']
+    if elapsed < self.threshold:
+      return None
+
+    mark = timings['started']
+    phases = []
+    for phase, key in PHASES:
+      if key in timings:
+        phases.append(f'{phase}={(timings[key] - mark) * 1000:.1f}ms')
+        mark = timings[key]
+
+    lines = [f'Slow request {request.method.name.upper()} {request.url} route[{request.route}] {elapsed * 1000:.1f}ms: {" ".join(phases)}']
+    stack = timings.get('stack')
+    if stack:
+      lines.append(f'Handler stack at {self.threshold}s:\n{stack.rstrip()}')
+
+    self._records.append('\n'.join(lines))
+
+  def in_thread(self, _handler: panic_datatypes.FunctionType, request: typing.Any, **parameters: typing.Any) -> typing.Any:
+    """
+    Runs a thread pool handler, noting its thread so the sampler and `_capture` can read its frames
+    """
+    ident = threading.get_ident()
+    request.timings['thread'] = ident
+    self.threads.add(ident)
+    try:
+      return _handler(request, **parameters)
+    finally:
+      self.threads.discard(ident)
+      del request.timings['thread']
+
+  def _capture(self) -> None:
+    """
+    Reads the stack of handlers running past the threshold, once per request
+    """
+    now = time.perf_counter()
+    frames = None
+    for slot, task in self.inflight.items():
+      request = slot.request
+      if request is None:
+        continue
+
+      timings = request.timings
+      if 'stack' in timings or 'responded' in timings or now - timings['started'] < self.threshold:
+        continue
+
+      thread = timings.get('thread')
+      if thread is not None:
+        # A pool handler, its coroutine only shows the await on the executor
+        frames = sys._current_frames() if frames is None else frames
+        frame = frames.get(thread)
+        timings['stack'] = _format_stack(frame) if frame is not None else ''
+
+      elif task is not None:
+        timings['stack'] = _task_stack(task)
+
+  def _tick(self) -> None:
+    now = time.perf_counter()
+    lag = max(now - self._expected, 0.0)
+    self.lag_max = max(self.lag_max, lag)
+    self.lag_total += lag
+    self.ticks += 1
+    self._heartbeat = now
+    if self.inflight:
+      self._capture()
+
+    self._expected = now + self.interval
+    self._loop.call_later(self.interval, self._tick)
+
+  # -------------------------------------------- #
+  # Sampler thread
+  # -------------------------------------------- #
+
+  def _sample(self) -> None:
+    reported = time.perf_counter()
+    while not self._loop.is_closed():
+      time.sleep(self.interval)
+      now = time.perf_counter()
+      frames = sys._current_frames()
+      loop_frame = frames.get(self._loop_thread)
+
+      blocked = now - self._heartbeat
+      if blocked > self.threshold and not self._stalled and loop_frame is not None:
+        self._stalled = True
+        self._records.append(f'Event loop blocked for {blocked * 1000:.1f}ms at:\n{_format_stack(loop_frame).rstrip()}')
+
+      elif blocked <= self.interval * 2:
+        self._stalled = False
+
+      self.samples += 1
+      for ident in [self._loop_thread, *self.threads.copy()]:
+        frame = frames.get(ident)
+        if frame is None or (ident == self._loop_thread and frame.f_code.co_name == 'select'):
+          # The loop is idle, waiting on its selector
+          continue
+
+        hot = _hot_frame(frame)
+        if hot is not None:
+          self.hot[hot] += 1
+
+      while self._records:
+        self._log.info(self._records.popleft())
+
+      if now - reported >= self.report_interval:
+        self._report(now - reported)
+        reported = now
+
+  def _report(self, elapsed: float) -> None:
+    ticks, lag_max, lag_total, hot, samples = self.ticks, self.lag_max, self.lag_total, self.hot, self.samples
+    self.ticks, self.lag_max, self.lag_total, self.hot, self.samples = 0, 0.0, 0.0, Counter(), 0
+    lines = [f'Loop lag over {elapsed:.0f}s: mean={lag_total / ticks * 1000 if ticks else 0.0:.2f}ms max={lag_max * 1000:.2f}ms, {samples} samples']
+    for frame, count in hot.most_common(HOT_FRAMES):
+      lines.append(f'  {count / samples * 100 if samples else 0.0:5.1f}% {frame}')
+
+    self._log.info('\n'.join(lines))
+
+  def __repr__(self) -> str:
+    return f'Tracer[{self.threshold}s:{len(self.inflight)}]'